@@ -0,0 +1,604 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.io.Writer;
+import java.lang.reflect.Array;
+import java.lang.reflect.InvocationHandler;
+import java.lang.reflect.Method;
+import java.lang.reflect.Proxy;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Comparator;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Locale;
+import java.util.Map;
+import java.util.Optional;
+import java.util.stream.Collectors;
+import java.util.stream.Stream;
+import javax.tools.Diagnostic;
+import javax.tools.DiagnosticCollector;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+
+/**
+ * the test runner of one maven module that eval/jvm_server.py starts and talks to.
+ * it holds the test classpath of the module and the compiled main and test classes of the module, a copy
+ * taken on the clean tree.
+ * a request compiles the patched sources into a scratch directory, loads them with the test and main
+ * classes of the module in a fresh class loader on top of a fresh one of the dependencies, runs the
+ * selected junit 5 or junit 4 tests and answers with a log like the one of `mvn test`. the surefire xml
+ * reports are written too, so the results read the same as the ones of maven. the class loaders are
+ * closed after the request, no static state of a library or a test framework, e.g. a cached spring
+ * context, is left for the next one.
+ * a request is a few lines on a loopback socket: "timeout <seconds>", "source <path>" and
+ * "test <Class[#method+method]>" lines and "end", the answer one json line.
+ * it needs a jdk 16 or later, it is run from source by the java launcher.
+ * usage: java JvmTestServer.java <module dir> <classpath file> <port file> <classes dir> <test classes dir>
+ */
+public class JvmTestServer {
+    static final int MAX_OUTPUT = 1 << 20;
+
+    final Path moduleDir;
+    final Path classesDir;
+    final Path testClassesDir;
+    final String compileClasspath;
+    final URL[] dependencyUrls;
+    final PrintStream systemOut = System.out;
+    final PrintStream systemErr = System.err;
+
+    JvmTestServer(Path moduleDir, Path classpathFile, Path classesDir, Path testClassesDir) throws IOException {
+        this.moduleDir = moduleDir;
+        this.classesDir = classesDir;
+        this.testClassesDir = testClassesDir;
+        String classpath = new String(Files.readAllBytes(classpathFile), StandardCharsets.UTF_8).trim();
+        List<URL> urls = new ArrayList<>();
+        List<String> entries = new ArrayList<>(Arrays.asList(classesDir.toString(), testClassesDir.toString()));
+        for (String entry : classpath.split(File.pathSeparator)) {
+            if (!entry.isEmpty()) {
+                urls.add(Paths.get(entry).toUri().toURL());
+                entries.add(entry);
+            }
+        }
+        this.compileClasspath = String.join(File.pathSeparator, entries);
+        this.dependencyUrls = urls.toArray(new URL[0]);
+    }
+
+    public static void main(String[] args) throws Exception {
+        JvmTestServer server = new JvmTestServer(Paths.get(args[0]).toAbsolutePath(), Paths.get(args[1]),
+                Paths.get(args[3]).toAbsolutePath(), Paths.get(args[4]).toAbsolutePath());
+        System.setProperty("basedir", server.moduleDir.toString());
+        server.serve(Paths.get(args[2]));
+    }
+
+    void serve(Path portFile) throws IOException {
+        try (ServerSocket serverSocket = new ServerSocket(0, 50, InetAddress.getLoopbackAddress())) {
+            // the port file appears complete or not at all
+            Path tmp = Paths.get(portFile + ".tmp");
+            Files.write(tmp, String.valueOf(serverSocket.getLocalPort()).getBytes(StandardCharsets.UTF_8));
+            Files.move(tmp, portFile, StandardCopyOption.ATOMIC_MOVE);
+            while (true) {
+                try (Socket socket = serverSocket.accept()) {
+                    BufferedReader in = new BufferedReader(new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+                    Request request = Request.read(in);
+                    Run run = new Run(request);
+                    Thread thread = new Thread(run::execute, "jvm-test-server-run");
+                    thread.setDaemon(true);
+                    thread.start();
+                    thread.join((long) (request.timeout * 1000));
+                    boolean timedOut = thread.isAlive();
+                    String response = timedOut ? "{\"timeout\": true}" : run.response();
+                    Writer out = new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8);
+                    out.write(response + "\n");
+                    out.flush();
+                    if (timedOut) {
+                        // the tests are still running and can not be stopped, the client starts a new server
+                        socket.close();
+                        Runtime.getRuntime().halt(0);
+                    }
+                } catch (InterruptedException e) {
+                    return;
+                }
+            }
+        }
+    }
+
+    static class Request {
+        double timeout = 40;
+        final List<Path> sources = new ArrayList<>();
+        final List<String> tests = new ArrayList<>();
+
+        static Request read(BufferedReader in) throws IOException {
+            Request request = new Request();
+            String line;
+            while ((line = in.readLine()) != null && !line.equals("end")) {
+                int space = line.indexOf(' ');
+                if (space < 0) {
+                    continue;
+                }
+                String key = line.substring(0, space);
+                String value = line.substring(space + 1);
+                if (key.equals("timeout")) {
+                    request.timeout = Double.parseDouble(value);
+                } else if (key.equals("source")) {
+                    request.sources.add(Paths.get(value));
+                } else if (key.equals("test")) {
+                    request.tests.add(value);
+                }
+            }
+            return request;
+        }
+    }
+
+    /** the outcome of a test as surefire reports it: passed, failed, error or skipped */
+    static class TestResult {
+        final String className;
+        final String name;
+        final String outcome;
+        final double seconds;
+        final Throwable throwable;
+
+        TestResult(String className, String name, String outcome, double seconds, Throwable throwable) {
+            this.className = className;
+            this.name = name;
+            this.outcome = outcome;
+            this.seconds = seconds;
+            this.throwable = throwable;
+        }
+    }
+
+    /** an output stream that keeps the first MAX_OUTPUT bytes */
+    static class BoundedOutput extends OutputStream {
+        final ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+
+        @Override
+        public synchronized void write(int b) {
+            if (buffer.size() < MAX_OUTPUT) {
+                buffer.write(b);
+            }
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            buffer.write(b, off, Math.max(0, Math.min(len, MAX_OUTPUT - buffer.size())));
+        }
+
+        @Override
+        public synchronized String toString() {
+            return new String(buffer.toByteArray(), StandardCharsets.UTF_8);
+        }
+    }
+
+    class Run {
+        final Request request;
+        final StringBuilder log = new StringBuilder();
+        final Map<String, List<TestResult>> results = new LinkedHashMap<>();
+        String unsupported;
+
+        Run(Request request) {
+            this.request = request;
+        }
+
+        void execute() {
+            Path scratch = null;
+            try {
+                scratch = Files.createTempDirectory("jvm_test_server_");
+                if (!request.sources.isEmpty() && !compile(scratch)) {
+                    log.append("[INFO] BUILD FAILURE\n");
+                    return;
+                }
+                URL[] urls = {scratch.toUri().toURL(), testClassesDir.toUri().toURL(), classesDir.toUri().toURL()};
+                try (URLClassLoader dependencyLoader = new URLClassLoader(dependencyUrls, ClassLoader.getPlatformClassLoader());
+                     URLClassLoader loader = new URLClassLoader(urls, dependencyLoader)) {
+                    runTests(loader);
+                }
+            } catch (Throwable e) {
+                unsupported = "server error: " + e;
+            } finally {
+                if (scratch != null) {
+                    deleteTree(scratch);
+                }
+            }
+        }
+
+        boolean compile(Path scratch) throws IOException {
+            JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+            DiagnosticCollector<JavaFileObject> diagnostics = new DiagnosticCollector<>();
+            Path generated = Files.createDirectories(scratch.resolve("generated-sources"));
+            try (StandardJavaFileManager files = compiler.getStandardFileManager(diagnostics, null, StandardCharsets.UTF_8)) {
+                List<File> sources = request.sources.stream().map(Path::toFile).collect(Collectors.toList());
+                // annotation processors such as lombok are found on the classpath, like maven does
+                List<String> options = Arrays.asList("-d", scratch.toString(), "-s", generated.toString(),
+                        "-classpath", compileClasspath, "-processorpath", compileClasspath,
+                        "-implicit:none", "-nowarn", "-encoding", "UTF-8", "-parameters");
+                boolean ok = compiler.getTask(null, files, diagnostics, options, null,
+                        files.getJavaFileObjectsFromFiles(sources)).call();
+                if (!ok) {
+                    log.append("[ERROR] COMPILATION ERROR : \n");
+                    for (Diagnostic<? extends JavaFileObject> d : diagnostics.getDiagnostics()) {
+                        if (d.getKind() == Diagnostic.Kind.ERROR) {
+                            String source = d.getSource() == null ? "" : d.getSource().getName();
+                            log.append("[ERROR] ").append(source).append(":[").append(d.getLineNumber()).append(',')
+                                    .append(d.getColumnNumber()).append("] ").append(d.getMessage(null)).append('\n');
+                        }
+                    }
+                }
+                return ok;
+            }
+        }
+
+        void runTests(ClassLoader loader) throws Exception {
+            boolean platform = loadable(loader, "org.junit.platform.launcher.core.LauncherFactory");
+            if (!platform && !loadable(loader, "org.junit.runner.JUnitCore")) {
+                unsupported = "no junit platform launcher or junit 4 on the test classpath";
+                return;
+            }
+            int run = 0, failures = 0, errors = 0, skipped = 0;
+            Thread thread = Thread.currentThread();
+            ClassLoader contextLoader = thread.getContextClassLoader();
+            for (String test : request.tests) {
+                String pattern = test.contains("#") ? test.substring(0, test.indexOf('#')) : test;
+                List<String> methods = test.contains("#")
+                        ? Arrays.asList(test.substring(test.indexOf('#') + 1).split("\\+")) : new ArrayList<>();
+                List<String> classNames = findTestClasses(pattern);
+                if (classNames.isEmpty()) {
+                    log.append("[ERROR] No tests matching pattern \"").append(test).append("\" were executed!\n");
+                    log.append("[INFO] BUILD FAILURE\n");
+                    return;
+                }
+                for (String className : classNames) {
+                    BoundedOutput output = new BoundedOutput();
+                    PrintStream capture = new PrintStream(output, true, "UTF-8");
+                    List<TestResult> classResults = new ArrayList<>();
+                    long start = System.nanoTime();
+                    thread.setContextClassLoader(loader);
+                    System.setOut(capture);
+                    System.setErr(capture);
+                    try {
+                        Class<?> testClass = Class.forName(className, false, loader);
+                        if (platform) {
+                            runPlatform(loader, testClass, methods, classResults);
+                        } else {
+                            runJUnit4(loader, testClass, methods, classResults);
+                        }
+                    } finally {
+                        System.setOut(systemOut);
+                        System.setErr(systemErr);
+                        thread.setContextClassLoader(contextLoader);
+                    }
+                    double seconds = (System.nanoTime() - start) / 1e9;
+                    results.put(className, classResults);
+                    int classFailures = count(classResults, "failed"), classErrors = count(classResults, "error");
+                    int classSkipped = count(classResults, "skipped");
+                    run += classResults.size();
+                    failures += classFailures;
+                    errors += classErrors;
+                    skipped += classSkipped;
+                    log.append("[INFO] Running ").append(className).append('\n').append(output);
+                    boolean failed = classFailures + classErrors > 0;
+                    log.append(failed ? "[ERROR] " : "[INFO] ").append(String.format(Locale.ROOT,
+                            "Tests run: %d, Failures: %d, Errors: %d, Skipped: %d, Time elapsed: %.3f s",
+                            classResults.size(), classFailures, classErrors, classSkipped, seconds))
+                            .append(failed ? " <<< FAILURE! - in " : " - in ").append(className).append('\n');
+                    for (TestResult result : classResults) {
+                        if (result.outcome.equals("failed") || result.outcome.equals("error")) {
+                            log.append("[ERROR] ").append(result.className).append('.').append(result.name)
+                                    .append(result.outcome.equals("failed") ? "  <<< FAILURE!\n" : "  <<< ERROR!\n")
+                                    .append(trace(result.throwable, 20));
+                        }
+                    }
+                    writeReport(className, classResults, seconds, output.toString());
+                }
+            }
+            boolean failed = failures + errors > 0 || run == 0 || run == skipped;
+            log.append("[INFO] Results:\n").append(failed ? "[ERROR] " : "[INFO] ")
+                    .append(String.format("Tests run: %d, Failures: %d, Errors: %d, Skipped: %d\n", run, failures, errors, skipped))
+                    .append(failed ? "[INFO] BUILD FAILURE\n" : "[INFO] BUILD SUCCESS\n");
+        }
+
+        /** the test classes whose simple name or fully qualified name is pattern, as surefire's -Dtest matches them */
+        List<String> findTestClasses(String pattern) throws IOException {
+            if (!Files.isDirectory(testClassesDir)) {
+                return new ArrayList<>();
+            }
+            String simpleName = pattern.substring(pattern.lastIndexOf('.') + 1);
+            try (Stream<Path> paths = Files.walk(testClassesDir)) {
+                return paths.filter(p -> p.getFileName().toString().equals(simpleName + ".class"))
+                        .map(p -> testClassesDir.relativize(p).toString().replace(File.separatorChar, '.'))
+                        .map(name -> name.substring(0, name.length() - ".class".length()))
+                        .filter(name -> !pattern.contains(".") || name.equals(pattern))
+                        .sorted()
+                        .collect(Collectors.toList());
+            }
+        }
+
+        /** junit 5 through the launcher api of the class loader, which the server is not compiled against */
+        void runPlatform(ClassLoader loader, Class<?> testClass, List<String> methods, List<TestResult> classResults)
+                throws Exception {
+            Class<?> selectors = loader.loadClass("org.junit.platform.engine.discovery.DiscoverySelectors");
+            Class<?> builderClass = loader.loadClass("org.junit.platform.launcher.core.LauncherDiscoveryRequestBuilder");
+            Class<?> filterClass = loader.loadClass("org.junit.platform.engine.Filter");
+            Class<?> postDiscoveryFilter = loader.loadClass("org.junit.platform.launcher.PostDiscoveryFilter");
+            Class<?> filterResult = loader.loadClass("org.junit.platform.engine.FilterResult");
+            Class<?> listenerClass = loader.loadClass("org.junit.platform.launcher.TestExecutionListener");
+            Class<?> launcherClass = loader.loadClass("org.junit.platform.launcher.Launcher");
+            Class<?> requestClass = loader.loadClass("org.junit.platform.launcher.LauncherDiscoveryRequest");
+
+            Object builder = builderClass.getMethod("request").invoke(null);
+            Object selector = selectors.getMethod("selectClass", Class.class).invoke(null, testClass);
+            builderClass.getMethod("selectors", List.class).invoke(builder, Arrays.asList(selector));
+            if (!methods.isEmpty()) {
+                // a method filter instead of method selectors, which need the parameter types of parameterized tests
+                Method includedIf = filterResult.getMethod("includedIf", boolean.class);
+                InvocationHandler filter = (proxy, method, args) -> {
+                    if (method.getDeclaringClass() == Object.class) {
+                        return objectMethod(proxy, method, args);
+                    }
+                    if (!method.getName().equals("apply")) {
+                        return method.isDefault() ? InvocationHandler.invokeDefault(proxy, method, args) : null;
+                    }
+                    Object source = ((Optional<?>) call(args[0], "getSource")).orElse(null);
+                    boolean included = source == null || !isMethodSource(source)
+                            || methods.contains((String) call(source, "getMethodName"));
+                    return includedIf.invoke(null, included);
+                };
+                Object filters = Array.newInstance(filterClass, 1);
+                Array.set(filters, 0, Proxy.newProxyInstance(loader, new Class<?>[]{postDiscoveryFilter}, filter));
+                builderClass.getMethod("filters", filters.getClass()).invoke(builder, filters);
+            }
+            Object discoveryRequest = builderClass.getMethod("build").invoke(builder);
+
+            Map<Object, Long> starts = new LinkedHashMap<>();
+            InvocationHandler listener = (proxy, method, args) -> {
+                if (method.getDeclaringClass() == Object.class) {
+                    return objectMethod(proxy, method, args);
+                }
+                if (method.getName().equals("executionStarted")) {
+                    starts.put(args[0], System.nanoTime());
+                } else if (method.getName().equals("executionSkipped")) {
+                    if ((Boolean) call(args[0], "isTest")) {
+                        classResults.add(platformResult(args[0], "skipped", 0, null));
+                    }
+                } else if (method.getName().equals("executionFinished")) {
+                    Long start = starts.remove(args[0]);
+                    double seconds = start == null ? 0 : (System.nanoTime() - start) / 1e9;
+                    String status = call(args[1], "getStatus").toString();
+                    Throwable throwable = (Throwable) ((Optional<?>) call(args[1], "getThrowable")).orElse(null);
+                    boolean isTest = (Boolean) call(args[0], "isTest");
+                    if (isTest || status.equals("FAILED")) {
+                        // a failing container, e.g. a @BeforeAll that throws, is an error of the class
+                        String outcome = status.equals("SUCCESSFUL") ? "passed" : status.equals("ABORTED") ? "skipped"
+                                : throwable instanceof AssertionError ? "failed" : "error";
+                        classResults.add(platformResult(args[0], isTest ? outcome : "error", seconds, throwable));
+                    }
+                } else if (method.isDefault()) {
+                    return InvocationHandler.invokeDefault(proxy, method, args);
+                }
+                return null;
+            };
+            Object listeners = Array.newInstance(listenerClass, 1);
+            Array.set(listeners, 0, Proxy.newProxyInstance(loader, new Class<?>[]{listenerClass}, listener));
+            Object launcher = loader.loadClass("org.junit.platform.launcher.core.LauncherFactory").getMethod("create").invoke(null);
+            launcherClass.getMethod("execute", requestClass, listeners.getClass()).invoke(launcher, discoveryRequest, listeners);
+        }
+
+        TestResult platformResult(Object identifier, String outcome, double seconds, Throwable throwable) throws Exception {
+            Object source = ((Optional<?>) call(identifier, "getSource")).orElse(null);
+            String reportingName = (String) call(identifier, "getLegacyReportingName");
+            if (source != null && isMethodSource(source)) {
+                String methodName = (String) call(source, "getMethodName");
+                // surefire names a plain test by its method, an invocation of a parameterized one by its reporting name
+                String name = reportingName.equals(methodName + "()") ? methodName : reportingName;
+                return new TestResult((String) call(source, "getClassName"), name, outcome, seconds, throwable);
+            }
+            String className = source != null && source.getClass().getSimpleName().equals("ClassSource")
+                    ? (String) call(source, "getClassName") : reportingName;
+            return new TestResult(className, reportingName, outcome, seconds, throwable);
+        }
+
+        /** junit 4 through JUnitCore, the tests are the leaves of the description of the request */
+        void runJUnit4(ClassLoader loader, Class<?> testClass, List<String> methods, List<TestResult> classResults)
+                throws Exception {
+            Class<?> requestClass = loader.loadClass("org.junit.runner.Request");
+            Class<?> coreClass = loader.loadClass("org.junit.runner.JUnitCore");
+            @SuppressWarnings("unchecked")
+            Class<? extends java.lang.annotation.Annotation> ignore =
+                    (Class<? extends java.lang.annotation.Annotation>) loader.loadClass("org.junit.Ignore");
+            List<Object> requests = new ArrayList<>();
+            if (methods.isEmpty()) {
+                requests.add(requestClass.getMethod("aClass", Class.class).invoke(null, testClass));
+            } else {
+                for (String method : methods) {
+                    requests.add(requestClass.getMethod("method", Class.class, String.class).invoke(null, testClass, method));
+                }
+            }
+            for (Object request : requests) {
+                Object runner = requestClass.getMethod("getRunner").invoke(request);
+                List<Object> leaves = new ArrayList<>();
+                collectLeaves(call(runner, "getDescription"), leaves);
+                long start = System.nanoTime();
+                Object core = coreClass.getConstructor().newInstance();
+                Object result = coreClass.getMethod("run", requestClass).invoke(core, request);
+                double seconds = (System.nanoTime() - start) / 1e9 / Math.max(leaves.size(), 1);
+                Map<String, Throwable> failed = new LinkedHashMap<>();
+                for (Object failure : (List<?>) call(result, "getFailures")) {
+                    Object description = call(failure, "getDescription");
+                    failed.put(call(description, "getClassName") + "#" + call(description, "getMethodName"),
+                            (Throwable) call(failure, "getException"));
+                }
+                for (Object leaf : leaves) {
+                    String className = (String) call(leaf, "getClassName");
+                    String methodName = (String) call(leaf, "getMethodName");
+                    Throwable throwable = failed.remove(className + "#" + methodName);
+                    Method getAnnotation = leaf.getClass().getMethod("getAnnotation", Class.class);
+                    String outcome = throwable != null ? (throwable instanceof AssertionError ? "failed" : "error")
+                            : getAnnotation.invoke(leaf, ignore) != null ? "skipped" : "passed";
+                    classResults.add(new TestResult(className, methodName, outcome, seconds, throwable));
+                }
+                // failures of the class itself, e.g. a @BeforeClass that throws
+                for (Map.Entry<String, Throwable> entry : failed.entrySet()) {
+                    String className = entry.getKey().substring(0, entry.getKey().indexOf('#'));
+                    classResults.add(new TestResult(className, className, "error", 0, entry.getValue()));
+                }
+            }
+        }
+
+        void collectLeaves(Object description, List<Object> leaves) throws Exception {
+            if ((Boolean) call(description, "isTest")) {
+                leaves.add(description);
+                return;
+            }
+            for (Object child : (List<?>) call(description, "getChildren")) {
+                collectLeaves(child, leaves);
+            }
+        }
+
+        void writeReport(String className, List<TestResult> classResults, double seconds, String output) throws IOException {
+            Path reportDir = Files.createDirectories(moduleDir.resolve("target").resolve("surefire-reports"));
+            StringBuilder xml = new StringBuilder("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n");
+            xml.append(String.format(Locale.ROOT, "<testsuite name=\"%s\" time=\"%.3f\" tests=\"%d\" errors=\"%d\" skipped=\"%d\" failures=\"%d\">\n",
+                    xmlEscape(className), seconds, classResults.size(), count(classResults, "error"),
+                    count(classResults, "skipped"), count(classResults, "failed")));
+            for (TestResult result : classResults) {
+                xml.append(String.format(Locale.ROOT, "  <testcase name=\"%s\" classname=\"%s\" time=\"%.3f\"",
+                        xmlEscape(result.name), xmlEscape(result.className), result.seconds));
+                if (result.outcome.equals("passed")) {
+                    xml.append("/>\n");
+                    continue;
+                }
+                xml.append(">\n");
+                if (result.outcome.equals("skipped")) {
+                    xml.append("    <skipped/>\n");
+                } else {
+                    String tag = result.outcome.equals("failed") ? "failure" : "error";
+                    String message = result.throwable == null || result.throwable.getMessage() == null
+                            ? "" : result.throwable.getMessage();
+                    String type = result.throwable == null ? "" : result.throwable.getClass().getName();
+                    xml.append(String.format("    <%s message=\"%s\" type=\"%s\">%s</%s>\n", tag, xmlEscape(message),
+                            xmlEscape(type), xmlEscape(trace(result.throwable, 50)), tag));
+                }
+                xml.append("  </testcase>\n");
+            }
+            xml.append("  <system-out>").append(xmlEscape(output)).append("</system-out>\n</testsuite>\n");
+            Files.write(reportDir.resolve("TEST-" + className + ".xml"), xml.toString().getBytes(StandardCharsets.UTF_8));
+        }
+
+        String response() {
+            StringBuilder json = new StringBuilder("{\"timeout\": false, ");
+            if (unsupported != null) {
+                json.append("\"unsupported\": ").append(jsonString(unsupported)).append(", ");
+            }
+            return json.append("\"log\": ").append(jsonString(log.toString())).append("}").toString();
+        }
+    }
+
+    static boolean loadable(ClassLoader loader, String name) {
+        try {
+            loader.loadClass(name);
+            return true;
+        } catch (ClassNotFoundException | LinkageError e) {
+            return false;
+        }
+    }
+
+    static boolean isMethodSource(Object source) {
+        return source.getClass().getName().equals("org.junit.platform.engine.support.descriptor.MethodSource");
+    }
+
+    /** a public no argument method of an object of a class the server is not compiled against */
+    static Object call(Object target, String name) throws Exception {
+        Method method = target.getClass().getMethod(name);
+        method.setAccessible(true);
+        return method.invoke(target);
+    }
+
+    static Object objectMethod(Object proxy, Method method, Object[] args) {
+        switch (method.getName()) {
+            case "equals":
+                return proxy == args[0];
+            case "hashCode":
+                return System.identityHashCode(proxy);
+            default:
+                return "JvmTestServer proxy";
+        }
+    }
+
+    static int count(List<TestResult> results, String outcome) {
+        return (int) results.stream().filter(r -> r.outcome.equals(outcome)).count();
+    }
+
+    static String trace(Throwable throwable, int lines) {
+        if (throwable == null) {
+            return "";
+        }
+        StringWriter writer = new StringWriter();
+        throwable.printStackTrace(new PrintWriter(writer));
+        return Arrays.stream(writer.toString().split("\n")).limit(lines).collect(Collectors.joining("\n")) + "\n";
+    }
+
+    static void deleteTree(Path root) {
+        try (Stream<Path> paths = Files.walk(root)) {
+            paths.sorted(Comparator.reverseOrder()).forEach(p -> p.toFile().delete());
+        } catch (IOException e) {
+            // a scratch directory left in the temp directory
+        }
+    }
+
+    static String xmlEscape(String text) {
+        StringBuilder escaped = new StringBuilder();
+        for (char c : text.toCharArray()) {
+            switch (c) {
+                case '<': escaped.append("&lt;"); break;
+                case '>': escaped.append("&gt;"); break;
+                case '&': escaped.append("&amp;"); break;
+                case '"': escaped.append("&quot;"); break;
+                default:
+                    if (c < 0x20 && c != '\n' && c != '\t' && c != '\r') {
+                        escaped.append(' ');
+                    } else {
+                        escaped.append(c);
+                    }
+            }
+        }
+        return escaped.toString();
+    }
+
+    static String jsonString(String text) {
+        StringBuilder escaped = new StringBuilder("\"");
+        for (char c : text.toCharArray()) {
+            switch (c) {
+                case '"': escaped.append("\\\""); break;
+                case '\\': escaped.append("\\\\"); break;
+                case '\n': escaped.append("\\n"); break;
+                case '\r': escaped.append("\\r"); break;
+                case '\t': escaped.append("\\t"); break;
+                default:
+                    if (c < 0x20) {
+                        escaped.append(String.format("\\u%04x", (int) c));
+                    } else {
+                        escaped.append(c);
+                    }
+            }
+        }
+        return escaped.append('"').toString();
+    }
+}
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from eval.parse_run_log import parse_log
+
+LANGUAGES = ["py", "go", "java", "cs"]
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data")
+
+def result_info(result_path: str, result_dir: str):
+    """
+    context type, model and language of a test result file from its path, e.g.
+    callee/go_llama3_sig.json_testresult.json or rag/bge3_rag_go.json_testresult.json
+    """
+    rel_path = os.path.relpath(result_path, result_dir)
+    context_type = os.path.dirname(rel_path) or "."
+    name = os.path.basename(rel_path).replace("_testresult.json", "")
+    name = name[:-len(".json")] if name.endswith(".json") else name
+    parts = name.split("_")
+    lan = next((p for p in parts if p in LANGUAGES), None)
+    model = "_".join(p for p in parts if p != lan)
+    return context_type, model, lan
+
+def find_result_files(result_dir: str):
+    result_paths = []
+    for root, dirs, files in os.walk(result_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith("_testresult.json"):
+                result_paths.append(os.path.join(root, f))
+    return result_paths
+
+def parse_result_file(result_path: str, lan: str):
+    """
+    the verdicts of one result file as columns: task ids, sample indexes and passed
+    """
+    with open(result_path, "r") as f:
+        all_test_log = json.load(f)
+    task_ids, samples, passed = [], [], []
+    for task_id, logs in all_test_log.items():
+        for i, log in enumerate(logs):
+            task_ids.append(task_id)
+            samples.append(i)
+            passed.append(parse_log(log, lan))
+    return task_ids, np.array(samples, dtype=np.int32), np.array(passed, dtype=bool)
+
+def load_verdicts(result_dir: str, workers: int = os.cpu_count(), task_projects: dict = None):
+    """
+    one row per sample of every result file under result_dir:
+    context_type, model, lan, project, task_id, sample, passed.
+    the files are parsed in a process pool, the project of a task is looked up in task_projects,
+    see task_project.
+    """
+    result_paths = []
+    infos = []
+    for result_path in find_result_files(result_dir):
+        info = result_info(result_path, result_dir)
+        if info[2] is None:
+            print("unknown language:", result_path)
+            continue
+        result_paths.append(result_path)
+        infos.append(info)
+
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        parsed = list(executor.map(parse_result_file, result_paths, [info[2] for info in infos]))
+
+    tables = []
+    for (context_type, model, lan), (task_ids, samples, passed) in zip(infos, parsed):
+        table = pd.DataFrame({"task_id": task_ids, "sample": samples, "passed": passed})
+        table.insert(0, "lan", lan)
+        table.insert(0, "model", model)
+        table.insert(0, "context_type", context_type)
+        tables.append(table)
+    if len(tables) == 0:
+        return pd.DataFrame(columns=["context_type", "model", "lan", "project", "task_id", "sample", "passed"])
+    verdicts = pd.concat(tables, ignore_index=True)
+    for column in ["context_type", "model", "lan", "task_id"]:
+        verdicts[column] = verdicts[column].astype("category")
+    task_ids = verdicts["task_id"].cat.categories
+    known_projects = sorted(set((task_projects or {}).values()), key=len, reverse=True)
+    projects = [task_project(t, task_projects or {}, known_projects) for t in task_ids]
+    verdicts.insert(3, "project", pd.Categorical(np.array(projects, dtype=object)[verdicts["task_id"].cat.codes]))
+    return verdicts
+
+def task_project(task_id: str, task_projects: dict, known_projects: list):
+    """
+    the project of a task: its entry in task_projects, or the longest of known_projects its id starts
+    with, the ids are <project>-<file>-<function> and project names hold "-" themselves, e.g. spring-ai
+    """
+    if task_id in task_projects:
+        return task_projects[task_id]
+    for project in known_projects:
+        if task_id.startswith(project + "-"):
+            return project
+    raise ValueError(f"no known project of task {task_id}, pass the -data_dir of its dataset")
+
+def pass_at_k(n, c, k_max: int):
+    """
+    the unbiased pass@k, 1 - C(n-c, k) / C(n, k), of every task for k = 1..k_max.
+    n and c are arrays of the samples and correct samples per task, the result has one row per task
+    and one column per k, NaN where k > n. the ratio is the product of (n-c-j) / (n-j) for j < k.
+    """
+    n = np.asarray(n, dtype=np.float64)[:, None]
+    c = np.asarray(c, dtype=np.float64)[:, None]
+    j = np.arange(k_max, dtype=np.float64)[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.clip((n - c - j) / (n - j), 0, 1)
+    ratio = np.cumprod(terms, axis=1)
+    result = 1 - ratio
+    result[j + 1 > n] = np.nan
+    return result
+
+def leaderboard(verdicts: pd.DataFrame, by: list, ks: list = None):
+    """
+    the mean pass@k over the tasks of every group of `by`, with the number of distinct tasks and of samples.
+    ks defaults to every k up to the most samples of a task.
+    """
+    keys = list(dict.fromkeys(by + ["context_type", "model", "lan", "task_id"]))
+    per_task = verdicts.groupby(keys, observed=True)["passed"].agg(["size", "sum"]).reset_index()
+    k_max = int(per_task["size"].max()) if len(per_task) else 1
+    ks = ks or list(range(1, k_max + 1))
+    scores = pass_at_k(per_task["size"].to_numpy(), per_task["sum"].to_numpy(), max(ks))
+    for k in ks:
+        per_task[f"pass@{k}"] = scores[:, k - 1]
+    columns = {"task_id": ("task_id", "nunique"), "samples": ("size", "sum")}
+    columns.update({f"pass@{k}": (f"pass@{k}", "mean") for k in ks})
+    board = per_task.groupby(by, observed=True).agg(**columns).reset_index()
+    return board.rename(columns={"task_id": "tasks"})
+
+def save_table(table: pd.DataFrame, path: str):
+    if path.endswith(".parquet"):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+def load_table(path: str):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def dataset_projects(data_dir: str):
+    """
+    task-id -> project of the datasets in data_dir, e.g. data/py_data_final.xlsx
+    """
+    task_projects = {}
+    for lan in LANGUAGES:
+        df_path = os.path.join(data_dir, f"{lan}_data_final.xlsx")
+        if os.path.exists(df_path):
+            df = pd.read_excel(df_path, usecols=["task-id", "project"])
+            task_projects.update(zip(df["task-id"], df["project"]))
+    return task_projects
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-result_dir", default="result/cache_result", help="directory searched for *_testresult.json files")
+    parser.add_argument("-verdicts", default=None, help="table of the parsed verdicts, .parquet or .csv, read if it exists and written otherwise")
+    parser.add_argument("-data_dir", default=DATA_DIR, help="directory of the dataset excel files, to look up the project of a task")
+    parser.add_argument("-by", default="context_type,model,lan", help="comma separated columns to group by, of context_type, model, lan, project")
+    parser.add_argument("-k", default="", help="comma separated k of pass@k, all k up to the samples per task if empty")
+    parser.add_argument("-output", default=None, help="Path to write the leaderboard to, .csv or .parquet")
+    parser.add_argument("-workers", type=int, default=os.cpu_count(), help="processes parsing the result files")
+    args = parser.parse_args()
+
+    if args.verdicts and os.path.exists(args.verdicts):
+        verdicts = load_table(args.verdicts)
+    else:
+        task_projects = dataset_projects(args.data_dir)
+        verdicts = load_verdicts(args.result_dir, args.workers, task_projects)
+        if args.verdicts:
+            save_table(verdicts, args.verdicts)
+    print(f"{len(verdicts)} verdicts of {verdicts['task_id'].nunique()} tasks")
+
+    ks = [int(k) for k in args.k.split(",")] if args.k else None
+    board = leaderboard(verdicts, args.by.split(","), ks)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(board.round(4).to_string(index=False))
+    if args.output:
+        save_table(board, args.output)
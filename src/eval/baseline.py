@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from eval.command_runner import ResourceLimits, start_usage, read_usage
+from eval.parse_run_log import parse_log, is_timeout
+
+def profile_task(row, lan: str, project_root: str, runs: int = 3, timeout: float = 40, limits=None, env=None,
+                 structured=False):
+    """
+    run the tests of a task on its original function `runs` times and record the wall time of every
+    run and whether it passed, and the peak memory in MB of the runs, see command_runner.read_usage:
+    of the largest single process of a test command, of the whole command with a cgroup with the
+    memory controller. a run that times out is not repeated.
+    status is "ok" if every run passed, "broken" if none did and "flaky" otherwise.
+    """
+    from eval.run_test import run_tests
+    durations, passed, peak_memory = [], [], 0
+    timed_out = False
+    for _ in range(runs):
+        start_usage()
+        start_time = time.time()
+        log = run_tests(row, lan, project_root, env, timeout, limits, structured=structured, log_chars=0)
+        durations.append(round(time.time() - start_time, 3))
+        passed.append(parse_log(log, lan))
+        peak_memory = max(peak_memory, read_usage()[0])
+        if is_timeout(log):
+            timed_out = True
+            break
+    if all(passed):
+        status = "ok"
+    elif not any(passed):
+        status = "broken"
+    else:
+        status = "flaky"
+    return {
+        "project": row["project"],
+        "durations": durations,
+        "passed": passed,
+        "peak_memory": round(peak_memory, 1),
+        "timed_out": timed_out,
+        "status": status,
+    }
+
+def load_profile(path: str):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_profile(profile: dict, path: str):
+    with open(path + ".tmp", "w") as f:
+        json.dump(profile, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+def task_cost(entry: dict, samples: int, default: float):
+    """
+    the expected seconds of a task: the mean duration of its baseline runs per sample
+    """
+    if entry is None or len(entry["durations"]) == 0:
+        return default * samples
+    return float(np.mean(entry["durations"])) * samples
+
+def schedule(rows: list, profile: dict, samples: dict):
+    """
+    the rows in longest processing time first order. the workers take the next task when they are
+    free, so the long tasks, e.g. the maven ones, start first and spread over the workers, and the
+    short ones fill the gaps at the end. tasks without a profile count as a median one.
+    samples is task-id -> number of responses.
+    """
+    known = [float(np.mean(e["durations"])) for e in profile.values() if len(e["durations"])]
+    default = float(np.median(known)) if known else 0
+    costs = [task_cost(profile.get(row["task-id"]), samples[row["task-id"]], default) for row in rows]
+    order = sorted(range(len(rows)), key=lambda i: -costs[i])
+    return [rows[i] for i in order]
+
+def quarantine(rows: list, profile: dict):
+    """
+    split the rows into the ones to run and the quarantined ones, whose original function
+    is broken or flaky in the baseline and whose candidates would tell nothing
+    """
+    kept, quarantined = [], []
+    for row in rows:
+        entry = profile.get(row["task-id"])
+        if entry is not None and entry["status"] != "ok":
+            quarantined.append(row)
+        else:
+            kept.append(row)
+    return kept, quarantined
+
+if __name__ == "__main__":
+    from eval.run_test import select_rows
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-df_path", help="Path to the input DataFrame file")
+    parser.add_argument("-lan", help="Programming language")
+    parser.add_argument("-output", help="Path to the profile json, the tasks already in it are not run again")
+    parser.add_argument("-runs", type=int, default=3, help="runs of the tests of every task")
+    parser.add_argument("-timeout", type=float, default=40, help="timeout of a run in seconds")
+    parser.add_argument("-test_selection", default=None, help="json of the tests selected per task by parser.test_impact")
+    parser.add_argument("-max_memory", type=int, default=None, help="memory limit of a test command in MB")
+    parser.add_argument("-structured", action="store_true", help="decide pass or fail from the reports of the test tools")
+    args = parser.parse_args()
+
+    dataset_root = os.path.join("/root/repos/", f'{args.lan}_data')
+    test_df = pd.read_excel(args.df_path)
+    test_selection = None
+    if args.test_selection:
+        with open(args.test_selection, 'r') as f:
+            test_selection = json.load(f)
+    limits = ResourceLimits(args.max_memory * 1024 * 1024) if args.max_memory else None
+
+    # the tasks run one after another, runs side by side would distort each other's wall time
+    profile = load_profile(args.output)
+    for row in select_rows(test_df, test_selection):
+        if row["task-id"] in profile:
+            continue
+        project_root = os.path.join(dataset_root, row["project"])
+        profile[row["task-id"]] = profile_task(row, args.lan, project_root, args.runs, args.timeout, limits,
+                                               structured=args.structured)
+        print(row["task-id"], profile[row["task-id"]])
+        save_profile(profile, args.output)
+
+    statuses = pd.Series([e["status"] for e in profile.values()]).value_counts()
+    print(statuses.to_string())
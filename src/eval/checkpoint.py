@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+class Checkpoint:
+    """
+    append only jsonl of the finished samples, one {"task_id", "sample", "log"} line each,
+    written as soon as the sample is done. load reads it back as task_id -> {sample: log},
+    a line cut off by a crash is skipped.
+    """
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = self.load(path) if resume else {}
+        self.f = open(path, "a" if resume else "w")
+
+    @staticmethod
+    def load(path: str):
+        done = {}
+        if not os.path.exists(path):
+            return done
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done.setdefault(entry["task_id"], {})[entry["sample"]] = entry["log"]
+        return done
+
+    def task_logs(self, task_id: str):
+        return self.done.get(task_id, {})
+
+    def append(self, task_id: str, sample: int, log: str):
+        line = json.dumps({"task_id": task_id, "sample": sample, "log": log})
+        with self.lock:
+            self.f.write(line + "\n")
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class RestoreJournal:
+    """
+    the files being patched, so that a run killed with a candidate written into the project can be
+    undone. before the first candidate of a task the original file is copied to the journal
+    directory and a "patch" line is appended, after the task a "restore" line. replay copies back
+    every file patched and not restored, it runs when the journal is opened.
+    """
+    def __init__(self, journal_dir: str):
+        self.journal_dir = journal_dir
+        self.journal_path = os.path.join(journal_dir, "journal.jsonl")
+        self.lock = threading.Lock()
+        os.makedirs(journal_dir, exist_ok=True)
+        self.replay()
+        self.f = open(self.journal_path, "w")
+
+    def backup_path(self, file_path: str):
+        return os.path.join(self.journal_dir, hashlib.sha1(file_path.encode("utf-8")).hexdigest())
+
+    def replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        patched = {}
+        with open(self.journal_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["op"] == "patch":
+                    patched[entry["file"]] = entry["backup"]
+                else:
+                    patched.pop(entry["file"], None)
+        for file_path, backup_path in patched.items():
+            # a workspace copy may be gone already, there is nothing to restore then
+            if os.path.exists(backup_path) and os.path.exists(os.path.dirname(file_path)):
+                print("restore file patched by an interrupted run:", file_path)
+                shutil.copy2(backup_path, file_path + ".run_test_tmp")
+                os.replace(file_path + ".run_test_tmp", file_path)
+        for name in os.listdir(self.journal_dir):
+            os.remove(os.path.join(self.journal_dir, name))
+
+    def patched(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        backup_path = self.backup_path(file_path)
+        shutil.copy2(file_path, backup_path)
+        self.write({"op": "patch", "file": file_path, "backup": backup_path})
+
+    def restored(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        self.write({"op": "restore", "file": file_path})
+        os.remove(self.backup_path(file_path))
+
+    def write(self, entry: dict):
+        with self.lock:
+            self.f.write(json.dumps(entry) + "\n")
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,352 @@
+import collections
+import gzip
+import json
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+# the usage of the commands a thread ran since start_usage
+thread_usage = threading.local()
+
+def start_usage():
+    thread_usage.peak_memory = 0
+    thread_usage.commands = 0
+
+def read_usage():
+    """
+    the peak memory in MB of the commands the thread ran since start_usage, and the number of those
+    commands. the peak of a command is the memory.peak of its cgroup, all its processes together, when
+    it ran in one with the memory controller. otherwise it is the ru_maxrss of wait4: the peak resident
+    memory of the largest single process of the command, not the sum of its processes.
+    """
+    return getattr(thread_usage, "peak_memory", 0) / 1024, getattr(thread_usage, "commands", 0)
+
+# a shell that could not set the limits of its command exits with this code and line, without running it
+LIMITS_EXIT_CODE = 125
+LIMITS_FAILED = "run_test: setting the resource limits of the test command failed"
+
+# seconds the pipes of a killed command are read for, a process outside its group and cgroup may hold them
+KILL_GRACE = 10
+
+# seconds between the reads of the cpu time of a command's cgroup, and the line added when it ran out
+CPU_POLL = 0.2
+CPU_EXCEEDED = "run_test: the cpu time limit of the test command was exceeded, killed"
+
+# the lines parse_run_log decides on: pytest's ==== result lines, go's PASS, ok, FAIL and any line
+# with fail or error in it, maven's Tests run: and BUILD lines and dotnet's Passed and Failed
+SUMMARY_LINE = re.compile(r"^=+ |^(ok|PASS|FAIL|---)\b|Tests run:|BUILD |\[ERROR\]|fail|error|passed|no tests ran",
+                          re.IGNORECASE)
+
+class BoundedCapture:
+    """
+    the output of a stream in at most max_chars characters: the head and the tail of it, and the summary
+    lines of the part in between, at most max_summary_lines of them. with spill_path every line also goes
+    to that gzip file, the cut log names it.
+    """
+    def __init__(self, max_chars: int, spill_path: str = None, max_summary_lines: int = 1000):
+        self.head_chars = max_chars // 2
+        self.tail_chars = max_chars - self.head_chars
+        self.max_summary_lines = max_summary_lines
+        self.head = []
+        self.head_len = 0
+        self.tail = collections.deque()
+        self.tail_len = 0
+        self.summary = []
+        self.cut = 0
+        self.spill_path = spill_path
+        self.spill = gzip.open(spill_path, "wt") if spill_path else None
+
+    def feed(self, line: str):
+        if self.spill is not None:
+            self.spill.write(line)
+        if self.head_len < self.head_chars:
+            part = line[:self.head_chars - self.head_len]
+            self.head.append(part)
+            self.head_len += len(part)
+            line = line[len(part):]
+            if not line:
+                return
+        self.tail.append(line)
+        self.tail_len += len(line)
+        while self.tail_len > self.tail_chars:
+            if len(self.tail) == 1:
+                # one line longer than the tail, its end is kept
+                dropped = self.tail_len - self.tail_chars
+                self.keep_summary(self.tail[0][:dropped])
+                self.tail[0] = self.tail[0][dropped:]
+                self.tail_len -= dropped
+                self.cut += dropped
+                break
+            dropped = self.tail.popleft()
+            self.tail_len -= len(dropped)
+            self.cut += len(dropped)
+            self.keep_summary(dropped)
+
+    def keep_summary(self, line: str):
+        if len(self.summary) < self.max_summary_lines and SUMMARY_LINE.search(line[:500]):
+            self.summary.append(line[:500].rstrip("\n") + "\n")
+
+    def text(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        if self.cut == 0:
+            return "".join(self.head) + "".join(self.tail)
+        where = f", full log in {self.spill_path}" if self.spill_path else ""
+        return "".join(self.head) + f"\n... {self.cut} characters cut{where} ...\n" + "".join(self.summary) \
+            + "".join(self.tail)
+
+class ResourceLimits:
+    """
+    limits of a test command and every process it starts.
+    memory is in bytes, cpu in seconds of cpu time, processes is the number of processes.
+    with cgroup_root, a cgroup v2 directory the runner may create children in, every command gets a
+    cgroup of its own with memory.max and pids.max, which covers the whole process tree. cpu time is
+    not a cgroup limit, the runner reads the cpu.stat of the cgroup and kills the command once its
+    processes used cpu seconds together, see cpu_exceeded.
+    otherwise the limits are `ulimit`s of the shell, inherited by its children but counted per process:
+    -v for memory, which a JVM reserving its heap needs a large value of, -t for cpu time, and -u,
+    which counts all processes of the user and is not enforced for root.
+    both are set by the shell itself before it runs the command, the worker threads of run_test
+    can not safely run python code between fork and exec.
+    max_output bounds the characters kept of stdout and of stderr each, see BoundedCapture, with
+    spill_dir the full output is written there compressed.
+    """
+    def __init__(self, memory: int = None, cpu: int = None, processes: int = None, cgroup_root: str = None,
+                 max_output: int = None, spill_dir: str = None):
+        self.memory = memory
+        self.cpu = cpu
+        self.processes = processes
+        self.cgroup_root = cgroup_root
+        self.max_output = max_output
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        if cgroup_root and not os.path.exists(os.path.join(cgroup_root, "cgroup.controllers")):
+            print("not a cgroup v2 directory, using rlimits:", cgroup_root)
+            self.cgroup_root = None
+
+    def create_cgroup(self):
+        if self.cgroup_root is None:
+            return None
+        cgroup = os.path.join(self.cgroup_root, f"run_test_{uuid.uuid4().hex[:12]}")
+        os.makedirs(cgroup)
+        settings = {
+            "memory.max": self.memory,
+            "pids.max": self.processes,
+        }
+        for name, value in settings.items():
+            if value is not None:
+                with open(os.path.join(cgroup, name), "w") as f:
+                    f.write(str(value))
+        return cgroup
+
+    def wrap(self, command: str, cgroup: str = None):
+        """
+        command run by a shell that first puts itself into cgroup or sets its ulimits. if that fails
+        the shell prints LIMITS_FAILED and exits with LIMITS_EXIT_CODE, run_command raises then.
+        """
+        if cgroup is not None:
+            limits = [f"echo $$ > {os.path.join(cgroup, 'cgroup.procs')}"]
+        else:
+            limits = []
+            if self.memory:
+                limits.append(f"ulimit -v {self.memory // 1024}")
+            if self.cpu:
+                limits.append(f"ulimit -t {self.cpu}")
+            if self.processes:
+                limits.append(f"ulimit -u {self.processes}")
+        if len(limits) == 0:
+            return command
+        return " && ".join(limits) + f" || {{ echo '{LIMITS_FAILED}' >&2; exit {LIMITS_EXIT_CODE}; }}\n{{ {command}\n}}"
+
+    def spill_path(self, name: str):
+        return os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.{name}.log.gz") if self.spill_dir else None
+
+    def capture(self, name: str):
+        if not self.max_output:
+            return None
+        return BoundedCapture(self.max_output, self.spill_path(name))
+
+def cpu_exceeded(cgroup: str, cpu: float):
+    """
+    whether the processes of cgroup, the ones gone included, used more than cpu seconds of cpu time
+    """
+    if cgroup is None or not cpu:
+        return False
+    try:
+        with open(os.path.join(cgroup, "cpu.stat"), "r") as f:
+            for line in f:
+                key, value = line.split()
+                if key == "usage_usec":
+                    return int(value) / 1e6 > cpu
+    except (OSError, ValueError):
+        pass
+    return False
+
+def cgroup_peak_memory(cgroup: str):
+    """
+    the peak memory in KB of the processes of cgroup together, None without the memory controller
+    """
+    if cgroup is None:
+        return None
+    try:
+        with open(os.path.join(cgroup, "memory.peak"), "r") as f:
+            return int(f.read()) // 1024
+    except (OSError, ValueError):
+        return None
+
+def kill_cgroup(cgroup: str):
+    """
+    kill every process of cgroup, also the ones that left the session of the command
+    """
+    if cgroup is None:
+        return
+    try:
+        with open(os.path.join(cgroup, "cgroup.kill"), "w") as f:
+            f.write("1")
+    except OSError:
+        pass
+
+def remove_cgroup(cgroup: str):
+    if cgroup is None:
+        return
+    # a cgroup can only be removed once it is empty
+    kill_cgroup(cgroup)
+    try:
+        os.rmdir(cgroup)
+    except OSError:
+        pass
+
+def kill_group(pgid: int):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def run_command(command: str, timeout: float, cwd=None, env=None, limits: ResourceLimits = None,
+                line_handler=None):
+    """
+    run command in bash in a session of its own, and return the CompletedProcess or None on timeout.
+    on timeout the whole process group is killed, so are the processes still left in it after the
+    command exits, e.g. a test binary or a JVM a killed `go test` or `mvn` started.
+    the peak memory of the command is added to the usage of the thread, see read_usage: the memory.peak
+    of its cgroup, or the ru_maxrss wait4 gives for the shell, the largest of it and the children it
+    waited for.
+    line_handler is called with every stdout line while the command runs, stdout is what it returns.
+    the pipes are read line by line, with a max_output in limits only a bounded part of them is kept.
+    a process that left both the group and the cgroup may keep the pipes open, they are read at most
+    KILL_GRACE seconds after the kill then, and the output so far is returned.
+    with a cgroup, a command past the cpu time of limits is killed like ulimit -t would, with CPU_EXCEEDED
+    in its stderr.
+    raises RuntimeError if the limits could not be set, the command did not run then.
+    """
+    cgroup = limits.create_cgroup() if limits is not None else None
+    shell_command = limits.wrap(command, cgroup) if limits is not None else command
+    process = subprocess.Popen(shell_command, shell=True, cwd=cwd, env=env, executable='/bin/bash',
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='ignore',
+                               start_new_session=True)
+    captures = {name: limits.capture(name) if limits is not None else None for name in ["stdout", "stderr"]}
+    lines = {"stdout": [], "stderr": []}
+    def read(name, stream):
+        # a line is read in pieces of at most 64k characters
+        for line in iter(lambda: stream.readline(65536), ""):
+            if name == "stdout" and line_handler is not None:
+                line = line_handler(line)
+            if captures[name] is not None:
+                captures[name].feed(line)
+            else:
+                lines[name].append(line)
+        stream.close()
+    readers = [threading.Thread(target=read, args=("stdout", process.stdout), daemon=True),
+               threading.Thread(target=read, args=("stderr", process.stderr), daemon=True)]
+    status = {}
+    def wait():
+        _, status["code"], status["rusage"] = os.wait4(process.pid, 0)
+    waiter = threading.Thread(target=wait, daemon=True)
+    for t in readers + [waiter]:
+        t.start()
+    try:
+        cpu = limits.cpu if cgroup is not None else None
+        deadline = time.time() + timeout
+        waiter.join(min(timeout, CPU_POLL) if cpu else timeout)
+        out_of_cpu = False
+        while cpu and waiter.is_alive() and time.time() < deadline:
+            if cpu_exceeded(cgroup, cpu):
+                out_of_cpu = True
+                break
+            waiter.join(min(CPU_POLL, max(deadline - time.time(), 0)))
+        timed_out = waiter.is_alive() and not out_of_cpu
+        # the pipes are only closed once the processes left in the group and the cgroup are gone
+        kill_group(process.pid)
+        kill_cgroup(cgroup)
+        deadline = time.time() + KILL_GRACE
+        for t in [waiter] + readers:
+            t.join(max(deadline - time.time(), 0))
+        tree_peak_memory = cgroup_peak_memory(cgroup)
+    finally:
+        remove_cgroup(cgroup)
+    outputs = {name: captures[name].text() if captures[name] is not None else "".join(lines[name])
+               for name in ["stdout", "stderr"]}
+    if out_of_cpu:
+        outputs["stderr"] += f"\n{CPU_EXCEEDED}\n"
+    if any(t.is_alive() for t in readers):
+        outputs["stderr"] += "\nrun_test: the output pipes are held by a process outside the command's group, output cut\n"
+    # the shell leads the killed group, it is gone unless the system is stuck
+    process.returncode = os.waitstatus_to_exitcode(status["code"]) if "code" in status else -signal.SIGKILL
+    peak_memory = tree_peak_memory if tree_peak_memory is not None else \
+        status["rusage"].ru_maxrss if "rusage" in status else 0
+    thread_usage.peak_memory = max(getattr(thread_usage, "peak_memory", 0), peak_memory)
+    thread_usage.commands = getattr(thread_usage, "commands", 0) + 1
+    if process.returncode == LIMITS_EXIT_CODE and LIMITS_FAILED in outputs["stderr"]:
+        raise RuntimeError(f"{LIMITS_FAILED}: {outputs['stderr'][-1000:].strip()}")
+    if timed_out:
+        return None
+    return subprocess.CompletedProcess(command, process.returncode, outputs["stdout"], outputs["stderr"])
+
+class TimeoutModel:
+    """
+    per project timeouts learned from the durations of passing test runs of the test command, which
+    take about as long as the ground truth. the timeout of a project is factor times its slowest passing run plus slack,
+    between min_timeout and max_timeout. a project without passing runs keeps the default timeout.
+    the durations are saved as json, so a later run starts with them.
+    """
+    def __init__(self, path: str = None, factor: float = 3.0, slack: float = 5.0,
+                 min_timeout: float = 10.0, max_timeout: float = 300.0):
+        self.path = path
+        self.factor = factor
+        self.slack = slack
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.lock = threading.Lock()
+        self.durations = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.durations = json.load(f)
+
+    def observe(self, project: str, seconds: float):
+        with self.lock:
+            durations = self.durations.setdefault(project, [])
+            durations.append(round(seconds, 3))
+            del durations[:-100]
+
+    def timeout(self, project: str, default: float):
+        with self.lock:
+            durations = self.durations.get(project)
+            if not durations:
+                return default
+            timeout = self.factor * max(durations) + self.slack
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            durations = {project: list(d) for project, d in self.durations.items()}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(durations, f, indent=4)
+        os.replace(self.path + ".tmp", self.path)
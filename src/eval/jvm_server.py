@@ -0,0 +1,291 @@
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+from eval.command_runner import run_command, kill_group
+from eval.reporters import make_reporter
+from eval.test_commands import command_segments
+
+SERVER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "JvmTestServer.java")
+TEST_COMMAND = re.compile(r"^mvn (-o )?test -Dtest=([\w.$#+,]+)$")
+
+def parse_test_command(test_command: str):
+    """
+    the (module, [tests]) runs of a test command made of `cd module && mvn test -Dtest=Tests` and `cd ..`
+    segments, e.g. "cd core && mvn test -Dtest=ATest; cd .. ; cd core && mvn test -Dtest=BTest; cd ..",
+    or None for any other command, e.g. a gradle one or one with a -Dtest pattern.
+    the directory of a segment follows the cd's of the segments before it, see command_segments.
+    """
+    segments = command_segments(test_command)
+    if not segments:
+        return None
+    runs = []
+    for module, command in segments:
+        match = TEST_COMMAND.match(command)
+        if match is None:
+            return None
+        runs.append((module, match.group(2).split(",")))
+    return runs
+
+def launcher_classpath(entries: list, module_dir: str, env=None):
+    """
+    the test classpath with the junit-platform-launcher of the version of junit-platform-engine, which
+    surefire brings along itself and a junit 5 project does not depend on. it is fetched into the
+    local repository next to the engine if it is not there.
+    """
+    if any(os.path.basename(e).startswith("junit-platform-launcher-") for e in entries):
+        return entries
+    for entry in entries:
+        match = re.match(r"junit-platform-engine-(.+)\.jar$", os.path.basename(entry))
+        if match is None:
+            continue
+        version = match.group(1)
+        launcher = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(entry))), "junit-platform-launcher",
+                                version, f"junit-platform-launcher-{version}.jar")
+        if not os.path.exists(launcher):
+            run_command(f"mvn -B -q dependency:get -Dartifact=org.junit.platform:junit-platform-launcher:{version}",
+                        300, module_dir, env)
+        if os.path.exists(launcher):
+            return entries + [launcher]
+        break
+    return entries
+
+class ServerChecks:
+    """
+    the one-time equivalence checks of the jvm test servers, one per maven module of a project. the tests
+    of the first task of the module run on the original function with maven and with the server, the
+    server runs the module's tests from then on only if every test has the same outcome in both, maven
+    does otherwise. the server misses parts of maven, see JvmTestServer, a module where that matters
+    stays with maven. the results are kept in the json at cache_path,
+    "<project>:<module>" -> {"equivalent", "maven", "server"}, shared by the servers of a run.
+    """
+    def __init__(self, cache_path: str = None):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                self.entries = json.load(f)
+
+    def equivalent(self, key: str):
+        """True or False once the module is checked, None before"""
+        with self.lock:
+            entry = self.entries.get(key)
+        return None if entry is None else entry["equivalent"]
+
+    def put(self, keys: list, entry: dict):
+        with self.lock:
+            for key in keys:
+                self.entries[key] = entry
+            self.save()
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        with open(self.cache_path + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+class JvmTestServer:
+    """
+    client of the JvmTestServer.java test runners of a java project, one per maven module. prepare starts
+    the ones of the modules of a task on the clean tree, before a candidate is patched in, and checks a
+    module against maven on its first task, see ServerChecks. run returns
+    the log of the test command of a task like run_javatest, with only the patched file compiled and the
+    tests run in a warm jvm, or None if the servers can not answer or a module is not checked equivalent,
+    then the caller runs the maven command.
+    the module's classes and its test classpath come from `mvn test-compile dependency:build-classpath`,
+    offline if the test command of the task is. the compiled classes are copied, so the maven runs of
+    the candidates do not change what the server loads, and a server that stops, e.g. on a timeout, is
+    started again from the copy. like with maven a patched file of another module is not compiled, that
+    module is a jar of the local repository. unlike maven the surefire argLine and system properties of
+    the pom are not applied, and the other classes of the module are not recompiled against the patched one.
+    """
+    def __init__(self, project_root: str, env=None, checks: ServerChecks = None, check_timeout: float = 600):
+        self.project_root = project_root
+        self.env = env
+        self.checks = checks if checks is not None else ServerChecks()
+        self.check_timeout = check_timeout
+        self.state_dir = tempfile.mkdtemp(prefix="jvm_test_server_")
+        # module directory -> {"process", "port"}
+        self.servers = {}
+        # module directory -> the directory of its classpath file and its copied classes
+        self.modules = {}
+        self.failed = set()
+
+    def prepare(self, row):
+        """
+        start the servers of the modules of the test command of row that are not running, on the clean
+        tree, and check the modules not checked yet with the tests of row
+        """
+        runs = parse_test_command(row["test_command"])
+        if runs is None:
+            return
+        offline = "mvn -o " in row["test_command"]
+        unchecked = []
+        for module, _ in runs:
+            module_dir = os.path.abspath(os.path.join(self.project_root, module))
+            key = f"{row['project']}:{module}"
+            if self.checks.equivalent(key) is False:
+                continue
+            if module_dir not in self.modules and module_dir not in self.failed:
+                self.compile(module_dir, offline)
+            if module_dir in self.modules and module_dir not in self.servers:
+                self.start(module_dir)
+            if module_dir in self.servers and self.checks.equivalent(key) is None:
+                unchecked.append(key)
+        if unchecked:
+            self.check(row, runs, unchecked)
+
+    def check(self, row, runs: list, keys: list):
+        """
+        run the tests of row on the original function with maven and with the servers, and record the
+        modules keys equivalent if every test has the same outcome, from the surefire reports of both
+        """
+        from eval.run_test import run_tests
+        maven = run_tests(row, "java", self.project_root, self.env, self.check_timeout, structured=True, log_chars=0)
+        reporter = make_reporter("java", row, self.project_root, 0)
+        try:
+            reporter.prepare()
+            log = self.run_servers(row, runs, self.check_timeout)
+            server = reporter.record(log) if log is not None else None
+        finally:
+            reporter.close()
+        if server is None:
+            # the servers could not answer, the next task of the modules checks them again
+            return
+        equivalent = maven["status"] == "ok" and server["status"] == "ok" and len(maven["tests"]) > 0 \
+            and maven["tests"] == server["tests"] and maven["verdict"] == server["verdict"]
+        print(f"jvm test server of {', '.join(keys)}: {'equivalent to' if equivalent else 'differs from'} maven"
+              f"{'' if equivalent else ', the tests run with maven'}")
+        self.checks.put(keys, {"equivalent": equivalent, "maven": maven["tests"], "server": server["tests"]})
+        if not equivalent:
+            for module, _ in runs:
+                self.stop(os.path.abspath(os.path.join(self.project_root, module)))
+
+    def compile(self, module_dir: str, offline: bool):
+        state = tempfile.mkdtemp(prefix=os.path.basename(module_dir) + "_", dir=self.state_dir)
+        classpath_file = os.path.join(state, "classpath")
+        mvn = "mvn -o" if offline else "mvn"
+        command = f"{mvn} -B -q test-compile dependency:build-classpath -Dmdep.includeScope=test -Dmdep.outputFile={classpath_file}"
+        result = run_command(command, 600, module_dir, self.env)
+        if result is None or result.returncode != 0 or not os.path.exists(classpath_file):
+            print(f"jvm test server: no classpath of {module_dir}, the tests run with maven")
+            if result is not None:
+                print(result.stdout[-2000:] + result.stderr[-2000:])
+            self.failed.add(module_dir)
+            return
+        with open(classpath_file, "r") as f:
+            entries = [e for e in f.read().strip().split(os.pathsep) if e]
+        with open(classpath_file, "w") as f:
+            f.write(os.pathsep.join(launcher_classpath(entries, module_dir, self.env)))
+        for name in ["classes", "test-classes"]:
+            classes_dir = os.path.join(module_dir, "target", name)
+            if os.path.isdir(classes_dir):
+                shutil.copytree(classes_dir, os.path.join(state, name))
+            else:
+                os.makedirs(os.path.join(state, name))
+        self.modules[module_dir] = state
+
+    def start(self, module_dir: str):
+        state = self.modules[module_dir]
+        port_file = os.path.join(state, "port")
+        start_time = time.time()
+        with open(os.path.join(state, "log"), "ab") as log_file:
+            process = subprocess.Popen(["java", SERVER_SOURCE, module_dir, os.path.join(state, "classpath"), port_file,
+                                        os.path.join(state, "classes"), os.path.join(state, "test-classes")],
+                                       cwd=module_dir,
+                                       env=self.env, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+        deadline = time.time() + 120
+        while not os.path.exists(port_file):
+            if process.poll() is not None or time.time() > deadline:
+                print(f"jvm test server of {module_dir} did not start, the tests run with maven")
+                self.stop_process(process)
+                self.failed.add(module_dir)
+                del self.modules[module_dir]
+                return None
+            time.sleep(0.05)
+        with open(port_file, "r") as f:
+            port = int(f.read())
+        os.remove(port_file)
+        print(f"jvm test server of {module_dir} started in {round(time.time() - start_time, 1)}s")
+        self.servers[module_dir] = {"process": process, "port": port}
+        return self.servers[module_dir]
+
+    def request(self, module_dir: str, sources: list, tests: list, timeout: float):
+        server = self.servers.get(module_dir)
+        if server is None or server["process"].poll() is not None:
+            # only a module prepared on the clean tree, its server is started again from the copied classes
+            if module_dir not in self.modules:
+                return None
+            self.stop(module_dir)
+            server = self.start(module_dir)
+            if server is None:
+                return None
+        lines = [f"timeout {timeout}"] + [f"source {s}" for s in sources] + [f"test {t}" for t in tests] + ["end"]
+        try:
+            with socket.create_connection(("127.0.0.1", server["port"]), timeout=10) as conn:
+                conn.settimeout(timeout + 30)
+                conn.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+                chunks = []
+                while True:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            response = json.loads(b"".join(chunks).decode("utf-8", errors="ignore"))
+        except (OSError, ValueError):
+            # e.g. a test that called System.exit, the server is started again for the next run
+            self.stop(module_dir)
+            return None
+        if response["timeout"]:
+            self.stop(module_dir)
+        return response
+
+    def run(self, row, timeout: float = 40):
+        runs = parse_test_command(row["test_command"])
+        if runs is None:
+            return None
+        if any(self.checks.equivalent(f"{row['project']}:{module}") is not True for module, _ in runs):
+            return None
+        return self.run_servers(row, runs, timeout)
+
+    def run_servers(self, row, runs: list, timeout: float):
+        source = os.path.abspath(os.path.join(self.project_root, row["file_path"]))
+        deadline = time.time() + timeout
+        log = ""
+        for module, tests in runs:
+            module_dir = os.path.abspath(os.path.join(self.project_root, module))
+            sources = [source] if source.startswith(os.path.join(module_dir, "src") + os.sep) else []
+            response = self.request(module_dir, sources, tests, max(deadline - time.time(), 1))
+            if response is None or "unsupported" in response:
+                if response is not None:
+                    print(f"jvm test server of {module_dir}: {response['unsupported']}, the tests run with maven")
+                return None
+            if response["timeout"]:
+                return "TimeOut ERROR"
+            log += response["log"] + "\n"
+        return log
+
+    @staticmethod
+    def stop_process(process):
+        if process.poll() is None:
+            kill_group(process.pid)
+        process.wait()
+
+    def stop(self, module_dir: str):
+        server = self.servers.pop(module_dir, None)
+        if server is not None:
+            self.stop_process(server["process"])
+
+    def close(self):
+        for module_dir in list(self.servers):
+            self.stop(module_dir)
+        shutil.rmtree(self.state_dir, ignore_errors=True)
@@ -82,7 +82,10 @@ def parse_java_log(log:str):
     return passed and has_test
 
 
-def parse_log(log: str, lang: str):
+def parse_log(log, lang: str):
+    # a result entry of eval.reporters
+    if isinstance(log, dict):
+        return log["verdict"]
     if lang == "py":
         return parse_py_log(log)
     elif lang == "go":
@@ -94,6 +97,11 @@ def parse_log(log: str, lang: str):
     else:
         return False
 
+def is_timeout(log):
+    if isinstance(log, dict):
+        return log["status"] == "timeout"
+    return "TimeOut ERROR" in log
+
 def extract_code_blocks(markdown_text):
     # 正则表达式匹配Markdown中的代码块
     code_block_pattern = re.compile(r'```(?:\w+)?\n(.*?)```', re.DOTALL)
@@ -0,0 +1,247 @@
+import functools
+import importlib.util
+import json
+import os
+import resource
+import select
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+EVAL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@functools.lru_cache(maxsize=None)
+def load_command_runner():
+    # the zygote runs without the eval directory on sys.path, so the project's modules are not shadowed
+    spec = importlib.util.spec_from_file_location("_zygote_command_runner", os.path.join(EVAL_DIR, "command_runner.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def project_modules(project_root: str):
+    """
+    names of the loaded modules whose file is in the project, its conftest and tests included.
+    a virtualenv inside the project is third party.
+    """
+    project_root = os.path.realpath(project_root) + os.sep
+    names = []
+    for name, module in list(sys.modules.items()):
+        file_path = getattr(module, "__file__", None)
+        if not file_path:
+            continue
+        file_path = os.path.realpath(file_path)
+        if file_path.startswith(project_root) and "site-packages" not in file_path:
+            names.append(name)
+    return names
+
+def drop_project_modules(project_root: str):
+    for name in project_modules(project_root):
+        del sys.modules[name]
+
+def apply_limits(limits: dict):
+    """
+    put the process into the cgroup of limits, or set the rlimits the shell of run_command sets with ulimit
+    """
+    if limits.get("cgroup"):
+        with open(os.path.join(limits["cgroup"], "cgroup.procs"), "w") as f:
+            f.write(str(os.getpid()))
+        return
+    for name, value in [(resource.RLIMIT_AS, limits.get("memory")), (resource.RLIMIT_CPU, limits.get("cpu")),
+                        (resource.RLIMIT_NPROC, limits.get("processes"))]:
+        if value:
+            hard = resource.getrlimit(name)[1]
+            value = value if hard == resource.RLIM_INFINITY else min(value, hard)
+            resource.setrlimit(name, (value, value))
+
+def read_output(f, max_output: int = None, spill_path: str = None):
+    f.seek(0)
+    if not max_output:
+        return f.read().decode("utf-8", errors="ignore")
+    capture = load_command_runner().BoundedCapture(max_output, spill_path)
+    for line in iter(lambda: f.readline(65536), b""):
+        capture.feed(line.decode("utf-8", errors="ignore"))
+    return capture.text()
+
+def run_forked(project_root: str, args: list, timeout: int, limits: dict = None):
+    """
+    fork, run pytest on args in the child, and return its stdout and stderr, or None on timeout.
+    the child runs in a session of its own, which is killed after the run with what it left running.
+    the child imports the project modules again, so it sees the generated code of the candidate.
+    limits are the ResourceLimits of run_test as a dict, the child applies them before it runs pytest,
+    and with max_output only a bounded part of the output is returned, see BoundedCapture.
+    """
+    limits = limits or {}
+    import pytest
+    stdout_file = tempfile.TemporaryFile()
+    stderr_file = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            os.dup2(stdout_file.fileno(), 1)
+            os.dup2(stderr_file.fileno(), 2)
+            try:
+                apply_limits(limits)
+            except (OSError, ValueError) as e:
+                command_runner = load_command_runner()
+                print(f"{command_runner.LIMITS_FAILED}: {e!r}", file=sys.stderr)
+                sys.stderr.flush()
+                os._exit(command_runner.LIMITS_EXIT_CODE)
+            drop_project_modules(project_root)
+            pytest.main(args)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0)
+
+    deadline = time.time() + timeout
+    command_runner = load_command_runner()
+    kill_group = command_runner.kill_group
+    # the cpu time of a run in a cgroup is read from the cgroup, like run_command does
+    next_cpu_check = time.time() + command_runner.CPU_POLL
+    out_of_cpu = False
+    while True:
+        finished, _ = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            # like run_command, the processes a test started and left in the session do not outlive the run
+            kill_group(pid)
+            break
+        if limits.get("cgroup") and limits.get("cpu") and time.time() > next_cpu_check:
+            next_cpu_check = time.time() + command_runner.CPU_POLL
+            if command_runner.cpu_exceeded(limits["cgroup"], limits["cpu"]):
+                kill_group(pid)
+                os.waitpid(pid, 0)
+                out_of_cpu = True
+                break
+        if time.time() > deadline:
+            # the tests may have started processes of their own
+            kill_group(pid)
+            os.waitpid(pid, 0)
+            return None
+        time.sleep(0.005)
+    logs = []
+    for f, spill_path in zip([stdout_file, stderr_file], limits.get("spill_paths") or [None, None]):
+        logs.append(read_output(f, limits.get("max_output"), spill_path))
+        f.close()
+    if out_of_cpu:
+        logs[1] += f"\n{command_runner.CPU_EXCEEDED}\n"
+    return logs
+
+def serve(project_root: str, warm_args: list):
+    """
+    the zygote: import pytest and, by collecting warm_args once, the conftest and the dependencies of the tests.
+    the project modules are dropped again and the third party ones stay loaded for the forked children.
+    requests and responses are json lines on stdin and on the original stdout.
+    """
+    protocol_out = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    import pytest
+    if warm_args:
+        pytest.main(["--collect-only", "-q", "-p", "no:cacheprovider"] + warm_args)
+    drop_project_modules(project_root)
+    protocol_out.write(json.dumps({"ready": True}) + "\n")
+    protocol_out.flush()
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        logs = run_forked(project_root, request["args"], request["timeout"], request.get("limits"))
+        if logs is None:
+            response = {"timeout": True}
+        else:
+            response = {"timeout": False, "stdout": logs[0], "stderr": logs[1]}
+        protocol_out.write(json.dumps(response) + "\n")
+        protocol_out.flush()
+
+class PytestZygote:
+    """
+    client of a zygote running in project_root. run returns the log of `pytest <test_funcs>` like
+    run_pytest, or None if the zygote can not answer, then the caller runs pytest as a subprocess.
+    the forked runs get the resource limits and the output bound of limits, a cgroup of its own each
+    with the cgroup_root of limits.
+    """
+    def __init__(self, project_root: str, env=None, limits=None):
+        self.project_root = project_root
+        self.env = env
+        self.limits = limits
+        self.process = None
+        self.failed = False
+
+    def start(self, test_funcs: str):
+        # the `python` of PATH, like the `pytest` run_pytest starts. the file is run by path, and its
+        # directory is taken off sys.path below, so the eval modules do not shadow the project's.
+        # the warm-up only collects, it must not write the report of a structured run
+        warm_args = [a for a in shlex.split(test_funcs) if not a.startswith(("--junitxml", "--junit-xml"))]
+        self.process = subprocess.Popen(["python", os.path.abspath(__file__), self.project_root] + warm_args,
+                                        cwd=self.project_root, env=self.env, text=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, errors="ignore")
+        if self.read_response(300) is None:
+            self.close()
+            self.failed = True
+
+    def read_response(self, timeout: int):
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            return None
+        line = self.process.stdout.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def run(self, test_funcs: str, timeout: int = 40):
+        if self.failed:
+            return None
+        if self.process is None:
+            self.start(test_funcs)
+        if self.process is None or self.process.poll() is not None:
+            self.close()
+            return None
+        from eval.command_runner import remove_cgroup, LIMITS_FAILED
+        limits, cgroup = self.request_limits()
+        try:
+            self.process.stdin.write(json.dumps({"args": shlex.split(test_funcs), "timeout": timeout,
+                                                 "limits": limits}) + "\n")
+            self.process.stdin.flush()
+            response = self.read_response(timeout + 30)
+        except BrokenPipeError:
+            response = None
+        finally:
+            remove_cgroup(cgroup)
+        if response is None:
+            self.close()
+            return None
+        if response["timeout"]:
+            return "TimeOut ERROR"
+        if LIMITS_FAILED in response["stderr"]:
+            raise RuntimeError(response["stderr"][-1000:].strip())
+        return response["stdout"] + "\n" + response["stderr"]
+
+    def request_limits(self):
+        """
+        the limits of a run as sent to the zygote, and the cgroup created for it
+        """
+        if self.limits is None:
+            return None, None
+        cgroup = self.limits.create_cgroup()
+        limits = {"cgroup": cgroup, "memory": self.limits.memory, "cpu": self.limits.cpu,
+                  "processes": self.limits.processes, "max_output": self.limits.max_output}
+        if self.limits.max_output:
+            limits["spill_paths"] = [self.limits.spill_path("stdout"), self.limits.spill_path("stderr")]
+        return limits, cgroup
+
+    def close(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+        self.process = None
+
+if __name__ == "__main__":
+    if sys.path and os.path.realpath(sys.path[0]) == os.path.dirname(os.path.realpath(__file__)):
+        sys.path.pop(0)
+    serve(sys.argv[1], sys.argv[2:])
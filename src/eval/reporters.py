@@ -0,0 +1,208 @@
+import glob
+import json
+import os
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+from eval.test_commands import command_segments
+
+OUTCOMES = ["passed", "failed", "error", "skipped"]
+
+def truncate_log(log: str, log_chars: int):
+    """
+    the head and the tail of log, log_chars characters together
+    """
+    if len(log) <= log_chars:
+        return log
+    half = log_chars // 2
+    return log[:half] + f"\n... {len(log) - 2 * half} characters cut ...\n" + log[-half:]
+
+def parse_junit_xml(path: str, tests: dict):
+    """
+    the testcases of a junit xml report, as written by pytest --junitxml, surefire and gradle.
+    a testcase passed unless it has a failure, error or skipped child.
+    """
+    try:
+        root = ET.parse(path).getroot()
+    except (ET.ParseError, OSError):
+        return
+    for case in root.iter("testcase"):
+        outcome = "passed"
+        for child in case:
+            if child.tag == "failure":
+                outcome = "failed"
+            elif child.tag == "error":
+                outcome = "error"
+            elif child.tag == "skipped" and outcome == "passed":
+                outcome = "skipped"
+        tests[f"{case.get('classname', '')}::{case.get('name', '')}"] = outcome
+
+def parse_trx(path: str, tests: dict):
+    try:
+        root = ET.parse(path).getroot()
+    except (ET.ParseError, OSError):
+        return
+    outcomes = {"Passed": "passed", "Failed": "failed", "Error": "error", "Timeout": "error",
+                "Aborted": "error", "NotExecuted": "skipped", "Inconclusive": "skipped"}
+    for result in root.iter():
+        if result.tag.endswith("UnitTestResult"):
+            tests[result.get("testName", "")] = outcomes.get(result.get("outcome"), "error")
+
+class Reporter:
+    """
+    machine readable results of the test commands of one run of a task. command adds the report
+    options to a test command, feed takes the stdout lines while the command runs, and record turns
+    the reports and the log into a compact result entry:
+    {"verdict", "status", "tests": {test: outcome}, "log"}, the log cut to log_chars, left out if 0.
+    status is "ok", "timeout", or "no_report" when the tests did not get to report, e.g. a build failure.
+    the verdict is True if a test passed and none failed or errored.
+    """
+    def __init__(self, log_chars: int = 2000):
+        self.log_chars = log_chars
+        self.report_dir = tempfile.mkdtemp(prefix="run_test_report_")
+        self.tests = {}
+        self.package_failed = False
+
+    def command(self, command: str):
+        return command
+
+    def feed(self, line: str):
+        return line
+
+    def prepare(self):
+        pass
+
+    def collect(self):
+        pass
+
+    def record(self, log: str):
+        timed_out = "TimeOut ERROR" in log
+        self.collect()
+        if timed_out:
+            status = "timeout"
+        elif len(self.tests) == 0:
+            status = "no_report"
+        else:
+            status = "ok"
+        outcomes = list(self.tests.values())
+        verdict = status == "ok" and not self.package_failed and "passed" in outcomes \
+            and "failed" not in outcomes and "error" not in outcomes
+        entry = {"verdict": verdict, "status": status, "tests": self.tests}
+        if self.log_chars:
+            entry["log"] = truncate_log(log, self.log_chars)
+        return entry
+
+    def close(self):
+        shutil.rmtree(self.report_dir, ignore_errors=True)
+
+class PytestReporter(Reporter):
+    def command(self, command: str):
+        self.report_path = os.path.join(self.report_dir, "report.xml")
+        return f"{command} --junitxml={self.report_path}"
+
+    def collect(self):
+        if os.path.exists(self.report_path):
+            parse_junit_xml(self.report_path, self.tests)
+
+class GoJsonReporter(Reporter):
+    """
+    `go test -json` prints one event per line, the outcomes are taken from the events as they come.
+    the log is the output of the events, as go test prints it without -json.
+    """
+    def __init__(self, log_chars: int = 2000):
+        super().__init__(log_chars)
+        self.output = []
+
+    def command(self, command: str):
+        return command.replace("go test ", "go test -json ", 1)
+
+    def feed(self, line: str):
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            return line
+        if not isinstance(event, dict):
+            return line
+        action = event.get("Action")
+        if event.get("Test") is None:
+            if action == "fail":
+                self.package_failed = True
+        elif action in ("pass", "fail", "skip"):
+            # subtests are reported as Test/sub, their parent test has an outcome of its own
+            if "/" not in event["Test"]:
+                self.tests[f"{event.get('Package', '')}::{event['Test']}"] = \
+                    {"pass": "passed", "fail": "failed", "skip": "skipped"}[action]
+        return event.get("Output", "")
+
+class SurefireReporter(Reporter):
+    """
+    the TEST-*.xml reports surefire and gradle write into the modules of the test command: for every
+    segment of it the module it cd's into, the ones of maven's -pl or of gradle's :module:test tasks,
+    the subprojects too for a plain `gradle test`.
+    the ones of earlier runs are removed first. a module without reports did not get to run its tests,
+    e.g. it failed to compile, and so does a run whose log has a BUILD FAILURE or BUILD FAILED, like
+    parse_java_log
+    """
+    def __init__(self, cwd: str, test_command: str, log_chars: int = 2000):
+        super().__init__(log_chars)
+        segments = command_segments(test_command or "") or [("", test_command or "")]
+        self.module_report_dirs = []
+        for directory, command in segments:
+            modules = [""]
+            match = re.search(r"\s-pl (\S+)", command)
+            if match:
+                modules = match.group(1).split(",")
+            gradle_modules = re.findall(r"\s:(\S+):test\b", command)
+            if gradle_modules:
+                modules = [m.replace(":", "/") for m in gradle_modules]
+            # a plain `gradle test` runs the test tasks of the subprojects too
+            gradle_build = "**" if re.search(r"\bgradlew?\b", command) and not gradle_modules else ""
+            for module in modules:
+                module_path = os.path.normpath(os.path.join(cwd or os.getcwd(), directory, module))
+                self.module_report_dirs.append([os.path.join(module_path, "target", "surefire-reports"),
+                                                os.path.join(module_path, gradle_build, "build", "test-results", "test")])
+
+    def report_paths(self, report_dirs: list):
+        return [path for report_dir in report_dirs
+                for path in glob.glob(os.path.join(report_dir, "TEST-*.xml"), recursive=True)]
+
+    def prepare(self):
+        for report_dirs in self.module_report_dirs:
+            for path in self.report_paths(report_dirs):
+                os.remove(path)
+
+    def collect(self):
+        for report_dirs in self.module_report_dirs:
+            paths = self.report_paths(report_dirs)
+            if len(paths) == 0:
+                self.package_failed = True
+            for path in paths:
+                parse_junit_xml(path, self.tests)
+
+    def record(self, log: str):
+        # maven's and gradle's
+        if "BUILD FAILURE" in log or "BUILD FAILED" in log:
+            self.package_failed = True
+        return super().record(log)
+
+class TrxReporter(Reporter):
+    def command(self, command: str):
+        self.report_path = os.path.join(self.report_dir, "report.trx")
+        return f'{command} --results-directory {self.report_dir} --logger "trx;LogFileName=report.trx"'
+
+    def collect(self):
+        if os.path.exists(self.report_path):
+            parse_trx(self.report_path, self.tests)
+
+def make_reporter(lan: str, row, cwd: str, log_chars: int = 2000):
+    if lan == "py":
+        return PytestReporter(log_chars)
+    elif lan == "go":
+        return GoJsonReporter(log_chars)
+    elif lan == "java":
+        return SurefireReporter(cwd, row["test_command"], log_chars)
+    elif lan == "cs":
+        return TrxReporter(log_chars)
+    raise NotImplementedError("Error language type")
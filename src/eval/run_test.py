@@ -1,25 +1,36 @@
 import os
+import time
 import subprocess
 import pandas as pd
 import tqdm
 import json
 import argparse
+import threading
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import subprocess
 from eval.parse_run_log import parse_log, extract_code_blocks
+from eval.syntax_check import SyntaxChecker
+from eval.workspace import Workspace, WorkspacePool, COPY_MODES
+from eval.pytest_zygote import PytestZygote
+from eval.jvm_server import JvmTestServer, ServerChecks
+from eval.verdict_cache import VerdictCache
+from eval.checkpoint import Checkpoint, RestoreJournal
+from eval.command_runner import ResourceLimits, TimeoutModel, run_command, start_usage, read_usage
+from eval.baseline import load_profile, quarantine, schedule
+from eval.reporters import make_reporter
+from eval.warmup import BuildCache
+from eval.test_commands import NarrowedCommands
+from eval.task_queue import TaskQueue, run_worker, wait_for_results
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-df_path", help="Path to the input DataFrame file")
-parser.add_argument("-result_path", help="Path to the output result file")
-parser.add_argument("-lan", help="Programming language")
-
-args = parser.parse_args()
-
-df_path = args.df_path
-result_path = args.result_path
-lan = args.lan
-dataset_root = "/root/repos/"
-dataset_root = os.path.join(dataset_root, f'{lan}_data')
+# the options of the coordinator that decide the logs of a task, the queue workers take them from
+# queue.json. the ones of the host, e.g. -workers, -workspace_dir and -build_cache, are the worker's own
+QUEUE_SETTINGS = ["syntax_check", "pytest_zygote", "jvm_server", "jvm_server_checks", "narrowed_commands", "structured",
+                  "log_chars", "max_memory", "max_cpu", "max_procs", "max_output", "warm_up", "online", "profile",
+                  "quarantine"]
+QUEUE_PATHS = ["jvm_server_checks", "narrowed_commands", "profile"]
 
 def get_tab_count(s:str):
     if s[0] == ' ' or s[0] == '\t':
@@ -42,62 +53,73 @@ def get_tab_count(s:str):
     #             break
     # return tab_count
 
-def run_command_with_timeout(command, timeout):
-    try:
-        # 创建并运行子进程
-        result = subprocess.run(command, capture_output=True, timeout=timeout,
-                                    shell=True, text=True,
-                                    executable='/bin/bash', errors='ignore')        
-        return result
-    except subprocess.TimeoutExpired:
-        # 如果超时，终止进程
+def run_command_with_timeout(command, timeout, cwd=None, env=None, limits=None, reporter=None):
+    # 创建并运行子进程, 超时则终止整个进程组
+    if reporter is not None:
+        command = reporter.command(command)
+    result = run_command(command, timeout, cwd, env, limits, reporter.feed if reporter is not None else None)
+    if result is None:
         print("time out for command : ", command)
         return "TimeOut ERROR"
+    return result
 
-def run_cstest(row):
+def unique_test_funcs(test_funcs: str):
+    """
+    the tests of a task in their order, each once
+    """
+    return list(dict.fromkeys(t for t in test_funcs.split(" ") if t))
+
+def run_cstest(row, cwd=None, env=None, timeout=40, limits=None, reporter=None):
     
     base_command = "dotnet test --filter "
-    test_funcs = row["test_funcs"].split(" ")
+    test_funcs = unique_test_funcs(row["test_funcs"])
     args_func = []
     for t in test_funcs:
         path, func = t.split("::")
-        args_func.append(func)
+        if func not in args_func:
+            args_func.append(func)
     command = base_command + '"' + " | ".join(args_func) + '"'
 
     # if "shesha-framework" in row["file_path"]:
     #     command = "cd shesha-core && " + command + "; cd .."
 
-    result = run_command_with_timeout(command, 40)
+    result = run_command_with_timeout(command, timeout, cwd, env, limits, reporter)
     if isinstance(result, str):
         return result
     else:
         return result.stdout + "\n" + result.stderr
 
-def run_pytest(row):
+def run_pytest(row, cwd=None, env=None, timeout=40, limits=None, reporter=None):
     base_command = "pytest "
     
-    args = row['test_funcs']
+    args = " ".join(unique_test_funcs(row['test_funcs']))
     command = base_command + args
-    result = run_command_with_timeout(command, 40)
+    result = run_command_with_timeout(command, timeout, cwd, env, limits, reporter)
     if isinstance(result, str):
         return result
     else:
         return result.stdout + "\n" + result.stderr
 
-def run_javatest(row):
+def run_javatest(row, cwd=None, env=None, timeout=40, limits=None, reporter=None):
     
     result_log = ""
-    result = run_command_with_timeout(row['test_command'], 40)
+    result = run_command_with_timeout(row['test_command'], timeout, cwd, env, limits, reporter)
     if isinstance(result, str):
         result_log += result
     else:
         result_log += result.stdout + "\n" + result.stderr
     return result_log
 
-def run_gotest(row):
+def run_gotest(row, cwd=None, env=None, timeout=40, limits=None, reporter=None):
+    """
+    the tests of a package run in one `go test -run '^(A|B)$'`, so the package is built once.
+    the timeout is the one of a single test times the number of tests of the package,
+    a quarter of timeout for the tests in sub packages.
+    """
     result_log = ""
     func_file_name = os.path.basename(row['file_path'])
-    test_cases = row['test_funcs'].split(" ")
+    test_cases = unique_test_funcs(row['test_funcs'])
+    folder_tests = {}
     for t in test_cases:
         file_path = t.split("::")[0]
         file_name = os.path.basename(file_path)
@@ -105,30 +127,59 @@ def run_gotest(row):
             print("not test file")
             continue
         test_func = t.split("::")[1]
-        command = "go test -run " + test_func
-        if '/' not in file_path:
-            result = run_command_with_timeout(command, 40)
-            if isinstance(result, str):
-                result_log += result
-            else:
-                result_log += result.stdout + "\n" + result.stderr
+        folder_tests.setdefault(os.path.dirname(file_path), []).append(test_func)
+    for folder, test_funcs in folder_tests.items():
+        command = "go test -run '^(" + "|".join(test_funcs) + ")$'"
+        if folder == "":
+            result = run_command_with_timeout(command, timeout * len(test_funcs), cwd, env, limits, reporter)
+        else:
+            folder = os.path.join(cwd or os.getcwd(), folder)
+            result = run_command_with_timeout(command, timeout / 4 * len(test_funcs), folder, env, limits, reporter)
+        if isinstance(result, str):
+            result_log += result
         else:
-            folder = os.path.dirname(file_path)
-            cur_folder = os.getcwd()
-            os.chdir(folder)
-            result = run_command_with_timeout(command, 10)
-            if isinstance(result, str):
-                result_log += result
-            else:
-                result_log += result.stdout + "\n" + result.stderr
-            os.chdir(cur_folder)
+            result_log += result.stdout + "\n" + result.stderr
     return result_log
 
-def save_generate_code(file_path, start_line, end_line, code: str):
+def run_tests(row, lan, project_root, env=None, timeout=40, limits=None, zygote=None, structured=False,
+              log_chars=2000):
+    """
+    the log of the tests of a task, or with structured the result entry of eval.reporters,
+    with the outcome of every test from the junit, go test -json, surefire or trx report
+    """
+    reporter = make_reporter(lan, row, project_root, log_chars) if structured else None
+    try:
+        if reporter is not None:
+            reporter.prepare()
+        if lan == 'py':
+            test_result = None
+            if zygote is not None:
+                args = " ".join(unique_test_funcs(row['test_funcs']))
+                test_result = zygote.run(reporter.command(args) if reporter is not None else args, timeout)
+            if test_result is None:
+                test_result = run_pytest(row, project_root, env, timeout, limits, reporter)
+        elif lan == 'go':
+            test_result = run_gotest(row, project_root, env, timeout, limits, reporter)
+        elif lan == 'java':
+            test_result = None
+            if zygote is not None:
+                test_result = zygote.run(row, timeout)
+            if test_result is None:
+                test_result = run_javatest(row, project_root, env, timeout, limits, reporter)
+        elif lan == 'cs':
+            test_result = run_cstest(row, project_root, env, timeout, limits, reporter)
+        else:
+            raise NotImplementedError("Error language type")
+        if reporter is not None:
+            test_result = reporter.record(test_result)
+    finally:
+        if reporter is not None:
+            reporter.close()
+    return test_result
+
+def get_generate_code_lines(data, start_line, code: str):
     generated_code_lines = code.split('\n')
     generated_code_lines = [i+'\n' for i in generated_code_lines]
-    with open(file_path, 'r') as f:
-        data = f.readlines()
 
     # for method in class or inline method
     tab_count = get_tab_count(data[start_line])
@@ -136,6 +187,12 @@ def save_generate_code(file_path, start_line, end_line, code: str):
     need_tab = tab_count - exist_tab_count
     if need_tab > 0 :
         generated_code_lines = ['    '*need_tab + line for line in generated_code_lines]
+    return generated_code_lines
+
+def save_generate_code(file_path, start_line, end_line, code: str):
+    with open(file_path, 'r') as f:
+        data = f.readlines()
+    generated_code_lines = get_generate_code_lines(data, start_line, code)
     
     # remove existing code
     left_context = data[:start_line]
@@ -143,13 +200,22 @@ def save_generate_code(file_path, start_line, end_line, code: str):
     right_context = data[end_line+1:]
     new_data_lines = left_context + generated_code_lines + right_context
 
-    with open(file_path, 'w') as f:
-        f.write(''.join(new_data_lines))
+    write_file_lines(new_data_lines, file_path)
     return data
 
-def restore_file_lines(data_lines, file_path):
-    with open(file_path, 'w') as f:
+def write_file_lines(data_lines, file_path):
+    """
+    write a new file and move it over file_path, so a file hardlinked into a workspace copy
+    is replaced instead of written through to the project
+    """
+    tmp_path = file_path + ".run_test_tmp"
+    with open(tmp_path, 'w') as f:
         f.write(''.join(data_lines))
+    shutil.copymode(file_path, tmp_path)
+    os.replace(tmp_path, file_path)
+
+def restore_file_lines(data_lines, file_path):
+    write_file_lines(data_lines, file_path)
     return
 
 def check_code_style(code: str):
@@ -163,40 +229,301 @@ def check_code_style(code: str):
                 max_len_code = block
         return max_len_code
 
-def eval(test_df: pd.DataFrame, response_dict: dict, dataset_root: str, lan: str):
-    all_test_logs = {}
-    cwd = os.getcwd()
-    
-    for index, row in test_df.iterrows():
-        os.chdir(os.path.join(dataset_root, row['project']))
-        task_id = row['task-id']
-        file_path = os.path.join(dataset_root, row['project'], row['file_path'])
-        start_line = row['func_start']
-        end_line = row['func_end']
-        responses = response_dict[task_id]["response"]
-        test_logs = []
-        for r in responses:
+def eval_task(row, responses: list, project_root: str, lan: str, syntax_checker=None, env=None, zygote=None,
+              verdict_cache=None, cache_env=None, checkpoint=None, journal=None, timeout_model=None, limits=None,
+              structured=False, log_chars=2000):
+    """
+    run the tests of every response of one task in project_root, the project directory
+    or a workspace copy of it. the file of the task is restored after every response.
+    python tests run in the forked children of the zygote when there is one, java tests in the
+    eval.jvm_server.JvmTestServer passed as zygote.
+    with a verdict cache, a response whose canonical code was run before, in this list or
+    in an earlier run with the same cache_env, gets the stored log without running anything.
+    with a checkpoint, the samples it holds are not run again and every new log is appended to it,
+    the restore journal keeps the original file until the task is done.
+    the timeout of the tests is learned per project by timeout_model from the passing runs that ran
+    the test command as a subprocess. a run served by the zygote or the jvm server is far faster,
+    and the timeout must also hold when they fall back to the subprocess.
+    limits are the resource limits of the test commands.
+    with structured a test run gives the result entry of eval.reporters instead of the log.
+    """
+    task_id = row['task-id']
+    file_path = os.path.join(project_root, row['file_path'])
+    start_line = row['func_start']
+    end_line = row['func_end']
+    test_logs = []
+    done_logs = checkpoint.task_logs(task_id) if checkpoint is not None else {}
+    timeout = timeout_model.timeout(row['project'], 40) if timeout_model is not None else 40
+
+    def finish(test_result):
+        if checkpoint is not None:
+            checkpoint.append(task_id, len(test_logs), test_result)
+        test_logs.append(test_result)
+
+    if syntax_checker is not None and len(done_logs) < len(responses):
+        with open(file_path, 'r') as f:
+            file_lines = f.readlines()
+    seen_logs = {}
+    journaled = False
+    try:
+        for i, r in enumerate(responses):
+            if i in done_logs:
+                test_logs.append(done_logs[i])
+                continue
             code = check_code_style(r)
             if code is None:
-                test_logs.append("FAILED: No code block")
+                finish("FAILED: No code block")
                 continue
+            if verdict_cache is not None:
+                code_hash = verdict_cache.code_hash(code)
+                test_result = seen_logs.get(code_hash)
+                if test_result is None:
+                    test_result = verdict_cache.get(task_id, code_hash, cache_env)
+                if test_result is not None:
+                    print(f"task_id: {task_id} test_result (cached): {test_result}")
+                    seen_logs[code_hash] = test_result
+                    finish(test_result)
+                    continue
+            if syntax_checker is not None:
+                generated_code_lines = get_generate_code_lines(file_lines, start_line, code)
+                syntax_error = syntax_checker.check(file_path, file_lines, start_line, end_line,
+                                                    generated_code_lines, row['func_name'])
+                if syntax_error is not None:
+                    print(f"task_id: {task_id} test_result: {syntax_error}")
+                    finish(syntax_error)
+                    continue
+            if journal is not None and not journaled:
+                journal.patched(file_path)
+                journaled = True
             original_file_lines = save_generate_code(file_path, start_line, end_line, code)
-            test_dir = os.path.join(dataset_root, row['project'])
-            if lan == 'py':
-                test_result = run_pytest(row)
-            elif lan == 'go':
-                test_result = run_gotest(row)
-            elif lan == 'java':
-                test_result = run_javatest(row)
-            elif lan == 'cs':
-                test_result = run_cstest(row)
-            restore_file_lines(original_file_lines, file_path)
+            start_time = time.time()
+            start_usage()
+            try:
+                test_result = run_tests(row, lan, project_root, env, timeout, limits, zygote, structured, log_chars)
+            finally:
+                restore_file_lines(original_file_lines, file_path)
             print(f"task_id: {task_id} test_result: {test_result}")
-            test_logs.append(test_result)
-        os.chdir(cwd)
-        all_test_logs[task_id] = test_logs
-        
-    return all_test_logs
+            # the run went through run_command, not the zygote or the jvm server
+            ran_command = read_usage()[1] > 0
+            if timeout_model is not None and ran_command and parse_log(test_result, lan):
+                timeout_model.observe(row['project'], time.time() - start_time)
+            if verdict_cache is not None:
+                seen_logs[code_hash] = test_result
+                verdict_cache.put(task_id, code_hash, cache_env, test_result)
+            finish(test_result)
+    finally:
+        if journaled:
+            journal.restored(file_path)
+    return test_logs
+
+def prepare_task(row, lan, project_root, env=None, build_cache=None, narrowed_commands=None, limits=None):
+    """
+    the row and the environment of the test runs of a task in project_root: the project warmed up by
+    build_cache and its environment, and the narrowed or offline test command
+    """
+    task_row = row
+    if build_cache is not None:
+        build_cache.warm_up(row, lan, project_root, env)
+        env = build_cache.env(project_root, env)
+    if narrowed_commands is not None and lan == 'java':
+        task_row = narrowed_commands.task_row(task_row, project_root, env, limits)
+    if build_cache is not None:
+        task_row = build_cache.task_row(task_row, project_root)
+    return task_row, env
+
+def make_zygote(lan, project_root, env=None, limits=None, server_checks=None):
+    return PytestZygote(project_root, env, limits) if lan == 'py' else JvmTestServer(project_root, env, server_checks)
+
+def prepare_workspace(workspace, row, lan, project_path, use_zygote=False, build_cache=None,
+                      narrowed_commands=None, limits=None, server_checks=None):
+    """
+    check out the project of a task in workspace and prepare it, see prepare_task, with a zygote or
+    jvm server of the copy if use_zygote, the jvm servers of the task started and checked against
+    maven with server_checks on the clean copy. returns the task row, the copy and the environment.
+    """
+    copied = workspace.project_path != project_path
+    project_root = workspace.checkout(project_path)
+    if build_cache is not None and copied:
+        build_cache.forget(project_root)
+    task_row, env = prepare_task(row, lan, project_root, workspace.env(lan), build_cache, narrowed_commands, limits)
+    if use_zygote and (workspace.zygote is None or workspace.zygote.project_root != project_root):
+        workspace.zygote = make_zygote(lan, project_root, env, limits, server_checks)
+    if use_zygote and lan == 'java':
+        workspace.zygote.prepare(task_row)
+    return task_row, project_root, env
+
+def run_mode(lan, structured=False, log_chars=2000, use_zygote=False, limits=None):
+    """
+    how the tests of a run are run and reported, the logs of runs of different modes differ in shape
+    """
+    runner = ("zygote" if lan == 'py' else "jvm_server") if use_zygote else "subprocess"
+    report = f"structured:{log_chars}" if structured else "log"
+    max_output = limits.max_output if limits is not None else None
+    return f"{runner} {report} max_output:{max_output}"
+
+def make_timeout_model(timeout_stats=None, profile=None):
+    """
+    the TimeoutModel of the durations in timeout_stats, seeded with the passing runs of the profile,
+    None without either
+    """
+    timeout_model = TimeoutModel(timeout_stats) if timeout_stats else None
+    if profile:
+        if timeout_model is None:
+            timeout_model = TimeoutModel()
+        for entry in profile.values():
+            for seconds, passed in zip(entry['durations'], entry['passed']):
+                if passed:
+                    timeout_model.observe(entry['project'], seconds)
+    return timeout_model
+
+def select_rows(test_df: pd.DataFrame, test_selection=None):
+    """
+    the rows of test_df, with the tests of test_selection where it has a selection for the task
+    """
+    rows = []
+    for index, row in test_df.iterrows():
+        task_id = row['task-id']
+        if test_selection and task_id in test_selection:
+            row['test_funcs'] = test_selection[task_id]['test_funcs']
+            if test_selection[task_id]['test_command']:
+                row['test_command'] = test_selection[task_id]['test_command']
+        rows.append(row)
+    return rows
+
+def eval(test_df: pd.DataFrame, response_dict: dict, dataset_root: str, lan: str, syntax_check=False,
+         test_selection=None, workers=1, workspace_dir=None, copy_mode="reflink", pytest_zygote=False,
+         verdict_cache=None, checkpoint_path=None, resume=False, timeout_stats=None, limits=None,
+         profile=None, quarantine_tasks=False, structured=True, log_chars=2000, build_cache=None,
+         jvm_server=False, narrowed_commands=None, server_checks=None):
+    """
+    with one worker and no workspace_dir the tasks run one after another in the project directories.
+    otherwise every worker owns a workspace with its own copy of the project, and the tasks are
+    spread over the workers. the logs are returned in the order of test_df in both modes.
+    verdict_cache is the path of the sqlite verdict cache, see eval.verdict_cache.
+    with checkpoint_path every finished sample is appended to that jsonl, and the files left patched
+    by an interrupted run are restored from the journal in checkpoint_path + ".restore" first.
+    resume keeps the samples already in the checkpoint instead of starting it over.
+    with timeout_stats, the json of the durations of passing runs per project, the timeouts are
+    learned per project, see eval.command_runner.TimeoutModel. limits are the ResourceLimits of
+    the test commands.
+    profile is the baseline of eval.baseline, task-id -> the runs of the original function. its
+    durations seed the timeouts and order the tasks of the workers longest first. with
+    quarantine_tasks the tasks whose original function is broken or flaky are not run, every
+    sample of them gets a "QUARANTINED" log.
+    with structured, the default, the tests report in junit xml, go test -json, surefire xml or trx,
+    and every test run is stored as {"verdict", "status", "tests", "log"} with the log cut to
+    log_chars, see eval.reporters. the tests of a batched invocation get their outcomes from its own
+    report, e.g. per go package. without it the full log is stored. the samples that are not run
+    keep their string logs, parse_log reads both.
+    build_cache is an eval.warmup.BuildCache, the go and java projects are warmed up in the directory
+    the tests run in before their first task, the project directory or the copy of a workspace.
+    with jvm_server the java tests run in the warm jvms of eval.jvm_server, maven runs the ones they
+    can not, the pytest zygote and the jvm server take the same place. a module runs in a jvm only
+    once server_checks, an eval.jvm_server.ServerChecks, found it equivalent to maven, a new one by default.
+    narrowed_commands is an eval.test_commands.NarrowedCommands, the java tasks whose narrowed test
+    command is valid run it instead of their test_command, which the jvm server does not take.
+    """
+    rows = select_rows(test_df, test_selection)
+    task_ids = [row['task-id'] for row in rows]
+
+    all_test_logs = {}
+    if profile and quarantine_tasks:
+        rows, quarantined = quarantine(rows, profile)
+        for row in quarantined:
+            status = profile[row['task-id']]['status']
+            print(f"task_id: {row['task-id']} quarantined, {status} ground truth")
+            all_test_logs[row['task-id']] = [f"QUARANTINED: {status} ground truth"] * len(response_dict[row['task-id']]["response"])
+    use_zygote = (pytest_zygote and lan == 'py') or (jvm_server and lan == 'java')
+    if use_zygote and lan == 'java' and server_checks is None:
+        server_checks = ServerChecks()
+    cache = VerdictCache(verdict_cache, lan) if verdict_cache else None
+    mode = run_mode(lan, structured, log_chars, use_zygote, limits)
+    def cache_env(task_row):
+        # the fingerprint is taken of the project in dataset_root, not of a workspace copy
+        return cache.env(task_row, os.path.join(dataset_root, task_row['project']), mode) if cache is not None else None
+    journal = RestoreJournal(checkpoint_path + ".restore") if checkpoint_path else None
+    checkpoint = Checkpoint(checkpoint_path, resume) if checkpoint_path else None
+    timeout_model = make_timeout_model(timeout_stats, profile)
+    def finished_logs(row):
+        # the logs of a task the checkpoint holds every sample of, its project need not be set up
+        responses = response_dict[row['task-id']]["response"]
+        done_logs = checkpoint.task_logs(row['task-id']) if checkpoint is not None else {}
+        if all(i in done_logs for i in range(len(responses))):
+            return [done_logs[i] for i in range(len(responses))]
+        return None
+
+    if workers <= 1 and workspace_dir is None:
+        syntax_checker = SyntaxChecker(lan) if syntax_check else None
+        zygote = None
+        try:
+            for row in rows:
+                test_logs = finished_logs(row)
+                if test_logs is not None:
+                    all_test_logs[row['task-id']] = test_logs
+                    continue
+                project_root = os.path.join(dataset_root, row['project'])
+                task_row, env = prepare_task(row, lan, project_root, None, build_cache, narrowed_commands, limits)
+                if use_zygote and (zygote is None or zygote.project_root != project_root):
+                    if zygote is not None:
+                        zygote.close()
+                    zygote = make_zygote(lan, project_root, env, limits, server_checks)
+                if use_zygote and lan == 'java':
+                    zygote.prepare(task_row)
+                all_test_logs[row['task-id']] = eval_task(task_row, response_dict[row['task-id']]["response"],
+                                                          project_root, lan, syntax_checker, env, zygote,
+                                                          cache, cache_env(task_row), checkpoint, journal,
+                                                          timeout_model, limits, structured, log_chars)
+        finally:
+            if zygote is not None:
+                zygote.close()
+            close_run_state(cache, checkpoint, journal, timeout_model)
+        return {task_id: all_test_logs[task_id] for task_id in task_ids}
+
+    if profile:
+        rows = schedule(rows, profile, {task_id: len(response_dict[task_id]["response"]) for task_id in task_ids})
+    remove_workspace_dir = workspace_dir is None
+    if workspace_dir is None:
+        workspace_dir = tempfile.mkdtemp(prefix="run_test_")
+    pool = WorkspacePool([Workspace(os.path.join(workspace_dir, f"worker_{i}"), copy_mode,
+                                    SyntaxChecker(lan) if syntax_check else None) for i in range(max(workers, 1))])
+
+    def run_task(row):
+        test_logs = finished_logs(row)
+        if test_logs is not None:
+            return test_logs
+        project_path = os.path.join(dataset_root, row['project'])
+        workspace = pool.acquire(project_path)
+        try:
+            task_row, project_root, env = prepare_workspace(workspace, row, lan, project_path, use_zygote,
+                                                            build_cache, narrowed_commands, limits, server_checks)
+            return eval_task(task_row, response_dict[row['task-id']]["response"], project_root, lan,
+                             workspace.syntax_checker, env, workspace.zygote,
+                             cache, cache_env(task_row), checkpoint, journal, timeout_model, limits,
+                             structured, log_chars)
+        finally:
+            pool.release(workspace)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for row, test_logs in zip(rows, executor.map(run_task, rows)):
+                all_test_logs[row['task-id']] = test_logs
+    finally:
+        pool.close()
+        if remove_workspace_dir:
+            shutil.rmtree(workspace_dir, ignore_errors=True)
+        close_run_state(cache, checkpoint, journal, timeout_model)
+    return {task_id: all_test_logs[task_id] for task_id in task_ids}
+
+def close_run_state(cache, checkpoint, journal, timeout_model):
+    if cache is not None:
+        print(f"verdict cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+    if checkpoint is not None:
+        checkpoint.close()
+    if journal is not None:
+        journal.close()
+    if timeout_model is not None:
+        timeout_model.save()
 
 def get_pass_k(all_test_log, lan):
     pass_result = {}
@@ -213,13 +540,113 @@ def get_pass_k(all_test_log, lan):
         
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-df_path", help="Path to the input DataFrame file")
+    parser.add_argument("-result_path", help="Path to the output result file")
+    parser.add_argument("-lan", help="Programming language")
+    parser.add_argument("-syntax_check", action="store_true", help="reject candidates that do not parse before running their tests")
+    parser.add_argument("-test_selection", default=None, help="json of the tests selected per task by parser.test_impact")
+    parser.add_argument("-workers", type=int, default=1, help="tasks run at the same time, each in its own copy of the project")
+    parser.add_argument("-workspace_dir", default=None, help="directory of the project copies of the workers, a temporary one if empty")
+    parser.add_argument("-copy_mode", default="reflink", choices=COPY_MODES, help="how the workers copy the projects")
+    parser.add_argument("-pytest_zygote", action="store_true", help="fork the python tests from a warm pytest process per project")
+    parser.add_argument("-jvm_server", action="store_true", help="run the java tests in a warm jvm per maven module, maven for the ones it can not run or that differ from maven on their first task")
+    parser.add_argument("-jvm_server_checks", default=None, help="json of the checks of the jvm test servers against maven per module, kept across runs")
+    parser.add_argument("-narrowed_commands", default=None, help="json of the narrowed java test commands, validated once per task and used where they agree with test_command")
+    parser.add_argument("-verdict_cache", default=None, help="sqlite file of the test logs of candidates already run, reused across runs")
+    parser.add_argument("-checkpoint", action="store_true", help="append every finished sample to <result_path>_checkpoint.jsonl")
+    parser.add_argument("-resume", action="store_true", help="continue from the checkpoint of an interrupted run, implies -checkpoint")
+    parser.add_argument("-timeout_stats", default=None, help="json of the test durations per project, the timeouts are learned from it and it is updated")
+    parser.add_argument("-max_memory", type=int, default=None, help="memory limit of a test command in MB")
+    parser.add_argument("-max_cpu", type=int, default=None, help="cpu time limit of a test command in seconds, of each process with rlimits, of all of them together with -cgroup_root")
+    parser.add_argument("-max_procs", type=int, default=None, help="process limit of a test command")
+    parser.add_argument("-profile", default=None, help="baseline profile json of eval.baseline, to schedule the tasks and seed the timeouts")
+    parser.add_argument("-quarantine", action="store_true", help="do not run the tasks whose ground truth is broken or flaky in the profile")
+    parser.add_argument("-structured", action="store_true", default=True, help="store the outcome of every test from the reports of the test tools, the default")
+    parser.add_argument("-raw_logs", dest="structured", action="store_false", help="store the full log of every test run instead of the outcomes of its tests")
+    parser.add_argument("-log_chars", type=int, default=2000, help="characters of the log kept with -structured, 0 for none")
+    parser.add_argument("-max_output", type=int, default=None, help="characters kept of the stdout and the stderr of a test command, head, tail and summary lines")
+    parser.add_argument("-spill_dir", default=None, help="directory to write the full output of the test commands to, gzipped, with -max_output")
+    parser.add_argument("-warm_up", action="store_true", help="warm up the build caches of the go and java projects before their first task")
+    parser.add_argument("-build_cache", default=None, help="directory of the GOCACHE, GOMODCACHE and maven repository shared by the workers, implies -warm_up")
+    parser.add_argument("-online", action="store_true", help="keep the network for the test commands of warmed up projects, no GOPROXY=off and mvn -o")
+    parser.add_argument("-queue_dir", default=None, help="directory of a task queue shared by the coordinator and any number of workers")
+    parser.add_argument("-queue_role", default="coordinator", choices=["coordinator", "worker"], help="the coordinator fills the queue and merges the results, the workers run the tasks")
+    parser.add_argument("-lease_timeout", type=float, default=600, help="seconds after which a task leased by a worker that stopped touching it goes back to the queue")
+    parser.add_argument("-queue_batch", type=int, default=8, help="tasks of one project a worker leases at a time")
+    parser.add_argument("-cgroup_root", default=None, help="cgroup v2 directory to create a cgroup per test command in, rlimits are used otherwise. on its own it only puts every test command in a cgroup, killed with all its processes after the run")
+
+    args = parser.parse_args()
+
+    queue = TaskQueue(args.queue_dir, args.lease_timeout) if args.queue_dir else None
+    if queue is not None and args.queue_role == "worker":
+        # a worker runs the evaluation the coordinator put into the queue
+        while queue.config() is None:
+            print("waiting for the coordinator to fill", args.queue_dir)
+            time.sleep(10)
+        config = queue.config()
+        args.df_path, args.result_path = config["df_path"], config["result_path"]
+        args.lan, args.test_selection = config["lan"], config["test_selection"]
+        for name in QUEUE_SETTINGS:
+            if name in config:
+                setattr(args, name, config[name])
+
+    df_path = args.df_path
+    result_path = args.result_path
+    lan = args.lan
+    dataset_root = "/root/repos/"
+    dataset_root = os.path.join(dataset_root, f'{lan}_data')
+
     test_data_df = pd.read_excel(df_path)
     # test_data_df = test_data_df[test_data_df['project']=='textual']
     with open(result_path, 'r') as f:
         response_dict = json.load(f)
 
-    all_test_log = eval(test_data_df, response_dict, dataset_root, lan)
-    with open(result_path+'_testresult.json', 'w') as f:
-        json.dump(all_test_log, f)
+    test_selection = None
+    if args.test_selection:
+        with open(args.test_selection, 'r') as f:
+            test_selection = json.load(f)
+    limits = None
+    if args.max_memory or args.max_cpu or args.max_procs or args.max_output or args.cgroup_root:
+        limits = ResourceLimits(args.max_memory * 1024 * 1024 if args.max_memory else None,
+                                args.max_cpu, args.max_procs, args.cgroup_root, args.max_output, args.spill_dir)
+    build_cache = BuildCache(args.build_cache, not args.online) if args.warm_up or args.build_cache else None
+    narrowed_commands = NarrowedCommands(args.narrowed_commands) if args.narrowed_commands else None
+    server_checks = ServerChecks(args.jvm_server_checks) if args.jvm_server else None
+    def evaluate(df, workspace_dir, checkpoint_path=None):
+        return eval(df, response_dict, dataset_root, lan, args.syntax_check, test_selection,
+                    args.workers, workspace_dir, args.copy_mode, args.pytest_zygote, args.verdict_cache,
+                    checkpoint_path, args.resume, args.timeout_stats, limits, load_profile(args.profile),
+                    args.quarantine, args.structured, args.log_chars, build_cache, args.jvm_server, narrowed_commands,
+                    server_checks)
+
+    if queue is not None and args.queue_role == "worker":
+        # the workers of a host share the project directories, every one tests in copies of its own
+        workspace_dir = tempfile.mkdtemp(prefix="run_test_queue_", dir=args.workspace_dir)
+        try:
+            run_worker(queue, lambda task_ids: evaluate(test_data_df[test_data_df['task-id'].isin(task_ids)], workspace_dir),
+                       args.queue_batch)
+        finally:
+            shutil.rmtree(workspace_dir, ignore_errors=True)
+    else:
+        if queue is not None:
+            rows = select_rows(test_data_df, test_selection)
+            task_samples = {row['task-id']: len(response_dict[row['task-id']]["response"]) for row in rows}
+            profile = load_profile(args.profile)
+            if profile:
+                rows = schedule(rows, profile, task_samples)
+            config = {"df_path": os.path.abspath(df_path), "result_path": os.path.abspath(result_path), "lan": lan,
+                      "test_selection": os.path.abspath(args.test_selection) if args.test_selection else None}
+            for name in QUEUE_SETTINGS:
+                value = getattr(args, name)
+                config[name] = os.path.abspath(value) if name in QUEUE_PATHS and value else value
+            if not queue.enqueue(rows, config):
+                print("continuing the queue in", args.queue_dir)
+            all_test_log = wait_for_results(queue, task_samples)
+        else:
+            all_test_log = evaluate(test_data_df, args.workspace_dir,
+                                    result_path+'_checkpoint.jsonl' if args.checkpoint or args.resume else None)
+        with open(result_path+'_testresult.json', 'w') as f:
+            json.dump(all_test_log, f)
 
-    get_pass_k(all_test_log, lan)
\ No newline at end of file
+        get_pass_k(all_test_log, lan)
\ No newline at end of file
@@ -0,0 +1,354 @@
+import argparse
+import collections
+import json
+import math
+import os
+import shutil
+import signal
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from eval.run_test import select_rows, eval_task, prepare_workspace, make_timeout_model, close_run_state, run_mode
+from eval.parse_run_log import parse_log
+from eval.syntax_check import SyntaxChecker
+from eval.workspace import Workspace, WorkspacePool, COPY_MODES
+from eval.verdict_cache import VerdictCache
+from eval.command_runner import ResourceLimits
+from eval.baseline import load_profile, quarantine
+from eval.warmup import BuildCache
+from eval.test_commands import NarrowedCommands
+from eval.jvm_server import ServerChecks
+
+class Busy(Exception):
+    """
+    a submission turned away, the service has max_pending submissions waiting already or no worker
+    was free in time
+    """
+
+class EvalService:
+    """
+    the tests of run_test behind a long-running service, for the methods that generate, test and refine
+    in a loop: the dataset is read once, and the workspaces keep their project copies, warm build caches,
+    pytest zygotes and jvm test servers across the submissions. a submission is the code of one task,
+    tested like a sample of run_test.eval in a workspace, at most one per worker at a time. a submission
+    waits for a free worker at most queue_timeout seconds, and is turned away at once if max_pending
+    submissions wait already, so a client learns it should back off instead of queuing up.
+    the other settings are the ones of run_test.eval, server_checks shared by the workspaces, the results are the structured entries of
+    eval.reporters unless structured is off.
+    """
+    def __init__(self, test_df: pd.DataFrame, dataset_root: str, lan: str, workers=1, workspace_dir=None,
+                 copy_mode="reflink", syntax_check=False, test_selection=None, pytest_zygote=False,
+                 jvm_server=False, verdict_cache=None, timeout_stats=None, limits=None, profile=None,
+                 quarantine_tasks=False, structured=True, log_chars=2000, build_cache=None,
+                 narrowed_commands=None, max_pending=None, queue_timeout=None, server_checks=None):
+        self.dataset_root = dataset_root
+        self.lan = lan
+        self.rows = {row['task-id']: row for row in select_rows(test_df, test_selection)}
+        self.quarantined = {}
+        if profile and quarantine_tasks:
+            _, quarantined = quarantine(list(self.rows.values()), profile)
+            self.quarantined = {row['task-id']: profile[row['task-id']]['status'] for row in quarantined}
+        self.use_zygote = (pytest_zygote and lan == 'py') or (jvm_server and lan == 'java')
+        self.cache = VerdictCache(verdict_cache, lan) if verdict_cache else None
+        self.mode = run_mode(lan, structured, log_chars, self.use_zygote, limits)
+        self.timeout_model = make_timeout_model(timeout_stats, profile)
+        self.limits = limits
+        self.structured = structured
+        self.log_chars = log_chars
+        self.build_cache = build_cache
+        self.narrowed_commands = narrowed_commands
+        self.server_checks = server_checks if server_checks is not None else ServerChecks()
+        self.workers = max(workers, 1)
+        self.max_pending = max_pending if max_pending is not None else 4 * self.workers
+        self.queue_timeout = queue_timeout
+        self.remove_workspace_dir = workspace_dir is None
+        self.workspace_dir = workspace_dir if workspace_dir is not None else tempfile.mkdtemp(prefix="eval_service_")
+        self.pool = WorkspacePool([Workspace(os.path.join(self.workspace_dir, f"worker_{i}"), copy_mode,
+                                             SyntaxChecker(lan) if syntax_check else None)
+                                   for i in range(self.workers)])
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.counts = collections.Counter()
+        # the latencies of the last submissions, {"queued", "setup", "test", "total"} in seconds
+        self.latencies = collections.deque(maxlen=10000)
+        self.start_time = time.time()
+
+    def project_path(self, row):
+        return os.path.join(self.dataset_root, row['project'])
+
+    def cache_env(self, task_row):
+        # the fingerprint is taken of the project in dataset_root, not of a workspace copy
+        return self.cache.env(task_row, self.project_path(task_row), self.mode) if self.cache is not None else None
+
+    def preload(self):
+        """
+        check out and warm up the projects with the most tasks, one per workspace, in parallel
+        """
+        projects = collections.Counter(row['project'] for row in self.rows.values()).most_common(self.workers)
+        rows = {}
+        for row in self.rows.values():
+            rows.setdefault(row['project'], row)
+
+        def prepare(project):
+            row = rows[project]
+            # the workspaces are released after every project is loaded, so each gets its own
+            workspace = self.pool.acquire(self.project_path(row))
+            start_time = time.time()
+            try:
+                prepare_workspace(workspace, row, self.lan, self.project_path(row), self.use_zygote,
+                                  self.build_cache, self.narrowed_commands, self.limits, self.server_checks)
+                print(f"preloaded {project} in {round(time.time() - start_time, 1)}s")
+            except Exception as e:
+                print(f"preload of {project} failed: {e!r}")
+            return workspace
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            workspaces = list(executor.map(prepare, [project for project, _ in projects]))
+        for workspace in workspaces:
+            self.pool.release(workspace)
+
+    def submit(self, task_id: str, code: str, wait: float = None):
+        """
+        test code as the function of task_id. code is a response with a fenced code block, the longest
+        block is taken like for the samples of run_test, or the bare code. wait overrides queue_timeout.
+        returns {"task_id", "passed", "result", "latency"}, raises KeyError for an unknown task and Busy.
+        """
+        start_time = time.time()
+        row = self.rows.get(task_id)
+        if row is None:
+            raise KeyError(task_id)
+        response = code if "```" in code else f"```\n{code}\n```"
+        if task_id in self.quarantined:
+            result = f"QUARANTINED: {self.quarantined[task_id]} ground truth"
+            return self.finish(task_id, result, start_time, start_time, start_time)
+
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.counts["rejected"] += 1
+                raise Busy(f"{self.pending} submissions waiting for a worker")
+            self.pending += 1
+        try:
+            workspace = self.pool.acquire(self.project_path(row), wait if wait is not None else self.queue_timeout)
+        finally:
+            with self.lock:
+                self.pending -= 1
+        if workspace is None:
+            with self.lock:
+                self.counts["rejected"] += 1
+            raise Busy("no worker free in time")
+
+        queued_time = time.time()
+        with self.lock:
+            self.running += 1
+        try:
+            task_row, project_root, env = prepare_workspace(workspace, row, self.lan, self.project_path(row),
+                                                            self.use_zygote, self.build_cache,
+                                                            self.narrowed_commands, self.limits, self.server_checks)
+            setup_time = time.time()
+            result = eval_task(task_row, [response], project_root, self.lan, workspace.syntax_checker, env,
+                               workspace.zygote, self.cache, self.cache_env(task_row), None, None,
+                               self.timeout_model, self.limits, self.structured, self.log_chars)[0]
+        finally:
+            self.pool.release(workspace)
+            with self.lock:
+                self.running -= 1
+        return self.finish(task_id, result, queued_time, setup_time, start_time)
+
+    def finish(self, task_id: str, result, queued_time: float, setup_time: float, start_time: float):
+        end_time = time.time()
+        latency = {"queued": queued_time - start_time, "setup": setup_time - queued_time,
+                   "test": end_time - setup_time, "total": end_time - start_time}
+        latency = {k: round(v, 3) for k, v in latency.items()}
+        passed = parse_log(result, self.lan)
+        with self.lock:
+            self.counts["passed" if passed else "failed"] += 1
+            self.latencies.append(latency)
+        return {"task_id": task_id, "passed": passed, "result": result, "latency": latency}
+
+    def tasks(self):
+        return [{"task_id": task_id, "project": row['project'], "file_path": row['file_path'],
+                 "func_start": int(row['func_start']), "func_end": int(row['func_end']),
+                 "quarantined": task_id in self.quarantined}
+                for task_id, row in self.rows.items()]
+
+    def stats(self):
+        """
+        the counts of the submissions and the percentiles of their latencies
+        """
+        with self.lock:
+            latencies = list(self.latencies)
+            stats = {"uptime": round(time.time() - self.start_time, 1), "workers": self.workers,
+                     "running": self.running, "pending": self.pending, "max_pending": self.max_pending,
+                     "submissions": dict(self.counts)}
+        stats["latency"] = {}
+        for key in ["queued", "setup", "test", "total"]:
+            values = sorted(latency[key] for latency in latencies)
+            if len(values) == 0:
+                continue
+            stats["latency"][key] = {f"p{p}": values[min(len(values) * p // 100, len(values) - 1)]
+                                     for p in [50, 90, 99]}
+            stats["latency"][key]["max"] = values[-1]
+        if self.cache is not None:
+            stats["verdict_cache"] = {"hits": self.cache.hits, "misses": self.cache.misses}
+        return stats
+
+    def close(self):
+        self.pool.close()
+        if self.remove_workspace_dir:
+            shutil.rmtree(self.workspace_dir, ignore_errors=True)
+        close_run_state(self.cache, None, None, self.timeout_model)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET /tasks, GET /stats and POST /submit with {"task_id", "code", "wait"}, json in and out.
+    400 for a bad submission, 404 for an unknown task, 429 if the service is busy, with Retry-After,
+    500 if the run failed.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, status: int, body, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/tasks":
+            self.reply(200, self.server.service.tasks())
+        elif self.path == "/stats":
+            self.reply(200, self.server.service.stats())
+        else:
+            self.reply(404, {"error": f"no such path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/submit":
+            self.reply(404, {"error": f"no such path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            task_id, code, wait = request["task_id"], request["code"], request.get("wait")
+            if not isinstance(task_id, str) or not isinstance(code, str):
+                raise ValueError("task_id or code is not a string")
+            if wait is not None and (isinstance(wait, bool) or not isinstance(wait, (int, float))
+                                     or not math.isfinite(wait) or wait < 0):
+                raise ValueError("wait is not a number of seconds")
+        except (ValueError, KeyError, TypeError) as e:
+            self.reply(400, {"error": f"bad submission: {e!r}"})
+            return
+        if task_id not in self.server.service.rows:
+            self.reply(404, {"error": f"no task {task_id}"})
+            return
+        try:
+            self.reply(200, self.server.service.submit(task_id, code, wait))
+        except Busy as e:
+            self.reply(429, {"error": str(e)}, {"Retry-After": "1"})
+        except Exception as e:
+            # e.g. a workspace that could not be checked out, the client gets an answer all the same
+            print(f"submission of {task_id} failed: {e!r}")
+            self.reply(500, {"error": f"run failed: {e!r}"})
+
+    def address_string(self):
+        # the client address of a unix socket is empty
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(service: EvalService, host="127.0.0.1", port=8765, socket_path=None):
+    """
+    serve the service on host:port, or on the unix socket socket_path, until interrupted
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ServiceHandler)
+        print(f"eval service on {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), ServiceHandler)
+        print(f"eval service on http://{host}:{server.server_address[1]}")
+    server.service = service
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-df_path", help="Path to the input DataFrame file")
+    parser.add_argument("-lan", help="Programming language")
+    parser.add_argument("-host", default="127.0.0.1", help="address to serve on")
+    parser.add_argument("-port", type=int, default=8765, help="port to serve on")
+    parser.add_argument("-socket", default=None, help="unix socket to serve on instead of the port")
+    parser.add_argument("-workers", type=int, default=1, help="submissions tested at the same time, each in its own copy of the project")
+    parser.add_argument("-max_pending", type=int, default=None, help="submissions waiting for a worker before the next ones are turned away, 4 per worker by default")
+    parser.add_argument("-queue_timeout", type=float, default=None, help="seconds a submission waits for a worker before it is turned away, no limit by default")
+    parser.add_argument("-preload", action="store_true", help="check out and warm up the projects with the most tasks, one per worker, before serving")
+    parser.add_argument("-workspace_dir", default=None, help="directory of the project copies of the workers, a temporary one if empty")
+    parser.add_argument("-copy_mode", default="reflink", choices=COPY_MODES, help="how the workers copy the projects")
+    parser.add_argument("-syntax_check", action="store_true", help="reject submissions that do not parse before running their tests")
+    parser.add_argument("-test_selection", default=None, help="json of the tests selected per task by parser.test_impact")
+    parser.add_argument("-pytest_zygote", action="store_true", help="fork the python tests from a warm pytest process per project")
+    parser.add_argument("-jvm_server", action="store_true", help="run the java tests in a warm jvm per maven module, maven for the ones it can not run or that differ from maven on their first task")
+    parser.add_argument("-jvm_server_checks", default=None, help="json of the checks of the jvm test servers against maven per module, kept across runs")
+    parser.add_argument("-narrowed_commands", default=None, help="json of the narrowed java test commands, validated once per task and used where they agree with test_command")
+    parser.add_argument("-verdict_cache", default=None, help="sqlite file of the test logs of candidates already run, reused across submissions")
+    parser.add_argument("-timeout_stats", default=None, help="json of the test durations per project, the timeouts are learned from it and it is updated")
+    parser.add_argument("-profile", default=None, help="baseline profile json of eval.baseline, to seed the timeouts")
+    parser.add_argument("-quarantine", action="store_true", help="do not run the tasks whose ground truth is broken or flaky in the profile")
+    parser.add_argument("-raw_logs", action="store_true", help="return the full logs instead of the outcome of every test")
+    parser.add_argument("-log_chars", type=int, default=2000, help="characters of the log kept in the structured results, 0 for none")
+    parser.add_argument("-max_memory", type=int, default=None, help="memory limit of a test command in MB")
+    parser.add_argument("-max_cpu", type=int, default=None, help="cpu time limit of a test command in seconds, of each process with rlimits, of all of them together with -cgroup_root")
+    parser.add_argument("-max_procs", type=int, default=None, help="process limit of a test command")
+    parser.add_argument("-max_output", type=int, default=None, help="characters kept of the stdout and the stderr of a test command, head, tail and summary lines")
+    parser.add_argument("-spill_dir", default=None, help="directory to write the full output of the test commands to, gzipped, with -max_output")
+    parser.add_argument("-cgroup_root", default=None, help="cgroup v2 directory to create a cgroup per test command in, rlimits are used otherwise. on its own it only puts every test command in a cgroup, killed with all its processes after the run")
+    parser.add_argument("-warm_up", action="store_true", help="warm up the build caches of the go and java projects before their first submission")
+    parser.add_argument("-build_cache", default=None, help="directory of the GOCACHE, GOMODCACHE and maven repository shared by the workers, implies -warm_up")
+    parser.add_argument("-online", action="store_true", help="keep the network for the test commands of warmed up projects, no GOPROXY=off and mvn -o")
+    args = parser.parse_args()
+
+    dataset_root = os.path.join("/root/repos/", f'{args.lan}_data')
+    test_data_df = pd.read_excel(args.df_path)
+    test_selection = None
+    if args.test_selection:
+        with open(args.test_selection, 'r') as f:
+            test_selection = json.load(f)
+    limits = None
+    if args.max_memory or args.max_cpu or args.max_procs or args.max_output or args.cgroup_root:
+        limits = ResourceLimits(args.max_memory * 1024 * 1024 if args.max_memory else None,
+                                args.max_cpu, args.max_procs, args.cgroup_root, args.max_output, args.spill_dir)
+    build_cache = BuildCache(args.build_cache, not args.online) if args.warm_up or args.build_cache else None
+    narrowed_commands = NarrowedCommands(args.narrowed_commands) if args.narrowed_commands else None
+    server_checks = ServerChecks(args.jvm_server_checks) if args.jvm_server else None
+
+    service = EvalService(test_data_df, dataset_root, args.lan, args.workers, args.workspace_dir, args.copy_mode,
+                          args.syntax_check, test_selection, args.pytest_zygote, args.jvm_server,
+                          args.verdict_cache, args.timeout_stats, limits, load_profile(args.profile),
+                          args.quarantine, not args.raw_logs, args.log_chars, build_cache, narrowed_commands,
+                          args.max_pending, args.queue_timeout, server_checks)
+    # a SIGTERM shuts down like ctrl-c, the zygotes, jvm servers and project copies are cleaned up
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if args.preload:
+            service.preload()
+        print(f"{len(service.rows)} tasks, {service.workers} workers")
+        serve(service, args.host, args.port, args.socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
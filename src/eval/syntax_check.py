@@ -0,0 +1,125 @@
+import tree_sitter_python as tspy
+import tree_sitter_go as tsgo
+import tree_sitter_java as tsjava
+import tree_sitter_c_sharp as tscs
+from tree_sitter import Language, Parser, Node
+
+LANGUAGE_MODULES = {"py": tspy, "go": tsgo, "java": tsjava, "cs": tscs}
+
+FUNCTION_TYPES = {
+    "py": ["function_definition"],
+    "go": ["function_declaration", "method_declaration"],
+    "java": ["method_declaration", "constructor_declaration"],
+    "cs": ["method_declaration", "constructor_declaration", "local_function_statement"],
+}
+
+# methods of java and c# only parse inside a class body, e.g. constructors
+SNIPPET_WRAPPERS = {
+    "py": (b"", b""),
+    "go": (b"", b""),
+    "java": (b"class Wrapper {\n", b"\n}\n"),
+    "cs": (b"class Wrapper {\n", b"\n}\n"),
+}
+
+def move_point(point: tuple, text: bytes):
+    """
+    the (row, column) reached after text, starting at point
+    """
+    rows = text.count(b"\n")
+    if rows == 0:
+        return (point[0], point[1] + len(text))
+    return (point[0] + rows, len(text) - text.rfind(b"\n") - 1)
+
+def find_error(node: Node, start_byte: int, end_byte: int):
+    """
+    the first ERROR or missing node overlapping [start_byte, end_byte), only subtrees with errors are visited
+    """
+    if node.end_byte < start_byte or node.start_byte > end_byte:
+        return None
+    if node.is_error or node.is_missing:
+        return node
+    if not node.has_error:
+        return None
+    for child in node.children:
+        error = find_error(child, start_byte, end_byte)
+        if error is not None:
+            return error
+    return None
+
+def find_function_names(node: Node, start_byte: int, end_byte: int, function_types: list):
+    names = []
+    if node.end_byte <= start_byte or node.start_byte >= end_byte:
+        return names
+    if node.type in function_types:
+        name = node.child_by_field_name("name")
+        if name is not None:
+            names.append(name.text.decode("utf-8", errors="ignore"))
+    for child in node.children:
+        names.extend(find_function_names(child, start_byte, end_byte, function_types))
+    return names
+
+class SyntaxChecker:
+    """
+    parse the file with the generated code spliced in, without writing it and without running the tests.
+    the generated code is first parsed alone, which rejects most broken candidates cheaply.
+    the rest is checked in the file: the file is parsed once per task, every candidate of the task
+    only re-parses the edited span of the previous tree.
+    """
+    def __init__(self, lan: str):
+        if lan not in LANGUAGE_MODULES:
+            raise NotImplementedError("Error language type")
+        self.parser = Parser(Language(LANGUAGE_MODULES[lan].language()))
+        self.function_types = FUNCTION_TYPES[lan]
+        self.snippet_wrapper = SNIPPET_WRAPPERS[lan]
+        self.key = None
+
+    def reset(self, file_path: str, data_lines: list, start_line: int, end_line: int):
+        self.key = (file_path, start_line, end_line)
+        self.prefix = "".join(data_lines[:start_line]).encode("utf-8")
+        self.middle = "".join(data_lines[start_line:end_line+1]).encode("utf-8")
+        self.suffix = "".join(data_lines[end_line+1:]).encode("utf-8")
+        self.start_point = move_point((0, 0), self.prefix)
+        self.tree = self.parser.parse(self.prefix + self.middle + self.suffix)
+        # errors the grammar already reports on the original file are not the candidate's fault
+        self.base_has_error = self.tree.root_node.has_error
+
+    def check(self, file_path: str, data_lines: list, start_line: int, end_line: int,
+              generated_code_lines: list, func_name: str):
+        """
+        return None if the spliced file parses and defines func_name in the generated code,
+        otherwise the failure log of the candidate
+        """
+        code = "".join(generated_code_lines).encode("utf-8")
+        # an unclosed string or bracket is expensive to recover from in a large file
+        snippet = self.parser.parse(self.snippet_wrapper[0] + code + self.snippet_wrapper[1])
+        error = find_error(snippet.root_node, 0, snippet.root_node.end_byte)
+        if error is not None:
+            line = error.start_point[0] - self.snippet_wrapper[0].count(b"\n")
+            return f"FAILED: Syntax error at line {start_line + max(line, 0) + 1}"
+
+        if self.key != (file_path, start_line, end_line):
+            self.reset(file_path, data_lines, start_line, end_line)
+        start_byte = len(self.prefix)
+        self.tree.edit(
+            start_byte=start_byte,
+            old_end_byte=start_byte + len(self.middle),
+            new_end_byte=start_byte + len(code),
+            start_point=self.start_point,
+            old_end_point=move_point(self.start_point, self.middle),
+            new_end_point=move_point(self.start_point, code),
+        )
+        self.tree = self.parser.parse(self.prefix + code + self.suffix, self.tree)
+        self.middle = code
+
+        root = self.tree.root_node
+        if self.base_has_error:
+            error = find_error(root, start_byte, start_byte + len(code))
+        else:
+            error = find_error(root, 0, root.end_byte)
+        if error is not None:
+            return f"FAILED: Syntax error at line {error.start_point[0] + 1}"
+
+        names = find_function_names(root, start_byte, start_byte + len(code), self.function_types)
+        if func_name not in names:
+            return "FAILED: Function not found in generated code"
+        return None
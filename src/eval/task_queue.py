@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+
+import tqdm
+
+class TaskQueue:
+    """
+    a durable queue of the tasks of an evaluation in a directory, which any number of worker processes,
+    containers or hosts with the directory on shared storage take tasks from. a task is a json file
+    that moves between the directories by atomic renames:
+    pending/<name> -> leased/<name>@<worker> -> done/<name>, with the logs of its samples,
+    or failed/<name> after max_attempts abandoned leases.
+    the name starts with the rank of the task, the workers lease in that order, and holds its project,
+    so a worker can lease several tasks of one project. a worker keeps its leases alive by touching
+    them, a lease not touched for lease_timeout seconds is abandoned and goes back to pending.
+    the clocks of the hosts are compared through the mtimes, lease_timeout should be well above their skew.
+    queue.json holds the settings of the evaluation, the coordinator writes it with the tasks, and the
+    workers run the tasks with them.
+    """
+    def __init__(self, queue_dir: str, lease_timeout: float = 600, max_attempts: int = 3):
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.dirs = {state: os.path.join(queue_dir, state) for state in ["pending", "leased", "done", "failed"]}
+        for path in self.dirs.values():
+            os.makedirs(path, exist_ok=True)
+        self.config_path = os.path.join(queue_dir, "queue.json")
+
+    @staticmethod
+    def task_name(rank: int, task_id: str, project: str):
+        project = re.sub(r"[^\w.-]", "_", project)[:40]
+        return f"{rank:07d}_{project}_{hashlib.sha1(task_id.encode('utf-8')).hexdigest()[:16]}.json"
+
+    @staticmethod
+    def project_of(name: str):
+        return name.split("_", 1)[1].rsplit("_", 1)[0]
+
+    @staticmethod
+    def write_json(path: str, data):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_json(path: str):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def names(self, state: str):
+        return sorted(n for n in os.listdir(self.dirs[state]) if not n.endswith(".tmp"))
+
+    def enqueue(self, rows: list, config: dict):
+        """
+        put the rows, in the order they should run, into pending, unless the queue holds them already
+        """
+        if os.path.exists(self.config_path):
+            return False
+        for rank, row in enumerate(rows):
+            name = self.task_name(rank, row["task-id"], row["project"])
+            self.write_json(os.path.join(self.dirs["pending"], name),
+                            {"task_id": row["task-id"], "project": row["project"], "attempts": 0})
+        self.write_json(self.config_path, dict(config, tasks=[row["task-id"] for row in rows]))
+        return True
+
+    def config(self):
+        return self.read_json(self.config_path) if os.path.exists(self.config_path) else None
+
+    def lease(self, worker_id: str, max_tasks: int = 1):
+        """
+        lease the first pending task and, up to max_tasks, the next ones of its project.
+        returns [(lease path, task)]. a rename another worker won first is skipped.
+        """
+        leases = []
+        project = None
+        for name in self.names("pending"):
+            if len(leases) >= max_tasks:
+                break
+            if project is not None and self.project_of(name) != project:
+                continue
+            pending_path = os.path.join(self.dirs["pending"], name)
+            lease_path = os.path.join(self.dirs["leased"], f"{name}@{worker_id}")
+            try:
+                # the rename keeps the mtime, a lease must not show up with the old one of the task,
+                # reclaim would take it back as abandoned
+                os.utime(pending_path)
+                os.rename(pending_path, lease_path)
+            except FileNotFoundError:
+                continue
+            if os.path.exists(os.path.join(self.dirs["done"], name)):
+                # finished by the holder of an earlier lease, which came back late
+                os.remove(lease_path)
+                continue
+            leases.append((lease_path, self.read_json(lease_path)))
+            project = self.project_of(name)
+        return leases
+
+    def heartbeat(self, lease_paths: list):
+        for lease_path in lease_paths:
+            try:
+                os.utime(lease_path)
+            except FileNotFoundError:
+                # reclaimed as abandoned, the task is still finished, whoever finishes it last wins
+                pass
+
+    def complete(self, lease_path: str, task_id: str, logs: list):
+        name = os.path.basename(lease_path).split("@")[0]
+        self.write_json(os.path.join(self.dirs["done"], name), {"task_id": task_id, "logs": logs})
+        try:
+            os.remove(lease_path)
+        except FileNotFoundError:
+            pass
+
+    def reclaim(self):
+        """
+        put the abandoned leases back to pending, or into failed after max_attempts.
+        a lease is first renamed to a lease of the reclaimer, so only one process reclaims it.
+        """
+        reclaimed = 0
+        now = time.time()
+        for lease_name in self.names("leased"):
+            lease_path = os.path.join(self.dirs["leased"], lease_name)
+            try:
+                if now - os.path.getmtime(lease_path) < self.lease_timeout:
+                    continue
+                name = lease_name.split("@")[0]
+                claimed_path = os.path.join(self.dirs["leased"], f"{name}@reclaim-{uuid.uuid4().hex[:8]}")
+                os.rename(lease_path, claimed_path)
+            except FileNotFoundError:
+                continue
+            task = self.read_json(claimed_path)
+            task["attempts"] += 1
+            self.write_json(claimed_path, task)
+            state = "failed" if task["attempts"] >= self.max_attempts else "pending"
+            print(f"lease of {task['task_id']} abandoned by {lease_name.split('@')[1]}, back to {state}")
+            os.rename(claimed_path, os.path.join(self.dirs[state], name))
+            reclaimed += 1
+        return reclaimed
+
+    def counts(self):
+        return {state: len(self.names(state)) for state in self.dirs}
+
+    def finished_names(self):
+        # a late worker may finish a task that failed meanwhile, it is done then
+        return set(self.names("done")) | set(self.names("failed"))
+
+    def finished(self):
+        # queue.json is written after the tasks, a queue without it is still being filled
+        if not os.path.exists(self.config_path):
+            return False
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+    def results(self, task_samples: dict):
+        """
+        task-id -> logs of the done tasks, the failed ones get a FAILED log per sample.
+        task_samples is task-id -> number of samples.
+        """
+        all_test_logs = {}
+        for name in self.names("failed"):
+            task = self.read_json(os.path.join(self.dirs["failed"], name))
+            all_test_logs[task["task_id"]] = [f"FAILED: lease abandoned {task['attempts']} times"] * task_samples[task["task_id"]]
+        for name in self.names("done"):
+            entry = self.read_json(os.path.join(self.dirs["done"], name))
+            all_test_logs[entry["task_id"]] = entry["logs"]
+        return all_test_logs
+
+def worker_id():
+    return re.sub(r"[^\w.-]", "_", f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}")
+
+def run_worker(queue: TaskQueue, evaluate, max_tasks: int = 8, poll: float = 5):
+    """
+    lease tasks until the queue is finished and push their logs back. evaluate takes the leased
+    task ids, of one project, and returns task-id -> logs. the leases are touched every
+    lease_timeout / 4 seconds while they run.
+    """
+    name = worker_id()
+    print("queue worker", name)
+    while True:
+        queue.reclaim()
+        leases = queue.lease(name, max_tasks)
+        if len(leases) == 0:
+            if queue.finished():
+                break
+            time.sleep(poll)
+            continue
+        lease_paths = [lease_path for lease_path, _ in leases]
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(queue.lease_timeout / 4):
+                queue.heartbeat(lease_paths)
+        heart = threading.Thread(target=beat, daemon=True)
+        heart.start()
+        try:
+            all_test_logs = evaluate([task["task_id"] for _, task in leases])
+        finally:
+            stop.set()
+            heart.join()
+        for lease_path, task in leases:
+            queue.complete(lease_path, task["task_id"], all_test_logs[task["task_id"]])
+
+def wait_for_results(queue: TaskQueue, task_samples: dict, poll: float = 10):
+    """
+    the coordinator: reclaim the abandoned leases until every task is done or failed,
+    then merge the logs, in the order of task_samples
+    """
+    total = len(task_samples)
+    with tqdm.tqdm(total=total, desc="queue") as progress:
+        while True:
+            queue.reclaim()
+            counts = queue.counts()
+            finished = len(queue.finished_names())
+            progress.update(finished - progress.n)
+            progress.set_postfix(pending=counts["pending"], leased=counts["leased"])
+            if finished >= total and counts["leased"] == 0:
+                break
+            time.sleep(poll)
+    all_test_logs = queue.results(task_samples)
+    return {task_id: all_test_logs[task_id] for task_id in task_samples}
@@ -0,0 +1,216 @@
+import json
+import os
+import re
+import threading
+import time
+
+MAVEN_BUILD_FILES = ["pom.xml"]
+GRADLE_BUILD_FILES = ["build.gradle", "build.gradle.kts"]
+
+# plugins a test run does not need, skipped by their properties. a property of a plugin the
+# project does not use is ignored by maven
+MAVEN_SKIP_FLAGS = [
+    "-Dcheckstyle.skip", "-Djacoco.skip=true", "-Dmaven.javadoc.skip=true", "-Dmaven.source.skip=true",
+    "-Dspotless.check.skip=true", "-Dspotless.apply.skip=true", "-Denforcer.skip=true", "-Drat.skip=true",
+    "-Dlicense.skip=true", "-Dgpg.skip", "-Dpmd.skip=true", "-Dcpd.skip=true", "-Dspotbugs.skip=true",
+    "-Dformatter.skip=true", "-Dimpsort.skip=true", "-Drevapi.skip=true", "-Djapicmp.skip=true",
+    "-Danimal.sniffer.skip=true", "-Dmaven.site.skip=true",
+]
+
+CD_SEGMENT = re.compile(r"^cd (\S+)(?:\s*&&\s*(.*))?$", re.S)
+
+def command_segments(test_command: str):
+    """
+    the (directory, command) of the `;` separated segments of a test command that run something,
+    the directory relative to where the command starts, following its `cd dir && ...` and `cd ..`
+    segments like the shell, e.g. "cd core && mvn test -Dtest=A; cd ..; mvn test -Dtest=B" gives
+    [("core", "mvn test -Dtest=A"), ("", "mvn test -Dtest=B")]. None if a cd leaves the start directory.
+    """
+    segments = []
+    cwd = ""
+    for segment in test_command.split(";"):
+        segment = segment.strip()
+        if segment == "":
+            continue
+        match = CD_SEGMENT.match(segment)
+        if match:
+            cwd = os.path.normpath(os.path.join(cwd, match.group(1)))
+            if cwd == ".." or cwd.startswith("../") or os.path.isabs(cwd):
+                return None
+            cwd = "" if cwd == "." else cwd
+            segment = (match.group(2) or "").strip()
+            if segment == "":
+                continue
+        segments.append((cwd, segment))
+    return segments
+
+def build_tool(project_root: str):
+    if os.path.exists(os.path.join(project_root, "pom.xml")):
+        return "maven"
+    if any(os.path.exists(os.path.join(project_root, f))
+           for f in GRADLE_BUILD_FILES + ["settings.gradle", "settings.gradle.kts"]):
+        return "gradle"
+    return None
+
+def owning_module(project_root: str, file_path: str, build_files: list):
+    """
+    the directory of the module file_path belongs to, relative to project_root, "" for the root:
+    the nearest directory above it with one of build_files
+    """
+    directory = os.path.dirname(file_path)
+    while directory:
+        if any(os.path.exists(os.path.join(project_root, directory, f)) for f in build_files):
+            return directory
+        directory = os.path.dirname(directory)
+    return ""
+
+def test_classes(test_funcs: str, project_root: str, build_files: list):
+    """
+    module -> {fully qualified test class: [methods]} of the "path::method" tests of a task,
+    in their order. the class name is the path below src/test/java, or the file name.
+    """
+    modules = {}
+    for test in dict.fromkeys(t for t in test_funcs.split(" ") if t):
+        path, method = test.split("::")
+        class_path = os.path.splitext(path)[0]
+        match = re.search(r"src/test/(?:java|kotlin|groovy)/(.+)$", class_path)
+        class_name = match.group(1).replace("/", ".") if match else os.path.basename(class_path)
+        module = owning_module(project_root, path, build_files)
+        modules.setdefault(module, {}).setdefault(class_name, []).append(method)
+    return modules
+
+def narrow_test_command(row, project_root: str):
+    """
+    a test command of the task that builds only the modules of its tests and the ones they depend on,
+    offline, runs only the test methods of the task and skips the plugins a test run does not need.
+    maven: `mvn -o test -pl <modules> -am -Dtest=Class#a+b,...`, the modules built for the test modules
+    have none of the tests and must not fail for it. gradle: `gradlew --offline :module:cleanTest
+    :module:test --tests Class.method`, the test tasks do not depend on checkstyle, javadoc and the like,
+    cleanTest so an up to date test task runs and writes its reports again.
+    None if the project has no maven or gradle build or the task no tests.
+    """
+    tool = build_tool(project_root)
+    if tool is None or not isinstance(row["test_funcs"], str):
+        return None
+    build_files = MAVEN_BUILD_FILES if tool == "maven" else GRADLE_BUILD_FILES
+    modules = test_classes(row["test_funcs"], project_root, build_files)
+    if len(modules) == 0:
+        return None
+    if tool == "maven":
+        # surefire matches -Dtest by the simple class name, like the commands of the dataset
+        tests = ",".join(f"{class_name.split('.')[-1]}#{'+'.join(methods)}"
+                         for classes in modules.values() for class_name, methods in classes.items())
+        command = "mvn -o -B test"
+        if "" not in modules:
+            command += f" -pl {','.join(modules)} -am"
+        return " ".join([command, f"-Dtest={tests}", "-Dsurefire.failIfNoSpecifiedTests=false",
+                         "-DfailIfNoTests=false"] + MAVEN_SKIP_FLAGS)
+    gradle = "./gradlew" if os.path.exists(os.path.join(project_root, "gradlew")) else "gradle"
+    command = [gradle, "--offline"]
+    for module, classes in modules.items():
+        task = ":" + module.replace("/", ":") + ":" if module else ""
+        command += [task + "cleanTest", task + "test"]
+        for class_name, methods in classes.items():
+            command += [f"--tests {class_name}.{method}" for method in methods]
+    return " ".join(command)
+
+def method_outcomes(tests: dict, class_name: str, method: str):
+    """
+    the "classname::name" -> outcome entries of a test method in the tests of a junit xml report, the
+    class matched by its simple name when the report or class_name has no package, the invocations of a
+    parameterized method, e.g. "method(int)[1]" or "method[1]", included
+    """
+    outcomes = {}
+    simple_name = class_name.split(".")[-1]
+    for test, outcome in tests.items():
+        reported_class, _, name = test.rpartition("::")
+        if reported_class != class_name and (reported_class.split(".")[-1] != simple_name
+                                             or ("." in reported_class and "." in class_name)):
+            continue
+        if re.split(r"[(\[]", name, 1)[0] == method:
+            outcomes[test] = outcome
+    return outcomes
+
+class NarrowedCommands:
+    """
+    the narrowed test commands of the java tasks, each validated once against the task's own
+    test_command on the original function: it is used if it runs every test method of the task and
+    they pass with the same outcomes as in the original run, the original one otherwise.
+    the outcomes are the ones of the junit xml reports, see eval.reporters.SurefireReporter, which maven
+    and gradle both write, the log of a gradle run does not read like the maven one parse_log knows.
+    the results are kept in the json at cache_path, task-id -> {"original", "command", "valid",
+    "original_seconds", "command_seconds"} and "mismatched", the methods that failed the check, an entry is redone if the original command changed.
+    """
+    def __init__(self, cache_path: str = None, timeout: float = 600):
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                self.entries = json.load(f)
+
+    def task_row(self, row, project_root: str, env=None, limits=None):
+        """
+        the row with the narrowed test command if it is valid, validating it first if it is new.
+        it runs before the candidates of the task, on the original function.
+        """
+        if not isinstance(row.get("test_command"), str):
+            return row
+        with self.lock:
+            entry = self.entries.get(row["task-id"])
+        if entry is None or entry["original"] != row["test_command"]:
+            entry = self.validate(row, project_root, env, limits)
+        if not entry["valid"]:
+            return row
+        row = row.copy()
+        row["test_command"] = entry["command"]
+        return row
+
+    def passes(self, row, project_root: str, env=None, limits=None):
+        """the outcome of every test the test command of row ran, from its junit xml reports"""
+        from eval.run_test import run_tests
+        return run_tests(row, "java", project_root, env, self.timeout, limits, structured=True, log_chars=0)["tests"]
+
+    def validate(self, row, project_root: str, env=None, limits=None):
+        """
+        run the original and the narrowed command, the narrowed one is valid if every test method of the
+        task passed in it, with the same outcomes in the original run. a narrowed command that misses a
+        method, e.g. one of another class of the same simple name, or runs it differently is not used.
+        """
+        command = narrow_test_command(row, project_root)
+        entry = {"original": row["test_command"], "command": command, "valid": False}
+        if command is not None:
+            narrowed_row = row.copy()
+            narrowed_row["test_command"] = command
+            start_time = time.time()
+            original_tests = self.passes(row, project_root, env, limits)
+            entry["original_seconds"] = round(time.time() - start_time, 3)
+            start_time = time.time()
+            narrowed_tests = self.passes(narrowed_row, project_root, env, limits)
+            entry["command_seconds"] = round(time.time() - start_time, 3)
+            build_files = MAVEN_BUILD_FILES if build_tool(project_root) == "maven" else GRADLE_BUILD_FILES
+            missing = []
+            for classes in test_classes(row["test_funcs"], project_root, build_files).values():
+                for class_name, methods in classes.items():
+                    for method in methods:
+                        narrowed = method_outcomes(narrowed_tests, class_name, method)
+                        if not narrowed or set(narrowed.values()) != {"passed"} \
+                                or method_outcomes(original_tests, class_name, method) != narrowed:
+                            missing.append(f"{class_name}.{method}")
+            entry["valid"] = len(missing) == 0
+            if missing:
+                entry["mismatched"] = missing
+        print(f"narrowed test command of {row['task-id']}: {'valid' if entry['valid'] else 'not used'}, "
+              f"{entry.get('original_seconds')}s -> {entry.get('command_seconds')}s")
+        with self.lock:
+            self.entries[row["task-id"]] = entry
+            self.save()
+        return entry
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        with open(self.cache_path + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import textwrap
+import threading
+import time
+
+from tree_sitter import Language, Parser, Node
+
+from eval.parse_run_log import is_timeout
+from eval.syntax_check import LANGUAGE_MODULES, SNIPPET_WRAPPERS
+from parser.file_scanner import scan_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (task_id TEXT, code_hash TEXT, env TEXT, log TEXT, created REAL,
+                                     PRIMARY KEY (task_id, code_hash, env));
+"""
+
+SOURCE_EXTENSIONS = {"py": (".py",), "go": (".go",), "java": (".java",), "cs": (".cs",)}
+
+TOOL_VERSION_COMMANDS = {
+    "py": "python -V; pytest --version",
+    "go": "go version",
+    "java": "java -version; mvn -v; gradle -v",
+    "cs": "dotnet --version",
+}
+
+# the text of a literal is kept as it is, whitespace inside a string is part of the code
+LITERAL_TYPES = ("string", "char", "rune")
+
+def canonical_tokens(node: Node, source: bytes, tokens: list):
+    """
+    s-expression of the named nodes with the text of the leaves, comments left out.
+    the nesting keeps the blocks of python apart, which the tokens alone would not.
+    """
+    if "comment" in node.type:
+        return
+    if node.child_count == 0 or any(t in node.type for t in LITERAL_TYPES):
+        tokens.append(source[node.start_byte:node.end_byte].decode("utf-8", errors="ignore"))
+        return
+    if node.is_named:
+        tokens.append("(" + node.type)
+    for child in node.children:
+        canonical_tokens(child, source, tokens)
+    if node.is_named:
+        tokens.append(")")
+
+def tool_versions(lan: str):
+    result = subprocess.run(TOOL_VERSION_COMMANDS.get(lan, "true"), shell=True, capture_output=True,
+                            text=True, errors="ignore", executable="/bin/bash")
+    return result.stdout + result.stderr
+
+def project_revision(project_path: str, lan: str):
+    """
+    the commit and the changes to tracked files of the project, or the paths and sizes of its source
+    files when it is not a git repository. both stay the same when run_test restores a file, and
+    neither sees the caches the test tools write.
+    """
+    result = subprocess.run("git rev-parse HEAD && git status --porcelain --untracked-files=no", shell=True,
+                            cwd=project_path, capture_output=True, text=True, errors="ignore",
+                            executable="/bin/bash")
+    if result.returncode == 0:
+        return result.stdout
+    files = scan_files(project_path, SOURCE_EXTENSIONS[lan], lan)
+    return "\n".join(f"{os.path.relpath(f, project_path)} {os.path.getsize(f)}" for f in sorted(files))
+
+class VerdictCache:
+    """
+    test logs of the candidates already run, keyed by task-id, the hash of the canonical code and
+    the environment: tool versions, the state of the project, the tests of the task, the test command
+    that runs them and the mode of the run, which decides the shape of the stored log.
+    the canonical code is the tree-sitter s-expression of the candidate, so candidates differing only
+    in whitespace, comments or formatting share one entry. a candidate that does not parse is keyed
+    by its stripped text. timeouts are not stored, they say more about the machine than the code.
+    the cache is shared by the worker threads of run_test.eval.
+    """
+    def __init__(self, db_path: str, lan: str):
+        self.lan = lan
+        self.parser = Parser(Language(LANGUAGE_MODULES[lan].language()))
+        self.snippet_wrapper = SNIPPET_WRAPPERS[lan]
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.tool_versions = tool_versions(lan)
+        self.project_revisions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def code_hash(self, code: str):
+        code = textwrap.dedent(code)
+        source = self.snippet_wrapper[0] + code.encode("utf-8") + self.snippet_wrapper[1]
+        with self.lock:
+            tree = self.parser.parse(source)
+        if tree.root_node.has_error:
+            canonical = "raw:" + code.strip()
+        else:
+            tokens = []
+            canonical_tokens(tree.root_node, source, tokens)
+            canonical = " ".join(tokens)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def env(self, row, project_path: str, mode: str = ""):
+        """
+        the environment fingerprint of a task. the project is looked at once per run, before
+        any generated code is written into it. row is the one the tests run with, its test command
+        the narrowed or offline one if so, mode the run_test.run_mode of the run.
+        """
+        with self.lock:
+            if project_path not in self.project_revisions:
+                self.project_revisions[project_path] = project_revision(project_path, self.lan)
+            revision = self.project_revisions[project_path]
+        test_command = row["test_command"] if "test_command" in row and isinstance(row["test_command"], str) else ""
+        fingerprint = "\n".join([self.lan, self.tool_versions, revision, row["test_funcs"], test_command, mode])
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def get(self, task_id: str, code_hash: str, env: str):
+        with self.lock:
+            row = self.conn.execute("SELECT log FROM verdicts WHERE task_id = ? AND code_hash = ? AND env = ?",
+                                    (task_id, code_hash, env)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # logs are stored as json, a string or a result entry of eval.reporters
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            return row[0]
+
+    def put(self, task_id: str, code_hash: str, env: str, log: str):
+        if is_timeout(log):
+            return
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                              (task_id, code_hash, env, json.dumps(log), time.time()))
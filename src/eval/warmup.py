@@ -0,0 +1,118 @@
+import collections
+import os
+import re
+import threading
+import time
+
+from eval.command_runner import run_command
+
+def warm_up_commands(row, lan: str):
+    """
+    the commands that fill the build caches of a project, run in its root.
+    go: download the modules, build every package and compile every test binary without running a test.
+    java: install every module without running the tests, so that a module's test command finds its
+    siblings in the local repository, resolve the plugins, and run the task's test command once, which
+    resolves the test provider surefire loads only when it runs.
+    """
+    if lan == "go":
+        return ["go mod download", "go build ./...", "go test -count=1 -run '^$' ./... > /dev/null"]
+    elif lan == "java":
+        return ["mvn -B -q install -DskipTests", "mvn -B -q dependency:go-offline", row["test_command"]]
+    return []
+
+# a build tool in command position: at the start, or after &&, ||, ;, | or (, e.g. `cd dir && ./mvnw`,
+# with the arguments of its command up to the next of them
+BUILD_TOOL = re.compile(r"((?:^|&&|\|\||[;|(])\s*)((?:\S*/)?(mvnw?|gradlew?))(?=\s|$)([^;&|)]*)")
+
+def offline_command(command: str):
+    """
+    command with the build tools in offline mode: mvn, mvnw -o and gradle, gradlew --offline, unless
+    they are already. only a tool in command position is changed, not a path like `cd gradle-plugin`.
+    """
+    def offline(match):
+        prefix, tool, name, args = match.groups()
+        flags = ["-o", "--offline"] if name.startswith("mvn") else ["--offline"]
+        if any(flag in args.split() for flag in flags):
+            return match.group(0)
+        return f"{prefix}{tool} {flags[0]}{args}"
+    return BUILD_TOOL.sub(offline, command)
+
+class BuildCache:
+    """
+    warm build caches of the go and java projects, so that a candidate run only recompiles the package
+    or module of the patched file instead of starting cold. cache_dir, if given, holds the GOCACHE,
+    GOMODCACHE and maven local repository shared by every workspace, the default caches of the tools
+    are used otherwise. warm_up runs warm_up_commands once per project directory, a workspace copy
+    included, since the go build cache keys the packages by their directory. after a warm-up that
+    succeeded and with offline, the test commands run without network: GOPROXY=off and mvn -o.
+    """
+    def __init__(self, cache_dir: str = None, offline: bool = True, timeout: float = 1800):
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir else None
+        self.offline = offline
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # project directory -> whether its warm-up succeeded
+        self.warm = {}
+        # the warm-ups of a project run one at a time, the java ones install into the shared repository
+        self.project_locks = collections.defaultdict(threading.Lock)
+
+    def env(self, project_root: str = None, env: dict = None):
+        """
+        the environment of the commands in project_root, based on env or the one of this process
+        """
+        offline = self.offline and self.warm.get(project_root, False)
+        if self.cache_dir is None and not offline:
+            return env
+        env = dict(env if env is not None else os.environ)
+        if self.cache_dir is not None:
+            env["GOCACHE"] = os.path.join(self.cache_dir, "go-build")
+            env["GOMODCACHE"] = os.path.join(self.cache_dir, "go-mod")
+            repo = os.path.join(self.cache_dir, "m2")
+            env["MAVEN_OPTS"] = (env.get("MAVEN_OPTS", "") + f" -Dmaven.repo.local={repo}").strip()
+        if offline:
+            env["GOPROXY"] = "off"
+        return env
+
+    def task_row(self, row, project_root: str):
+        """
+        the row with its test command offline, if the project is warm
+        """
+        if not (self.offline and self.warm.get(project_root, False)) or not isinstance(row.get("test_command"), str):
+            return row
+        row = row.copy()
+        row["test_command"] = offline_command(row["test_command"])
+        return row
+
+    def forget(self, project_root: str):
+        """
+        drop the warm-up of a directory whose project copy was replaced
+        """
+        with self.lock:
+            self.warm.pop(project_root, None)
+
+    def warm_up(self, row, lan: str, project_root: str, env: dict = None):
+        commands = warm_up_commands(row, lan)
+        if len(commands) == 0:
+            return False
+        with self.lock:
+            project_lock = self.project_locks[row["project"]]
+        with project_lock:
+            with self.lock:
+                if project_root in self.warm:
+                    return self.warm[project_root]
+            start_time = time.time()
+            ok = True
+            for command in commands:
+                result = run_command(command, self.timeout, project_root, self.env(project_root, env))
+                # the test command of a java task may fail on the original code too, it only resolves plugins
+                if command != commands[-1] or lan != "java":
+                    if result is None or result.returncode != 0:
+                        print(f"warm up {row['project']} failed: {command}")
+                        if result is not None:
+                            print(result.stdout[-2000:] + result.stderr[-2000:])
+                        ok = False
+                        break
+            print(f"warm up {row['project']}: {'ok' if ok else 'failed'} in {round(time.time() - start_time, 1)}s")
+            with self.lock:
+                self.warm[project_root] = ok
+            return ok
@@ -0,0 +1,137 @@
+import glob
+import os
+import re
+import shutil
+import site
+import subprocess
+import threading
+
+COPY_MODES = ["reflink", "hardlink", "worktree", "copy"]
+
+def copy_project(project_path: str, dest: str, mode: str = "reflink"):
+    """
+    make dest a copy of project_path that the tests can run in.
+    reflink: `cp --reflink=auto`, copy on write where the file system supports it, a full copy otherwise.
+    hardlink: `cp -al`, the files share their inodes with the project. the generated code is written
+        by replacing the file, which breaks the link, but a build tool rewriting an existing file in place
+        writes through to the project.
+    worktree: `git worktree add`, only the committed files, without untracked build outputs or dependencies.
+    copy: a plain copy.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if mode == "reflink":
+        command = ["cp", "-a", "--reflink=auto", project_path, dest]
+    elif mode == "hardlink":
+        command = ["cp", "-al", project_path, dest]
+    elif mode == "worktree":
+        command = ["git", "-C", project_path, "worktree", "add", "--detach", "--force", dest]
+    elif mode == "copy":
+        shutil.copytree(project_path, dest, symlinks=True)
+        return
+    else:
+        raise NotImplementedError(f"Error copy mode, should be one of {COPY_MODES}")
+    subprocess.run(command, check=True, capture_output=True)
+
+def remove_project_copy(project_path: str, dest: str, mode: str):
+    if mode == "worktree":
+        subprocess.run(["git", "-C", project_path, "worktree", "remove", "--force", dest], capture_output=True)
+    shutil.rmtree(dest, ignore_errors=True)
+
+def editable_paths(project_path: str):
+    """
+    the directories inside project_path that python imports from through an editable install:
+    the path lines of .pth files, and the package paths of the setuptools __editable__ finders
+    """
+    project_path = os.path.abspath(project_path)
+    paths = []
+    for site_dir in site.getsitepackages() + [site.getusersitepackages()]:
+        for pth in glob.glob(os.path.join(site_dir, "*.pth")):
+            with open(pth, "r", errors="ignore") as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith(project_path) and not line.startswith("import"):
+                        paths.append(line)
+        for finder in glob.glob(os.path.join(site_dir, "__editable__*finder.py")):
+            with open(finder, "r", errors="ignore") as f:
+                for package_path in re.findall(r"'([^']+)'", f.read()):
+                    if package_path.startswith(project_path + os.sep):
+                        paths.append(os.path.dirname(package_path))
+    return list(dict.fromkeys(paths))
+
+class Workspace:
+    """
+    the directory one worker runs its tasks in, holding a copy of the project of its current task.
+    the copy is kept while the worker stays on the same project, like the project directory in the serial mode.
+    """
+    def __init__(self, root_dir: str, copy_mode: str = "reflink", syntax_checker=None):
+        self.root_dir = root_dir
+        self.copy_mode = copy_mode
+        self.syntax_checker = syntax_checker
+        self.zygote = None
+        self.project_path = None
+        self.project_copy = None
+
+    def checkout(self, project_path: str):
+        if project_path != self.project_path:
+            self.release()
+            self.project_copy = os.path.join(self.root_dir, os.path.basename(os.path.normpath(project_path)))
+            if os.path.exists(self.project_copy):
+                remove_project_copy(project_path, self.project_copy, self.copy_mode)
+            copy_project(project_path, self.project_copy, self.copy_mode)
+            self.project_path = project_path
+        return self.project_copy
+
+    def release(self):
+        if self.zygote is not None:
+            self.zygote.close()
+            self.zygote = None
+        if self.project_copy is not None:
+            remove_project_copy(self.project_path, self.project_copy, self.copy_mode)
+        self.project_path = None
+        self.project_copy = None
+
+    def env(self, lan: str):
+        """
+        environment of the test commands. a python project installed in develop mode would import the
+        original sources, the same directories of the copy are put first on PYTHONPATH.
+        """
+        if lan != "py" or self.project_copy is None:
+            return None
+        project_path = os.path.abspath(self.project_path)
+        paths = [os.path.join(self.project_copy, os.path.relpath(p, project_path))
+                 for p in editable_paths(project_path)]
+        if len(paths) == 0:
+            return None
+        env = os.environ.copy()
+        if env.get("PYTHONPATH"):
+            paths.append(env["PYTHONPATH"])
+        env["PYTHONPATH"] = os.pathsep.join(paths)
+        return env
+
+class WorkspacePool:
+    """
+    the workspaces of the workers. acquire prefers a free workspace holding the project already,
+    so that it need not be copied, and waits for one to be free, at most timeout seconds if given.
+    """
+    def __init__(self, workspaces: list):
+        self.workspaces = list(workspaces)
+        self.free = list(workspaces)
+        self.condition = threading.Condition()
+
+    def acquire(self, project_path: str, timeout: float = None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.free) > 0, timeout):
+                return None
+            for i, workspace in enumerate(self.free):
+                if workspace.project_path == project_path:
+                    return self.free.pop(i)
+            return self.free.pop(0)
+
+    def release(self, workspace: Workspace):
+        with self.condition:
+            self.free.append(workspace)
+            self.condition.notify()
+
+    def close(self):
+        for workspace in self.workspaces:
+            workspace.release()
@@ -1,40 +1,264 @@
 from tree_sitter import Language, Parser
 from tree_sitter import Node
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left
+from parser.parse_cache import ParseCache
+from functools import lru_cache
+import hashlib
+import mmap
 import os
+import sys
+import tqdm
+
+# parser instance owned by each process of the pool, see BaseParser.parse_files
+_worker_parser = None
+
+def _init_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+def _parse_file_in_worker(file_path):
+    return _worker_parser.parse_file(file_path)
 
 class BaseParser:
+    # the tree_sitter_<lang> module of the subclass, used to rebuild the parser after unpickling
+    language_module = None
+    # query sources of the subclass: "function", "import", "callee" and optionally "package".
+    # they are compiled once per process by get_query, "file" is all of them in one query
+    QUERIES = {}
+    # capture name of a call site -> FunctionData attribute collecting the captured names
+    CALL_SITES = {"callee_name": "callee_names"}
+    _compiled_queries = {}
+
     def __init__(self, specific_language):
         self.LANGUAGE = specific_language
         self.parser = Parser(self.LANGUAGE)
         self.function_data = []
-    
+        self.file_imports = {}
+        self.cache = None
+
+    def __getstate__(self):
+        # tree_sitter objects can not be pickled, they are rebuilt in __setstate__
+        state = self.__dict__.copy()
+        for key in ["LANGUAGE", "parser", "function_data", "funcs", "file_imports", "cache"]:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.LANGUAGE = Language(self.language_module.language())
+        self.parser = Parser(self.LANGUAGE)
+        self.function_data = []
+        self.file_imports = {}
+        self.cache = None
+
+    def cache_key(self, project_path: str):
+        """
+        name of the parse cache of the project, parsers whose output depends on more
+        than the file content add their settings
+        """
+        return type(self).__name__ + "_" + hashlib.md5(project_path.encode("utf-8")).hexdigest()
+
+    def use_cache(self, cache_dir: str, project_path: str):
+        self.cache = ParseCache(cache_dir, self.cache_key(project_path)) if cache_dir else None
 
     def parse(self, file_path: str):
         if os.path.exists(file_path):
-            with open(file_path, "r") as file:
-                code = file.read()
-                tree = self.parser.parse(bytes(code, "utf8"))
-                return tree.root_node
+            tree = self.parser.parse(read_source(file_path))
+            return tree.root_node
         else:
             raise FileNotFoundError("File not found")
 
+    def get_query(self, name: str):
+        key = (type(self), name)
+        if key not in BaseParser._compiled_queries:
+            if name == "file":
+                source = "\n".join(self.QUERIES.values())
+            else:
+                source = self.QUERIES[name]
+            BaseParser._compiled_queries[key] = self.LANGUAGE.query(source)
+        return BaseParser._compiled_queries[key]
+
+    def make_function(self, captures: dict, file_path: str, package_name: str):
+        raise NotImplementedError("make_function is language specific")
+
+    def make_imports(self, captures: dict):
+        raise NotImplementedError("make_imports is language specific")
+
+    def extract_file(self, root_node: Node, file_path: str):
+        """
+        run the "file" query once and sort its matches into function definitions,
+        import info, package name and call sites. every call site is added to all the
+        functions whose span contains it, like running the callee query on each function.
+        """
+        func_captures = []
+        imports = []
+        sites = []
+        package_name = ""
+        for _, captures in self.get_query("file").matches(root_node):
+            if "method" in captures:
+                func_captures.append(captures)
+            elif "package_name" in captures:
+                if not package_name:
+                    package_name = captures["package_name"].text.decode('utf-8')
+            else:
+                site = next((c for c in self.CALL_SITES if c in captures), None)
+                if site:
+                    node = captures[site]
+                    sites.append((node.start_byte, self.CALL_SITES[site], sys.intern(node.text.decode('utf-8'))))
+                else:
+                    imports.extend(self.make_imports(captures))
+        defs = [self.make_function(c, file_path, package_name) for c in func_captures]
+        if len(defs) == 0:
+            return [], []
+
+        sites.sort(key=lambda site: site[0])
+        site_starts = [site[0] for site in sites]
+        for f in defs:
+            start = bisect_left(site_starts, f.func_span[0])
+            end = bisect_left(site_starts, f.func_span[1])
+            for attr in self.CALL_SITES.values():
+                setattr(f, attr, tuple(name for _, a, name in sites[start:end] if a == attr))
+        return defs, imports
+
+    def parse_file(self, file_path: str):
+        """
+        parse one file into its function definitions and import info.
+        the callee names are extracted here, so build_call_relation does not need the syntax tree,
+        and the tree is released when this returns.
+        """
+        root_node = self.parse(file_path)
+        return self.extract_file(root_node, file_path)
+
+    def parse_files(self, file_paths: list, workers: int = 1):
+        """
+        first pass of the project build: collect the symbols of all the files, one after another
+        or over a process pool of `workers` processes, with one syntax tree alive per process.
+        files keep the order of file_paths in both modes.
+        with a parse cache only the new and changed files are parsed, and their results are cached.
+        return func_defs: {file_path: [FunctionData]}, func_imports: {file_path: import info}
+        """
+        results = {}
+        if self.cache:
+            for file_path in file_paths:
+                cached = self.cache.get(file_path)
+                if cached is not None:
+                    results[file_path] = cached
+        to_parse = [file_path for file_path in file_paths if file_path not in results]
+        print(f"parse {len(to_parse)} files, {len(results)} from cache")
+
+        def collect(parsed):
+            for file_path, (defs, imports) in tqdm.tqdm(zip(to_parse, parsed), total=len(to_parse)):
+                if self.cache:
+                    self.cache.put(file_path, defs, imports)
+                results[file_path] = (defs, imports)
+
+        if workers > 1:
+            chunksize = max(1, len(to_parse) // (workers * 8))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(self,)) as executor:
+                collect(executor.map(_parse_file_in_worker, to_parse, chunksize=chunksize))
+        else:
+            collect(self.parse_file(file_path) for file_path in to_parse)
+
+        func_defs = {}
+        func_imports = {}
+        for file_path in file_paths:
+            defs, imports = results[file_path]
+            if len(defs) == 0:
+                continue
+            func_defs[file_path] = defs
+            func_imports[file_path] = imports
+        return func_defs, func_imports
+
+    def link_project(self, func_defs: dict, func_imports: dict):
+        """
+        second pass of the project build: build_call_relation over the collected symbols. with a parse cache, the callees of the files
+        not touched by the changes are restored and only the stale files are resolved.
+        the import info of the files is kept in self.file_imports, e.g. for the symbol index.
+        """
+        self.file_imports = func_imports
+        if self.cache is None:
+            self.build_call_relation(func_defs, func_imports)
+            return
+        stale = self.cache.stale_paths(func_defs)
+        print(f"resolve callees of {len(stale)} files")
+        self.cache.restore_edges(func_defs, stale)
+        self.build_call_relation(func_defs, func_imports, stale)
+        self.cache.save(func_defs)
+
+def index_by_name(funcs: list, index: dict = None):
+    """
+    name -> {file_path: FunctionData} of the possible callees. like the set() the contexts
+    used to be built with, the first function added wins for the same file and name.
+    """
+    if index is None:
+        index = {}
+    for f in funcs:
+        index.setdefault(f.name, {}).setdefault(f.file_path, f)
+    return index
+
+# larger files are mapped instead of read, tree_sitter parses the mapping and slicing it gives bytes
+MMAP_SIZE = 256 * 1024
+
+@lru_cache(maxsize=32)
+def _read_source(file_path: str, size: int, mtime_ns: int):
+    with open(file_path, "rb") as file:
+        if size >= MMAP_SIZE:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return file.read()
+
+def read_source(file_path: str):
+    """
+    the raw bytes BaseParser.parse hands to tree_sitter, the spans of FunctionData index into them.
+    the few recently used files are kept, keyed by stat so that a changed file is read again.
+    """
+    st = os.stat(file_path)
+    return _read_source(file_path, st.st_size, st.st_mtime_ns)
+
+def decode_source(data: bytes):
+    """
+    text of a slice of the raw source, with the newlines a text mode read would give
+    """
+    text = data.decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
 class FunctionData:
+    """
+    one function definition without tree_sitter nodes, so the syntax tree of a file can be freed
+    as soon as the file is extracted. names are interned, the function, body and comments are
+    byte spans sliced from the source file when asked for.
+    """
+    __slots__ = ("name", "class_name", "package_name", "file_path",
+                 "func_span", "body_span", "comment_spans", "start_line", "end_line",
+                 "is_test_func", "callee_names", "used_classes", "callee", "test_funcs", "_hash")
+
     def __init__(self, func_name: Node, func_body: Node, func: Node,
                     comment_node: Node, 
                     class_name: str, package_name: str, file_path: str):
-        self.name_node = func_name
-        self.body_node = func_body
-        self.func_node = func
-        self.comment_node = comment_node
-        self.file_path = file_path
-        self.class_name = class_name
-        self.package_name = package_name
-
-        self.name = self.get_name()
-        self.body = self.get_body()
+        self.name = sys.intern(func_name.text.decode('utf-8'))
+        self.class_name = sys.intern(class_name)
+        self.package_name = sys.intern(package_name)
+        self.file_path = sys.intern(file_path)
+        self.func_span = (func.start_byte, func.end_byte)
+        self.body_span = (func_body.start_byte, func_body.end_byte)
+        if comment_node is None:
+            self.comment_spans = ()
+        elif isinstance(comment_node, list):
+            self.comment_spans = tuple((c.start_byte, c.end_byte) for c in comment_node)
+        else:
+            self.comment_spans = ((comment_node.start_byte, comment_node.end_byte),)
+        self.start_line = func.start_point[0]
+        self.end_line = func.end_point[0]
+
         self.is_test_func = self.is_test()
+        self.callee_names = ()
+        self.used_classes = ()
         self.callee = set([])
         self.test_funcs = set([])
+        self._hash = hash((self.file_path, self.name))
     
     def is_test(self):
         if self.name and "test" in self.name.lower():
@@ -44,25 +268,46 @@ class FunctionData:
         return False
     def __eq__(self, value: object) -> bool:
         if isinstance(value, FunctionData):
-            return self.file_path == value.file_path and self.get_name() == value.get_name()
+            return self.file_path == value.file_path and self.name == value.name
         return False
     
     def __hash__(self) -> int:
-        return hash(self.file_path + self.get_name())
+        return self._hash
+
+    def __getstate__(self):
+        # callee and test_funcs point to other FunctionData, they are rebuilt after unpickling
+        return {key: getattr(self, key) for key in self.__slots__
+                if key not in ("callee", "test_funcs")}
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            if isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        self.callee_names = tuple(sys.intern(n) for n in self.callee_names)
+        self.used_classes = tuple(sys.intern(n) for n in self.used_classes)
+        self.callee = set([])
+        self.test_funcs = set([])
+
+    def get_text(self, span: tuple):
+        return decode_source(read_source(self.file_path)[span[0]:span[1]])
+
     def get_name(self):
-        return self.name_node.text.decode('utf-8')
+        return self.name
     
     def get_body(self):
-        return self.body_node.text.decode('utf-8')
+        return self.get_text(self.body_span)
 
     def get_func(self):
-        return self.func_node.text.decode('utf-8')
+        return self.get_text(self.func_span)
     
     def get_class_name(self):
-        return self.class_name.text.decode('utf-8')
+        return self.class_name
     
     def get_comment(self):
-        if isinstance(self.comment_node, list):
-            return '\n'.join([i.text.decode('utf-8') for i in self.comment_node])
-        else:
-            return self.comment_node.text.decode('utf-8')
+        if len(self.comment_spans) == 0:
+            return ""
+        source = read_source(self.file_path)
+        return '\n'.join([decode_source(source[start:end]) for start, end in self.comment_spans])
+
+    body = property(get_body)
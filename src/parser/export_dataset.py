@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+
+from parser import py_parser, go_parser, java_parser, csharp_parser
+
+FIELDS = ["task-id", "project", "file_path", "func_name", "signature", "comment", "func",
+          "func_start", "func_end", "test_funcs", "test_func_count", "test_command"]
+
+def parse_project(lan: str, project_path: str, workers=1, cache_dir=None):
+    """
+    return the parser of the project, its functions and the module whose get_func_and_tests applies to them
+    """
+    project_name = os.path.basename(os.path.normpath(project_path))
+    if lan == "py":
+        package_base_path = "src/" if os.path.isdir(os.path.join(project_path, "src")) else ""
+        parser = py_parser.PyParser(project_path, package_base_path=package_base_path,
+                                    workers=workers, cache_dir=cache_dir)
+        return parser, parser.funcs, py_parser
+    elif lan == "go":
+        parser = go_parser.GOParser(project_path, project_name)
+        return parser, parser.parse_project(project_path, workers, cache_dir), go_parser
+    elif lan == "java":
+        parser = java_parser.JavaParser()
+        return parser, parser.parse_project(project_path, workers, cache_dir), java_parser
+    elif lan == "cs":
+        parser = csharp_parser.CSParser()
+        return parser, parser.parse_project(project_path, workers, cache_dir), csharp_parser
+    raise NotImplementedError("Error language type")
+
+def get_signature(f):
+    """
+    the function up to its body, with the opening brace for the brace languages
+    """
+    signature = f.get_text((f.func_span[0], f.body_span[0])).strip()
+    if f.get_body().startswith("{"):
+        signature += " {"
+    return signature
+
+def get_java_module(project_path: str, file_path: str):
+    """
+    the directory of the nearest pom.xml or build.gradle above the file, relative to the project
+    """
+    folder = os.path.dirname(file_path)
+    while True:
+        for build_file in ["pom.xml", "build.gradle", "build.gradle.kts"]:
+            if os.path.exists(os.path.join(project_path, folder, build_file)):
+                return folder, build_file
+        if folder in ["", "."]:
+            return "", None
+        folder = os.path.dirname(folder)
+
+def get_test_command(lan: str, project_path: str, test_funcs: list, methods=False):
+    """
+    the java rows carry the command running their test classes, like `cd module && mvn test -Dtest=A; cd ..`,
+    one such segment per module owning some of the tests, joined by `; `.
+    with methods only the test methods of test_funcs are run, like -Dtest=A#m1+m2.
+    the other languages build their command from test_funcs in run_test.
+    """
+    if lan != "java" or len(test_funcs) == 0:
+        return ""
+    # module -> (build file, test class -> methods), in the order of the sorted tests
+    modules = {}
+    for t in sorted(test_funcs):
+        file_path, name = t.split("::")
+        module, build_file = get_java_module(project_path, file_path)
+        test_classes = modules.setdefault(module, (build_file, {}))[1]
+        test_classes.setdefault(os.path.basename(file_path).replace(".java", ""), []).append(name)
+    commands = []
+    for module, (build_file, test_classes) in modules.items():
+        if build_file in ["build.gradle", "build.gradle.kts"]:
+            if methods:
+                command = "./gradlew test " + " ".join(f"--tests {c}.{m}" for c, ms in test_classes.items() for m in ms)
+            else:
+                command = "./gradlew test " + " ".join(f"--tests {c}" for c in test_classes)
+        else:
+            if methods:
+                command = "mvn test -Dtest=" + ",".join(c + "#" + "+".join(ms) for c, ms in test_classes.items())
+            else:
+                command = "mvn test -Dtest=" + ",".join(test_classes)
+        if module:
+            command = f"cd {module} && {command}; cd {os.path.relpath('.', module)}"
+        commands.append(command)
+    return "; ".join(commands)
+
+def make_row(lan: str, project: str, project_path: str, f):
+    file_path = os.path.relpath(f.file_path, project_path)
+    test_funcs = sorted(set(os.path.relpath(t.file_path, project_path) + "::" + t.name for t in f.test_funcs))
+    return {
+        "task-id": f"{project}-{file_path}-{f.name}",
+        "project": project,
+        "file_path": file_path,
+        "func_name": f.name,
+        "signature": get_signature(f),
+        "comment": f.get_comment(),
+        "func": f.get_func(),
+        "func_start": f.start_line,
+        "func_end": f.end_line,
+        "test_funcs": " ".join(test_funcs),
+        "test_func_count": len(test_funcs),
+        "test_command": get_test_command(lan, project_path, test_funcs),
+    }
+
+def iter_project_rows(lan: str, project_path: str, workers=1, cache_dir=None):
+    """
+    yield the rows of the functions with tests and comment, one at a time.
+    the source text of a row is sliced when the row is made, the functions keep only spans.
+    """
+    project = os.path.basename(os.path.normpath(project_path))
+    _, funcs, module = parse_project(lan, project_path, workers, cache_dir)
+    for f in module.get_func_and_tests(funcs):
+        yield make_row(lan, project, project_path, f)
+
+class JsonlWriter:
+    def __init__(self, output_path: str):
+        self.file = open(output_path, "w", encoding="utf-8")
+
+    def write(self, row: dict):
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    """
+    buffer at most batch_size rows, each full buffer becomes one row group of the file
+    """
+    def __init__(self, output_path: str, batch_size=1024):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([(name, pa.int64() if name in ["func_start", "func_end", "test_func_count"]
+                                  else pa.string()) for name in FIELDS])
+        self.writer = pq.ParquetWriter(output_path, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def write(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+def export_dataset(lan: str, project_paths: list, output_path: str, output_format="jsonl",
+                   workers=1, cache_dir=None):
+    """
+    mine the projects one after another and stream their rows to output_path,
+    only one project's functions are in memory at a time
+    """
+    if output_format == "parquet":
+        writer = ParquetWriter(output_path)
+    elif output_format == "jsonl":
+        writer = JsonlWriter(output_path)
+    else:
+        raise NotImplementedError("Error output format, should be jsonl or parquet")
+    row_count = 0
+    try:
+        for project_path in project_paths:
+            project_rows = 0
+            for row in iter_project_rows(lan, project_path, workers, cache_dir):
+                writer.write(row)
+                project_rows += 1
+            print("project:", os.path.basename(os.path.normpath(project_path)), project_rows)
+            row_count += project_rows
+    finally:
+        writer.close()
+    return row_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-repo_root", help="directory holding one sub directory per project, e.g. /root/repos/py_data")
+    parser.add_argument("-projects", default="", help="comma separated projects in repo_root, all of them if empty")
+    parser.add_argument("-lan", help="Programming language, one of py, go, java, cs")
+    parser.add_argument("-output", help="Path to the output .jsonl or .parquet file")
+    parser.add_argument("-format", default="", help="jsonl or parquet, taken from the output suffix if empty")
+    parser.add_argument("-workers", type=int, default=1, help="processes parsing the files of a project")
+    parser.add_argument("-cache_dir", default=None, help="directory of the parse cache")
+    args = parser.parse_args()
+
+    projects = args.projects.split(",") if args.projects else sorted(os.listdir(args.repo_root))
+    project_paths = [os.path.join(args.repo_root, p) for p in projects
+                     if os.path.isdir(os.path.join(args.repo_root, p))]
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    row_count = export_dataset(args.lan, project_paths, args.output, output_format,
+                               args.workers, args.cache_dir)
+    print(f"{row_count} rows written to {args.output}")
@@ -0,0 +1,169 @@
+import os
+import re
+
+# directories never holding project sources, pruned during the walk
+PRUNE_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", ".tox", ".nox",
+              ".mypy_cache", ".pytest_cache", ".ipynb_checkpoints", ".idea", ".vscode", ".gradle"}
+# build outputs and dependency copies of each language
+LANGUAGE_PRUNE_DIRS = {
+    "py": set(),
+    "go": {"vendor"},
+    "java": {"target", ".mvn"},
+    "cs": {"bin", "obj", "packages"},
+}
+# larger files are data or generated code, not functions with tests
+MAX_FILE_SIZE = 2 * 1024 * 1024
+# markers of generated files, searched in the head of the file
+GENERATED_MARKERS = re.compile(rb"^// Code generated .* DO NOT EDIT\.$|<auto-generated|@generated|"
+                               rb"Generated by the protocol buffer compiler", re.MULTILINE)
+HEAD_SIZE = 4096
+# a head whose lines are this long on average is minified or data
+MAX_LINE_LENGTH = 1000
+
+def glob_to_regex(pattern: str):
+    """
+    translate one .gitignore glob into a regex over '/' separated relative paths
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                chars = pattern[i+1:end]
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                regex += "[" + chars.replace("\\", "\\\\") + "]"
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+class IgnoreRules:
+    """
+    the .gitignore rules seen on the way down to a directory. like git, the last matching rule wins,
+    and a file in an ignored directory can not be included again since the directory is pruned.
+    """
+    def __init__(self, rules=None):
+        self.rules = rules if rules is not None else []  # (regex, negate, dir_only)
+
+    def extend(self, root: str, rel_dir: str):
+        ignore_path = os.path.join(root, ".gitignore")
+        if not os.path.isfile(ignore_path):
+            return self
+        rules = list(self.rules)
+        with open(ignore_path, "r", errors="ignore") as f:
+            for line in f:
+                line = line.rstrip("\n").rstrip("\r")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                if not line.endswith("\\ "):
+                    line = line.rstrip()
+                negate = line.startswith("!")
+                if negate:
+                    line = line[1:]
+                dir_only = line.endswith("/")
+                line = line.rstrip("/")
+                if not line:
+                    continue
+                # a pattern with a slash is relative to the .gitignore, otherwise it matches at any depth
+                anchored = "/" in line
+                line = line.lstrip("/")
+                prefix = re.escape(rel_dir + "/") if rel_dir else ""
+                if anchored:
+                    regex = prefix + glob_to_regex(line)
+                else:
+                    regex = prefix + "(?:.*/)?" + glob_to_regex(line)
+                rules.append((re.compile(regex + "$"), negate, dir_only))
+        return IgnoreRules(rules)
+
+    def ignored(self, rel_path: str, is_dir: bool):
+        ignored = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                ignored = not negate
+        return ignored
+
+def is_generated_or_minified(file_path: str, size: int):
+    with open(file_path, "rb") as f:
+        head = f.read(HEAD_SIZE)
+    if b"\0" in head:
+        return True
+    # every marker has this substring, the regex only runs on the few heads having it
+    if b"enerated" in head and GENERATED_MARKERS.search(head):
+        return True
+    if len(head) > MAX_LINE_LENGTH and head.count(b"\n") < len(head) // MAX_LINE_LENGTH:
+        return True
+    return False
+
+def scan_files(project_path: str, extensions: tuple, lan: str = None, exclude_dirs=[],
+               use_gitignore=True, max_file_size=MAX_FILE_SIZE):
+    """
+    the source files with one of the extensions under project_path, in os.walk order.
+    pruned and ignored directories are not entered, a directory is also skipped if one of exclude_dirs
+    is a substring of its path. oversized, generated, minified and binary files are left out.
+    """
+    prune_dirs = PRUNE_DIRS | LANGUAGE_PRUNE_DIRS.get(lan, set())
+    # path of a directory to be walked -> (its path relative to project_path, the rules of its parent)
+    pending = {project_path: ("", IgnoreRules())}
+    file_paths = []
+    for root, dirs, files in os.walk(project_path):
+        rel_dir, rules = pending.pop(root)
+        if use_gitignore:
+            rules = rules.extend(root, rel_dir)
+
+        kept_dirs = []
+        for d in dirs:
+            if d in prune_dirs:
+                continue
+            dir_path = os.path.join(root, d)
+            if any(exclude_dir in dir_path for exclude_dir in exclude_dirs):
+                continue
+            rel_path = rel_dir + "/" + d if rel_dir else d
+            if rules.ignored(rel_path, True):
+                continue
+            kept_dirs.append(d)
+            pending[dir_path] = (rel_path, rules)
+        dirs[:] = kept_dirs
+
+        if any(exclude_dir in root for exclude_dir in exclude_dirs):
+            continue
+        for file in files:
+            if not file.endswith(extensions):
+                continue
+            if rules.ignored(rel_dir + "/" + file if rel_dir else file, False):
+                continue
+            file_path = os.path.join(root, file)
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            if size > max_file_size or is_generated_or_minified(file_path, size):
+                continue
+            file_paths.append(file_path)
+    return file_paths
@@ -1,22 +1,51 @@
-from parser.base_parser import BaseParser, FunctionData
+from parser.base_parser import BaseParser, FunctionData, index_by_name
+from parser.file_scanner import scan_files
 from tree_sitter import Language, Parser, Node
 import tree_sitter_java as tsjava
 import os
 import tqdm
 
 class JavaParser(BaseParser):
-    
+    language_module = tsjava
+    QUERIES = {
+        "function": """
+        (
+            (block_comment)* @comment .
+            (method_declaration
+                name: (identifier)@func_name
+                body: (block)@func_body
+            ) @method
+        )
+        (
+            (line_comment)* @comment .
+            (method_declaration
+                name: (identifier)@func_name
+                body: (block)@func_body
+            ) @method
+        )
+        """,
+        "import": """
+        (import_declaration
+            (scoped_identifier) @import_scope
+        )
+        """,
+        "callee": """
+        (method_invocation
+            name: (identifier) @callee_name
+            )
+        """,
+        "package": """
+        (package_declaration 
+            (scoped_identifier) @package_name
+        )
+        """,
+    }
+
     def __init__(self):
         super().__init__(Language(tsjava.language()))
 
     def parse_package_name(self, node: Node):
-        package_query = """
-        (package_declaration 
-            (scoped_identifier) @package_name
-        )
-        """
-        query = self.LANGUAGE.query(package_query)
-        matches = query.matches(node)
+        matches = self.get_query("package").matches(node)
         if matches:
             package_name = matches[0][1]["package_name"].text.decode('utf-8')
         else:
@@ -32,134 +61,85 @@ class JavaParser(BaseParser):
         return ""
     
     def extract_import_info(self, node: Node):
-        import_query = """
-        (import_declaration
-            (scoped_identifier) @import_scope
-        )
-        """
-        query = self.LANGUAGE.query(import_query)
-        matches = query.matches(node)
         import_info = []
-        if matches:
-            for match in matches:
-                import_scope = match[1]["import_scope"]
-                import_info.append(import_scope.text.decode('utf-8'))
+        for _, captures in self.get_query("import").matches(node):
+            import_info.extend(self.make_imports(captures))
         return import_info
 
+    def make_imports(self, captures: dict):
+        return [captures["import_scope"].text.decode('utf-8')]
+
     def extract_callee_name(self, node: Node):
-        invocation_query = """
-        (method_invocation
-            name: (identifier) @callee_name
-            )
-        """
-        query = self.LANGUAGE.query(invocation_query)
-        matches = query.matches(node)
         callees = []
-        if matches:
-            for match in matches:
-                callee_name = match[1]["callee_name"]
-                if callee_name:
-                    callees.append(callee_name.text.decode('utf-8'))
+        for _, captures in self.get_query("callee").matches(node):
+            callee_name = captures["callee_name"]
+            if callee_name:
+                callees.append(callee_name.text.decode('utf-8'))
         return callees
 
     def get_function_defintion(self, node: Node, file_path: str):
-        func_query = """
-        (
-            (block_comment)* @comment .
-            (method_declaration
-                name: (identifier)@func_name
-                body: (block)@func_body
-            ) @method
-        )
-        (
-            (line_comment)* @comment .
-            (method_declaration
-                name: (identifier)@func_name
-                body: (block)@func_body
-            ) @method
-        )
-        """
-        query = self.LANGUAGE.query(func_query)
-        matches = query.matches(node)
-        func_defs = []
-        if matches:
-            for match in matches:
-                func_name = match[1]["func_name"]
-                func_body = match[1]["func_body"]
-                func = match[1]["method"]
-                comment_node = match[1].get("comment", None)
-                class_name = self.get_class_name(func)
-                package_name = self.parse_package_name(node)
-                
-                func_defs.append(FunctionData(func_name, func_body, func, 
-                                            comment_node, class_name, package_name, file_path))
-        return func_defs
-    def parse_project(self, dir: str):
-        func_defs = {}
-        func_imports = {}
+        package_name = self.parse_package_name(node)
+        return [self.make_function(captures, file_path, package_name)
+                for _, captures in self.get_query("function").matches(node)]
+
+    def make_function(self, captures: dict, file_path: str, package_name: str):
+        func_name = captures["func_name"]
+        func_body = captures["func_body"]
+        func = captures["method"]
+        comment_node = captures.get("comment", None)
+        class_name = self.get_class_name(func)
+        return FunctionData(func_name, func_body, func,
+                            comment_node, class_name, package_name, file_path)
+
+    def parse_project(self, dir: str, workers=1, cache_dir=None):
         if not os.path.exists(dir):
             raise FileNotFoundError("Directory not found")
-        for root, dirs, files in os.walk(dir):
-            for file in files:
-                if file.endswith(".java"):
-                    file_path = os.path.join(root, file)
-                    root_node = self.parse(file_path)
-                    defs = self.get_function_defintion(root_node, file_path)
-                    if len(defs) == 0:
-                        continue
-                    func_defs[file_path] = defs
-                    func_imports[file_path] = self.extract_import_info(root_node)
+        self.use_cache(cache_dir, dir)
+        file_paths = scan_files(dir, (".java",), "java")
+        func_defs, func_imports = self.parse_files(file_paths, workers)
 
-        self.build_call_relation(func_defs, func_imports)
+        self.link_project(func_defs, func_imports)
         all_funcs = []
         for key in func_defs.keys():
             all_funcs.extend(func_defs[key])
         return all_funcs
         
     
-    def build_call_relation(self, func_defs: dict, func_imports: dict):
+    def build_call_relation(self, func_defs: dict, func_imports: dict, paths: list = None):
         """
         iter the func defs, add all the import context, and the context in the same file as the possible callees
+        only the callees of the files in paths are resolved, all the files when it is None
         possible context:
         1. funcs in same package 
         2. funcs in import files
         """
-        # build file possible context, add all the funcs defined in the import files and the same file
-        
+        # name tables of every file and package, the possible context of a file is looked up in them
         package_funcs = {}  # group the funcs according to package
+        file_funcs = {}
         import_info_to_path = {}
         for path in func_defs.keys():
             func_def = func_defs[path]
             package_name = func_def[0].package_name
             class_name = func_def[0].class_name
 
-            if package_name not in package_funcs.keys():
-                package_funcs[package_name] = []
-            package_funcs[package_name].extend(func_def)
+            index_by_name(func_def, package_funcs.setdefault(package_name, {}))
+            file_funcs[path] = index_by_name(func_def)
 
             import_info_to_path[package_name+'.'+class_name] = path
 
-        file_possible_context = {}
-        for path in func_defs.keys():
-            file_possible_context[path] = []
-            func_def = func_defs[path]
-            import_info = func_imports[path]
-            for info in import_info:
-                if info in import_info_to_path.keys():
-                    file_possible_context[path].extend(func_defs[import_info_to_path[info]])
-            file_possible_context[path].extend(func_def)
-            file_possible_context[path].extend(package_funcs[func_def[0].package_name])
-            file_possible_context[path] = list(set(file_possible_context[path]))
-        
         # build call relation
-        for path in tqdm.tqdm(func_defs.keys()):
+        for path in tqdm.tqdm(func_defs.keys() if paths is None else paths):
             func_def = func_defs[path]
+            # the funcs in the package (the same file included) and in the imported files
+            file_possible_context = [package_funcs[func_def[0].package_name]]
+            for info in func_imports[path]:
+                if info in import_info_to_path:
+                    file_possible_context.append(file_funcs[import_info_to_path[info]])
             for func in func_def:
-                callee_names = self.extract_callee_name(func.func_node)
-                for callee_name in callee_names:
-                    for context_func in file_possible_context[path]:
-                        if callee_name == context_func.name:
-                            func.callee.add(context_func)
+                for callee_name in func.callee_names:
+                    for context in file_possible_context:
+                        if callee_name in context:
+                            func.callee.update(context[callee_name].values())
         return func_defs
 
 def get_func_and_tests(func_defs):
@@ -170,22 +150,18 @@ def get_func_and_tests(func_defs):
         for callee in t.callee:
             callee.test_funcs.add(t)
     self_def_func_with_test = [i for i in func_defs if len(i.test_funcs) != 0]
-    self_def_func_with_test = [i for i in self_def_func_with_test if i.comment_node]
+    self_def_func_with_test = [i for i in self_def_func_with_test if i.get_comment()]
     return self_def_func_with_test
 
-def test_repo(repo_path):
+def test_repo(repo_path, workers=1):
     parser = JavaParser()
-    func_defs = parser.parse_project(repo_path)
+    func_defs = parser.parse_project(repo_path, workers)
     func_with_tests = get_func_and_tests(func_defs)
     print("project:", os.path.basename(repo_path), len(func_with_tests))
     for f in func_with_tests:
         print("=="*10)
         print(f.name)
-        if isinstance(f.comment_node, list):
-            for c in f.comment_node:
-                print(c.text.decode('utf-8'))
-        else:
-            print(f.comment_node.text.decode('utf-8'))
+        print(f.get_comment())
         print("--"*10)
         print(' '.join([i.name for i in f.test_funcs]))
     
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import pickle
+
+# bump when the cached FunctionData or import info change their shape
+CACHE_VERSION = 3
+
+def file_hash(file_path: str):
+    with open(file_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class ParseCache:
+    """
+    on-disk cache of one project: the parse_file result of every file, keyed by file path and
+    content hash, and the resolved callees of every function.
+    on a rerun only the changed files are parsed, and only the files whose callees may have
+    changed are given to build_call_relation, the edges of the other files are restored.
+    """
+    def __init__(self, cache_dir: str, project_key: str):
+        self.cache_path = os.path.join(cache_dir, project_key + ".pkl")
+        self.files = {}  # file_path -> (stat, content hash, defs, imports)
+        self.edges = {}  # file_path -> for each def, the (file_path, index) of its callees
+        self.changed = set()
+        self.old_defs = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.files = data["files"]
+                self.edges = data["edges"]
+
+    def get(self, file_path: str):
+        """
+        return the cached (defs, imports) of the file, or None if it is new or changed.
+        the content is only hashed when size or mtime differ from the cached stat.
+        """
+        if file_path not in self.files:
+            return None
+        stat, content_hash, defs, imports = self.files[file_path]
+        st = os.stat(file_path)
+        if (st.st_size, st.st_mtime_ns) != stat:
+            if file_hash(file_path) != content_hash:
+                return None
+            self.files[file_path] = ((st.st_size, st.st_mtime_ns), content_hash, defs, imports)
+        return defs, imports
+
+    def put(self, file_path: str, defs: list, imports: list):
+        st = os.stat(file_path)
+        if file_path in self.files:
+            self.old_defs[file_path] = self.files[file_path][2]
+        self.files[file_path] = ((st.st_size, st.st_mtime_ns), file_hash(file_path), defs, imports)
+        self.changed.add(file_path)
+
+    def stale_paths(self, func_defs: dict):
+        """
+        the files whose callees have to be resolved again: the changed files, and the files calling
+        a name that is defined, or was defined, in a changed file.
+        files added or removed, or a changed package/class of a file, can move whole import scopes,
+        then every file is stale.
+        """
+        if set(func_defs.keys()) != set(self.edges.keys()):
+            return list(func_defs.keys())
+        dirty_names = set()
+        for path in self.changed:
+            old_defs = self.old_defs.get(path, [])
+            new_defs = func_defs.get(path, [])
+            if len(old_defs) == 0 or len(new_defs) == 0:
+                # without defs before and after, otherwise the file set above has changed
+                continue
+            if (old_defs[0].package_name, old_defs[0].class_name) != \
+                    (new_defs[0].package_name, new_defs[0].class_name):
+                return list(func_defs.keys())
+            dirty_names.update(f.name for f in old_defs)
+            dirty_names.update(f.name for f in new_defs)
+        stale = []
+        for path, defs in func_defs.items():
+            if path in self.changed or any(n in dirty_names for f in defs for n in f.callee_names):
+                stale.append(path)
+        return stale
+
+    def restore_edges(self, func_defs: dict, stale: list):
+        stale = set(stale)
+        for path, defs in func_defs.items():
+            if path in stale:
+                continue
+            for f, callees in zip(defs, self.edges[path]):
+                f.callee = set(func_defs[p][i] for p, i in callees)
+
+    def save(self, func_defs: dict):
+        position = {}
+        for path, defs in func_defs.items():
+            for i, f in enumerate(defs):
+                position[id(f)] = (path, i)
+        self.edges = {}
+        for path, defs in func_defs.items():
+            self.edges[path] = [[position[id(c)] for c in f.callee] for f in defs]
+        # files without defs stay cached, so they are not parsed again
+        self.files = {path: v for path, v in self.files.items() if os.path.exists(path)}
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": CACHE_VERSION, "files": self.files, "edges": self.edges}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
+        self.changed = set()
+        self.old_defs = {}
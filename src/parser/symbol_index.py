@@ -0,0 +1,199 @@
+import argparse
+import os
+import sqlite3
+
+from parser.base_parser import decode_source, read_source
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (name TEXT PRIMARY KEY, lan TEXT, path TEXT);
+CREATE TABLE IF NOT EXISTS packages (id INTEGER PRIMARY KEY, project TEXT, name TEXT);
+CREATE TABLE IF NOT EXISTS classes (id INTEGER PRIMARY KEY, project TEXT, package_id INTEGER, name TEXT, file_path TEXT);
+CREATE TABLE IF NOT EXISTS functions (id INTEGER PRIMARY KEY, project TEXT, file_path TEXT, name TEXT,
+                                      class_id INTEGER, package_id INTEGER,
+                                      start_line INTEGER, end_line INTEGER, is_test INTEGER);
+CREATE TABLE IF NOT EXISTS spans (function_id INTEGER, kind TEXT, start_byte INTEGER, end_byte INTEGER);
+CREATE TABLE IF NOT EXISTS imports (project TEXT, file_path TEXT, import_path TEXT, import_name TEXT);
+CREATE TABLE IF NOT EXISTS call_edges (caller_id INTEGER, callee_id INTEGER);
+CREATE TABLE IF NOT EXISTS test_edges (test_id INTEGER, function_id INTEGER);
+CREATE INDEX IF NOT EXISTS packages_project ON packages (project, name);
+CREATE INDEX IF NOT EXISTS classes_project ON classes (project, name);
+CREATE INDEX IF NOT EXISTS functions_name ON functions (name, project);
+CREATE INDEX IF NOT EXISTS functions_file ON functions (project, file_path);
+CREATE INDEX IF NOT EXISTS spans_function ON spans (function_id);
+CREATE INDEX IF NOT EXISTS imports_file ON imports (project, file_path);
+CREATE INDEX IF NOT EXISTS call_edges_caller ON call_edges (caller_id);
+CREATE INDEX IF NOT EXISTS call_edges_callee ON call_edges (callee_id);
+CREATE INDEX IF NOT EXISTS test_edges_test ON test_edges (test_id);
+CREATE INDEX IF NOT EXISTS test_edges_function ON test_edges (function_id);
+"""
+
+def import_rows(project: str, project_path: str, file_path: str, imports: list):
+    """
+    the import info of the parsers is a dict of import_path and import_name for python,
+    and the imported path or scope string for the other languages.
+    the imported directories go resolves inside the project are made relative like the file paths.
+    """
+    for i in imports:
+        if isinstance(i, dict):
+            yield (project, file_path, i.get("import_path", ""), i.get("import_name", ""))
+        elif os.path.isabs(i) and i.startswith(project_path):
+            yield (project, file_path, os.path.relpath(i, project_path), "")
+        else:
+            yield (project, file_path, str(i), "")
+
+class SymbolIndex:
+    """
+    the functions, classes, packages, imports, call edges and test edges of the parsed projects in one
+    sqlite database. a project is loaded with add_project in one transaction, replacing its old rows.
+    file paths are relative to the project, the function text is read back through the spans.
+    test edges are the callees of the test functions, before get_func_and_tests filters them.
+    """
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def next_id(self, table: str):
+        return self.conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+    def remove_project(self, project: str):
+        function_ids = "SELECT id FROM functions WHERE project = ?"
+        self.conn.execute(f"DELETE FROM spans WHERE function_id IN ({function_ids})", (project,))
+        self.conn.execute(f"DELETE FROM call_edges WHERE caller_id IN ({function_ids})", (project,))
+        self.conn.execute(f"DELETE FROM test_edges WHERE test_id IN ({function_ids})", (project,))
+        for table in ["functions", "classes", "packages", "imports"]:
+            self.conn.execute(f"DELETE FROM {table} WHERE project = ?", (project,))
+        self.conn.execute("DELETE FROM projects WHERE name = ?", (project,))
+
+    def add_project(self, project: str, lan: str, project_path: str, funcs: list, file_imports: dict):
+        """
+        bulk load the functions of a parsed project and their edges, ids are given here so that
+        every table is written with one executemany
+        """
+        with self.conn:
+            self.remove_project(project)
+            self.conn.execute("INSERT INTO projects VALUES (?, ?, ?)", (project, lan, os.path.abspath(project_path)))
+
+            package_ids = {}
+            package_id = self.next_id("packages")
+            for f in funcs:
+                if f.package_name and f.package_name not in package_ids:
+                    package_ids[f.package_name] = package_id
+                    package_id += 1
+            class_ids = {}
+            class_id = self.next_id("classes")
+            for f in funcs:
+                key = (f.package_name, f.class_name, f.file_path)
+                if f.class_name and key not in class_ids:
+                    class_ids[key] = class_id
+                    class_id += 1
+            function_ids = {}
+            function_id = self.next_id("functions")
+            for f in funcs:
+                function_ids[id(f)] = function_id
+                function_id += 1
+
+            rel_paths = {}
+            def rel_path(file_path):
+                if file_path not in rel_paths:
+                    rel_paths[file_path] = os.path.relpath(file_path, project_path)
+                return rel_paths[file_path]
+
+            self.conn.executemany("INSERT INTO packages VALUES (?, ?, ?)",
+                                  [(i, project, name) for name, i in package_ids.items()])
+            self.conn.executemany("INSERT INTO classes VALUES (?, ?, ?, ?, ?)",
+                                  [(i, project, package_ids.get(package_name), class_name, rel_path(file_path))
+                                   for (package_name, class_name, file_path), i in class_ids.items()])
+            self.conn.executemany("INSERT INTO functions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+                (function_ids[id(f)], project, rel_path(f.file_path), f.name,
+                 class_ids.get((f.package_name, f.class_name, f.file_path)), package_ids.get(f.package_name),
+                 f.start_line, f.end_line, int(f.is_test_func)) for f in funcs])
+
+            spans = []
+            for f in funcs:
+                i = function_ids[id(f)]
+                spans.append((i, "func", f.func_span[0], f.func_span[1]))
+                spans.append((i, "body", f.body_span[0], f.body_span[1]))
+                spans.extend((i, "comment", start, end) for start, end in f.comment_spans)
+            self.conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?)", spans)
+
+            self.conn.executemany("INSERT INTO imports VALUES (?, ?, ?, ?)",
+                                  [row for file_path, imports in file_imports.items()
+                                   for row in import_rows(project, project_path, rel_path(file_path), imports)])
+            # a callee outside funcs, e.g. of another parser run, has no id and is left out
+            self.conn.executemany("INSERT INTO call_edges VALUES (?, ?)",
+                                  [(function_ids[id(f)], function_ids[id(c)])
+                                   for f in funcs for c in f.callee if id(c) in function_ids])
+            self.conn.executemany("INSERT INTO test_edges VALUES (?, ?)",
+                                  [(function_ids[id(f)], function_ids[id(c)])
+                                   for f in funcs if f.is_test_func
+                                   for c in f.callee if id(c) in function_ids])
+
+    def find_functions(self, name: str, project: str = None):
+        query = """SELECT functions.*, classes.name AS class_name, packages.name AS package_name
+                   FROM functions LEFT JOIN classes ON functions.class_id = classes.id
+                   LEFT JOIN packages ON functions.package_id = packages.id WHERE functions.name = ?"""
+        if project is None:
+            return self.conn.execute(query, (name,)).fetchall()
+        return self.conn.execute(query + " AND functions.project = ?", (name, project)).fetchall()
+
+    def functions_in_file(self, project: str, file_path: str):
+        return self.conn.execute("SELECT * FROM functions WHERE project = ? AND file_path = ? ORDER BY start_line",
+                                 (project, file_path)).fetchall()
+
+    def callees(self, function_id: int):
+        return self.conn.execute("""SELECT functions.* FROM call_edges JOIN functions ON call_edges.callee_id = functions.id
+                                    WHERE call_edges.caller_id = ?""", (function_id,)).fetchall()
+
+    def callers(self, function_id: int):
+        return self.conn.execute("""SELECT functions.* FROM call_edges JOIN functions ON call_edges.caller_id = functions.id
+                                    WHERE call_edges.callee_id = ?""", (function_id,)).fetchall()
+
+    def tests(self, function_id: int):
+        return self.conn.execute("""SELECT functions.* FROM test_edges JOIN functions ON test_edges.test_id = functions.id
+                                    WHERE test_edges.function_id = ?""", (function_id,)).fetchall()
+
+    def imports(self, project: str, file_path: str):
+        return self.conn.execute("SELECT import_path, import_name FROM imports WHERE project = ? AND file_path = ?",
+                                 (project, file_path)).fetchall()
+
+    def get_text(self, function_id: int, kind: str = "func"):
+        """
+        the function, body or comment text of a function, read from the project files
+        """
+        row = self.conn.execute("""SELECT projects.path, functions.file_path FROM functions
+                                   JOIN projects ON functions.project = projects.name WHERE functions.id = ?""",
+                                (function_id,)).fetchone()
+        if row is None:
+            return ""
+        source = read_source(os.path.join(row["path"], row["file_path"]))
+        spans = self.conn.execute("SELECT start_byte, end_byte FROM spans WHERE function_id = ? AND kind = ?",
+                                  (function_id, kind)).fetchall()
+        return '\n'.join(decode_source(source[start:end]) for start, end in spans)
+
+if __name__ == "__main__":
+    from parser.export_dataset import parse_project
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-repo_root", help="directory holding one sub directory per project, e.g. /root/repos/py_data")
+    parser.add_argument("-projects", default="", help="comma separated projects in repo_root, all of them if empty")
+    parser.add_argument("-lan", help="Programming language, one of py, go, java, cs")
+    parser.add_argument("-db", help="Path to the sqlite database")
+    parser.add_argument("-workers", type=int, default=1, help="processes parsing the files of a project")
+    parser.add_argument("-cache_dir", default=None, help="directory of the parse cache")
+    args = parser.parse_args()
+
+    projects = args.projects.split(",") if args.projects else sorted(os.listdir(args.repo_root))
+    index = SymbolIndex(args.db)
+    for project in projects:
+        project_path = os.path.join(args.repo_root, project)
+        if not os.path.isdir(project_path):
+            continue
+        project_parser, funcs, _ = parse_project(args.lan, project_path, args.workers, args.cache_dir)
+        index.add_project(project, args.lan, project_path, funcs, project_parser.file_imports)
+        print("project:", project, len(funcs))
+    index.close()
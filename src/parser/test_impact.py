@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+class TestImpactIndex:
+    """
+    reverse call graph of a project in CSR arrays: the callers of function i are
+    indices[indptr[i]:indptr[i+1]]. the tests reaching a function are found by walking the
+    callers breadth first, so a test calling a helper that calls the function is found at depth 2.
+    tests end the walk, a test called by another test does not pull in the caller.
+    """
+    def __init__(self, indptr, indices, is_test, file_paths, names, start_lines):
+        self.indptr = indptr
+        self.indices = indices
+        self.is_test = is_test
+        self.file_paths = file_paths
+        self.names = names
+        self.start_lines = start_lines
+        self.by_name = {}
+        for i, (file_path, name) in enumerate(zip(file_paths, names)):
+            self.by_name.setdefault((str(file_path), str(name)), []).append(i)
+
+    @classmethod
+    def from_edges(cls, callers, callees, is_test, file_paths, names, start_lines):
+        n = len(names)
+        callers = np.asarray(callers, dtype=np.int32)
+        callees = np.asarray(callees, dtype=np.int32)
+        order = np.argsort(callees, kind="stable")
+        indices = callers[order]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(callees, minlength=n), out=indptr[1:])
+        return cls(indptr, indices, np.asarray(is_test, dtype=bool), np.asarray(file_paths, dtype=str),
+                   np.asarray(names, dtype=str), np.asarray(start_lines, dtype=np.int32))
+
+    @classmethod
+    def from_funcs(cls, funcs: list, project_path: str):
+        """
+        from the functions of a parser, with file paths relative to the project like the dataset
+        """
+        position = {id(f): i for i, f in enumerate(funcs)}
+        callers, callees = [], []
+        for i, f in enumerate(funcs):
+            for c in f.callee:
+                if id(c) in position:
+                    callers.append(i)
+                    callees.append(position[id(c)])
+        return cls.from_edges(callers, callees, [f.is_test_func for f in funcs],
+                              [os.path.relpath(f.file_path, project_path) for f in funcs],
+                              [f.name for f in funcs], [f.start_line for f in funcs])
+
+    @classmethod
+    def from_symbol_index(cls, symbol_index, project: str):
+        rows = symbol_index.conn.execute(
+            "SELECT id, file_path, name, start_line, is_test FROM functions WHERE project = ? ORDER BY id",
+            (project,)).fetchall()
+        position = {r["id"]: i for i, r in enumerate(rows)}
+        edges = symbol_index.conn.execute(
+            """SELECT caller_id, callee_id FROM call_edges JOIN functions ON call_edges.caller_id = functions.id
+               WHERE functions.project = ?""", (project,)).fetchall()
+        return cls.from_edges([position[e[0]] for e in edges], [position[e[1]] for e in edges],
+                              [r["is_test"] for r in rows], [r["file_path"] for r in rows],
+                              [r["name"] for r in rows], [r["start_line"] for r in rows])
+
+    def save(self, path: str):
+        np.savez_compressed(path, indptr=self.indptr, indices=self.indices, is_test=self.is_test,
+                            file_paths=self.file_paths, names=self.names, start_lines=self.start_lines)
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        return cls(data["indptr"], data["indices"], data["is_test"], data["file_paths"],
+                   data["names"], data["start_lines"])
+
+    def find(self, file_path: str, name: str, start_line: int = None):
+        """
+        the function defined in file_path with name, the one starting at start_line if there are several
+        """
+        candidates = self.by_name.get((file_path, name), [])
+        if start_line is not None and len(candidates) > 1:
+            exact = [i for i in candidates if self.start_lines[i] == start_line]
+            if exact:
+                return exact[0]
+        return candidates[0] if candidates else None
+
+    def reaching_tests(self, func: int, max_depth: int = 3):
+        """
+        tests reaching func over at most max_depth calls, and the depth each is reached at
+        """
+        depth = np.full(len(self.names), -1, dtype=np.int32)
+        depth[func] = 0
+        frontier = np.array([func], dtype=np.int32)
+        for d in range(1, max_depth + 1):
+            if len(frontier) == 0:
+                break
+            # tests are not walked through, only the callers of the other functions are.
+            # func itself is, it may be a helper defined in a test file
+            if d > 1:
+                frontier = frontier[~self.is_test[frontier]]
+                if len(frontier) == 0:
+                    break
+            callers = np.concatenate([self.indices[self.indptr[i]:self.indptr[i+1]] for i in frontier])
+            callers = np.unique(callers)
+            callers = callers[depth[callers] == -1]
+            depth[callers] = d
+            frontier = callers
+        tests = np.nonzero((depth > 0) & self.is_test)[0]
+        return tests, depth[tests]
+
+    def select_tests(self, func: int, max_depth: int = 3):
+        """
+        the minimal selection for a function: the tests at the smallest depth that has any.
+        return the tests as "file_path::name" and that depth, 0 if no test reaches the function
+        """
+        tests, depths = self.reaching_tests(func, max_depth)
+        if len(tests) == 0:
+            return [], 0
+        nearest = depths.min()
+        selected = sorted(set(f"{self.file_paths[t]}::{self.names[t]}" for t in tests[depths == nearest]))
+        return selected, int(nearest)
+
+def select_dataset_tests(test_df: pd.DataFrame, indexes: dict, lan: str, repo_root: str, max_depth: int = 3):
+    """
+    the test selector of every task: test_funcs, and for java the test_command running only those methods.
+    tasks whose function is not found, or reached by no test, keep their own tests.
+    """
+    from parser.export_dataset import get_test_command
+    selection = {}
+    for _, row in test_df.iterrows():
+        index = indexes.get(row["project"])
+        if index is None:
+            continue
+        func = index.find(row["file_path"], row["func_name"], row["func_start"])
+        if func is None:
+            continue
+        test_funcs, depth = index.select_tests(func, max_depth)
+        if len(test_funcs) == 0:
+            continue
+        selection[row["task-id"]] = {
+            "test_funcs": " ".join(test_funcs),
+            "test_command": get_test_command(lan, os.path.join(repo_root, row["project"]), test_funcs, methods=True),
+            "depth": depth,
+        }
+    return selection
+
+if __name__ == "__main__":
+    from parser.export_dataset import parse_project
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-df_path", help="Path to the dataset excel file")
+    parser.add_argument("-repo_root", help="directory holding one sub directory per project, e.g. /root/repos/py_data")
+    parser.add_argument("-lan", help="Programming language, one of py, go, java, cs")
+    parser.add_argument("-output", help="Path to the output json, task-id -> selected tests")
+    parser.add_argument("-max_depth", type=int, default=3, help="most calls between a test and the function")
+    parser.add_argument("-index_dir", default=None, help="directory of the saved .npz indexes, built if missing")
+    parser.add_argument("-db", default=None, help="sqlite symbol index to read the call graphs from instead of parsing")
+    parser.add_argument("-workers", type=int, default=1, help="processes parsing the files of a project")
+    parser.add_argument("-cache_dir", default=None, help="directory of the parse cache")
+    args = parser.parse_args()
+
+    test_df = pd.read_excel(args.df_path)
+    symbol_index = None
+    if args.db:
+        from parser.symbol_index import SymbolIndex
+        symbol_index = SymbolIndex(args.db)
+    indexes = {}
+    for project in test_df["project"].unique():
+        index_path = os.path.join(args.index_dir, f"{args.lan}_{project}.npz") if args.index_dir else None
+        if index_path and os.path.exists(index_path):
+            indexes[project] = TestImpactIndex.load(index_path)
+            continue
+        if symbol_index is not None:
+            indexes[project] = TestImpactIndex.from_symbol_index(symbol_index, project)
+        else:
+            project_path = os.path.join(args.repo_root, project)
+            _, funcs, _ = parse_project(args.lan, project_path, args.workers, args.cache_dir)
+            indexes[project] = TestImpactIndex.from_funcs(funcs, project_path)
+        if index_path:
+            os.makedirs(args.index_dir, exist_ok=True)
+            indexes[project].save(index_path)
+
+    selection = select_dataset_tests(test_df, indexes, args.lan, args.repo_root, args.max_depth)
+    print(f"selected tests of {len(selection)} / {len(test_df)} tasks")
+    with open(args.output, "w") as f:
+        json.dump(selection, f, indent=4)